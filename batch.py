@@ -0,0 +1,246 @@
+from models import CourseFactory, UserFactory, CourseUser, Engine, MapperRegistry
+from bulk import BulkEnroller
+
+OPERATIONS = ('create', 'update', 'delete', 'enrol')
+KINDS = {'category': 'categories', 'course': 'courses', 'user': 'users'}
+UPDATABLE = {
+    'category': ('name', 'parent'),
+    'course': ('name', 'category', 'type', 'address', 'platform'),
+    'user': ('username', 'type'),
+}
+
+
+class BatchError(ValueError):
+
+    def __init__(self, index: int, message: str):
+        super().__init__(message)
+        self.index = index
+
+
+class Reference:
+
+    def __init__(self, id_):
+        self.id = id_
+
+
+class PendingCourseUser(CourseUser):
+
+    def __init__(self, course, user, notification_method='email'):
+        self.course = course
+        self.user = user
+        self.notification_method = notification_method
+
+    @property
+    def course_id(self):
+        return self.course.id
+
+    @property
+    def user_id(self):
+        return self.user.id
+
+
+class BatchExecutor:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.refs = {}
+        self.existing = {kind: set() for kind in KINDS}
+        self.loaded = {kind: {} for kind in KINDS}
+        self.deleted = set()
+
+    @staticmethod
+    def get_operation(index: int, operation) -> str:
+        if not isinstance(operation, dict):
+            raise BatchError(index, 'operation must be an object')
+        op = operation.get('op')
+        if op not in OPERATIONS:
+            raise BatchError(index, f'op must be one of {", ".join(OPERATIONS)}')
+        if op != 'enrol' and operation.get('kind') not in KINDS:
+            raise BatchError(index, f'kind must be one of {", ".join(KINDS)}')
+        return op
+
+    @staticmethod
+    def get_references(op: str, operation: dict):
+        if op == 'enrol':
+            yield 'course', operation.get('course')
+            yield 'user', operation.get('user')
+            return
+        kind = operation['kind']
+        if op in ('update', 'delete'):
+            yield kind, operation.get('id')
+        if kind == 'category' and operation.get('parent') is not None:
+            yield 'category', operation['parent']
+        elif kind == 'course' and 'category' in operation:
+            yield 'category', operation['category']
+
+    def check_references(self, operations: list):
+        wanted = {kind: set() for kind in KINDS}
+        for index, operation in enumerate(operations):
+            op = self.get_operation(index, operation)
+            for kind, value in self.get_references(op, operation):
+                if isinstance(value, str) and value.startswith('$'):
+                    continue
+                if not isinstance(value, int) or isinstance(value, bool):
+                    raise BatchError(index, f'{kind} must be an id or a "$ref" to an earlier operation')
+                wanted[kind].add(value)
+            if op in ('update', 'delete'):
+                self.loaded[operation['kind']][operation['id']] = None
+        enroller = BulkEnroller(self.connection)
+        for kind, ids in wanted.items():
+            to_load = [id_ for id_ in ids if id_ in self.loaded[kind]]
+            for obj in MapperRegistry.get_mapper_by_name(kind).find_by_ids(to_load):
+                self.loaded[kind][obj.id] = obj
+            self.existing[kind] = {id_ for id_, obj in self.loaded[kind].items() if obj is not None}
+            self.existing[kind] |= enroller.find_ids(KINDS[kind], sorted(ids - self.existing[kind]))
+
+    def resolve(self, index: int, kind: str, value):
+        if isinstance(value, str):
+            try:
+                ref_kind, obj = self.refs[value[1:]]
+            except KeyError:
+                raise BatchError(index, f'unknown reference {value!r}')
+            if ref_kind != kind:
+                raise BatchError(index, f'{value!r} refers to a {ref_kind}, not a {kind}')
+            return obj
+        if value not in self.existing[kind]:
+            raise BatchError(index, f'{kind} {value} does not exist')
+        if (kind, value) in self.deleted:
+            raise BatchError(index, f'{kind} {value} is deleted earlier in the batch')
+        return self.loaded[kind].get(value) or Reference(value)
+
+    def remember(self, index: int, operation: dict, kind: str, obj):
+        self.refs[str(index)] = (kind, obj)
+        ref = operation.get('ref')
+        if ref is not None:
+            if not isinstance(ref, str) or not ref or ref in self.refs:
+                raise BatchError(index, f'ref {ref!r} must be a unique non-empty string')
+            self.refs[ref] = (kind, obj)
+
+    @staticmethod
+    def get_text(index: int, operation: dict, name: str) -> str:
+        value = operation.get(name)
+        if not isinstance(value, str) or not value:
+            raise BatchError(index, f'{name} is required')
+        return value
+
+    def build_category(self, index: int, operation: dict):
+        parent = operation.get('parent')
+        parent = self.resolve(index, 'category', parent) if parent is not None else None
+        return Engine.create_category(self.get_text(index, operation, 'name'), parent)
+
+    def build_course(self, index: int, operation: dict):
+        type_ = operation.get('type')
+        if type_ not in CourseFactory.types:
+            raise BatchError(index, f'unknown course type {type_!r}')
+        params = [operation.get(slot) or '' for slot in CourseFactory.types_slots[type_]]
+        category = self.resolve(index, 'category', operation.get('category'))
+        return Engine.create_course(type_, *params, self.get_text(index, operation, 'name'), category)
+
+    def build_user(self, index: int, operation: dict):
+        type_ = operation.get('type')
+        if type_ not in UserFactory.types:
+            raise BatchError(index, f'unknown user type {type_!r}')
+        return Engine.create_user(type_, self.get_text(index, operation, 'username'))
+
+    def apply_update(self, index: int, operation: dict, kind: str, obj):
+        unknown = set(operation) - {'op', 'kind', 'id', 'ref', *UPDATABLE[kind]}
+        if unknown:
+            raise BatchError(index, f'cannot update {", ".join(sorted(unknown))} of a {kind}')
+        if kind == 'category':
+            if 'name' in operation:
+                obj.name = self.get_text(index, operation, 'name')
+            if 'parent' in operation:
+                parent = operation['parent']
+                obj.category = self.resolve(index, 'category', parent) if parent is not None else None
+        elif kind == 'course':
+            if 'name' in operation:
+                obj.name = self.get_text(index, operation, 'name')
+            if 'category' in operation:
+                obj.category = self.resolve(index, 'category', operation['category'])
+            type_ = operation.get('type', obj.type_)
+            if type_ not in CourseFactory.types:
+                raise BatchError(index, f'unknown course type {type_!r}')
+            obj.type_ = type_
+            for slot_type, slots in CourseFactory.types_slots.items():
+                for slot in slots:
+                    if slot_type != type_:
+                        setattr(obj, slot, None)
+                    elif slot in operation:
+                        setattr(obj, slot, operation[slot] or '')
+            MapperRegistry.get_mapper_by_name('course').attach_observers(obj)
+        else:
+            if 'username' in operation:
+                obj.username = self.get_text(index, operation, 'username')
+            if operation.get('type', obj.type_) not in UserFactory.types:
+                raise BatchError(index, f'unknown user type {operation["type"]!r}')
+            obj.type_ = operation.get('type', obj.type_)
+
+    def build_enrolment(self, index: int, operation: dict, pairs: set):
+        notification_method = operation.get('notification_method') or 'email'
+        if notification_method not in CourseUser.notification_methods:
+            raise BatchError(index, f'unknown notification method {notification_method!r}')
+        course = self.resolve(index, 'course', operation.get('course'))
+        user = self.resolve(index, 'user', operation.get('user'))
+        key = tuple(value if isinstance(value, int) else id(obj)
+                    for value, obj in ((operation['course'], course), (operation['user'], user)))
+        if key in pairs:
+            raise BatchError(index, 'the same enrolment appears twice in the batch')
+        pairs.add(key)
+        return PendingCourseUser(course, user, notification_method)
+
+    def plan(self, operations: list) -> list:
+        self.check_references(operations)
+        existing_pairs = self.find_existing_pairs(operations)
+        pairs = set()
+        plan = []
+        for index, operation in enumerate(operations):
+            op = operation['op']
+            if op == 'create':
+                kind = operation['kind']
+                obj = getattr(self, f'build_{kind}')(index, operation)
+                self.remember(index, operation, kind, obj)
+                plan.append((obj.mark_new, obj))
+            elif op == 'update':
+                kind = operation['kind']
+                obj = self.resolve(index, kind, operation['id'])
+                self.apply_update(index, operation, kind, obj)
+                self.remember(index, operation, kind, obj)
+                plan.append((obj.mark_dirty, obj))
+            elif op == 'delete':
+                kind = operation['kind']
+                obj = self.resolve(index, kind, operation['id'])
+                self.remember(index, operation, kind, obj)
+                self.deleted.add((kind, operation['id']))
+                plan.append((obj.mark_removed, obj))
+            else:
+                enrolment = self.build_enrolment(index, operation, pairs)
+                if (operation['course'], operation['user']) in existing_pairs:
+                    plan.append((None, enrolment))
+                else:
+                    plan.append((enrolment.mark_new, enrolment))
+        return plan
+
+    def find_existing_pairs(self, operations: list) -> set:
+        course_ids = [i['course'] for i in operations if i['op'] == 'enrol' and isinstance(i.get('course'), int)]
+        user_ids = [i['user'] for i in operations if i['op'] == 'enrol' and isinstance(i.get('user'), int)]
+        if not course_ids or not user_ids:
+            return set()
+        return MapperRegistry.get_mapper_by_name('course_user').find_pairs(sorted(set(course_ids)),
+                                                                           sorted(set(user_ids)))
+
+    @staticmethod
+    def apply(plan: list):
+        for mark, _ in plan:
+            if mark is not None:
+                mark()
+
+    def get_results(self, plan: list) -> dict:
+        results = []
+        for mark, obj in plan:
+            if isinstance(obj, CourseUser):
+                results.append({'course_id': obj.course_id, 'user_id': obj.user_id,
+                                'status': 'exists' if mark is None or obj.inserted is False else 'enrolled'})
+            else:
+                results.append({'id': obj.id})
+        return {'results': results,
+                'refs': {name: obj.id for name, (_, obj) in self.refs.items() if not name.isdigit()}}
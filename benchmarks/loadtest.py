@@ -0,0 +1,236 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlencode
+
+
+class HttpClient:
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = self.writer = None
+
+    async def request(self, method: str, path: str, data: dict = None):
+        for attempt in range(2):
+            if not self.writer:
+                await self.connect()
+            try:
+                return await asyncio.wait_for(self._request(method, path, data), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                await self.close()
+                if attempt:
+                    raise
+
+    async def _request(self, method: str, path: str, data: dict = None):
+        body = urlencode(data).encode('utf-8') if data else b''
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nConnection: keep-alive\r\n' \
+               f'Content-Length: {len(body)}\r\n'
+        if body:
+            head += 'Content-Type: application/x-www-form-urlencoded\r\n'
+        self.writer.write(head.encode('latin-1') + b'\r\n' + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readuntil(b'\r\n')
+        version, status = status_line.decode('latin-1').split(' ', 2)[:2]
+        headers = {}
+        while True:
+            line = await self.reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            payload = bytearray()
+            while True:
+                size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+                if not size:
+                    await self.reader.readuntil(b'\r\n')
+                    break
+                payload += await self.reader.readexactly(size + 2)
+                del payload[-2:]
+            payload = bytes(payload)
+        elif 'content-length' in headers:
+            payload = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            payload = await self.reader.read()
+            await self.close()
+            return int(status), payload
+
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        if not keep_alive:
+            await self.close()
+        return int(status), payload
+
+
+def parse_range(value: str) -> range:
+    start, _, end = value.partition('-')
+    return range(int(start), int(end or start) + 1)
+
+
+class Scenarios:
+
+    def __init__(self, args):
+        self.courses = parse_range(args.course_ids)
+        self.users = parse_range(args.user_ids)
+        self.categories = parse_range(args.category_ids)
+
+    def browse(self, rnd: random.Random):
+        yield 'GET', '/', None
+        yield 'GET', '/api/courses', None
+
+    def edit(self, rnd: random.Random):
+        course_id = rnd.choice(self.courses)
+        yield 'GET', f'/courses/edit/?course_id={course_id}', None
+        yield 'POST', '/courses/edit/', {'course_id': course_id, 'name': f'course {course_id}', 'type': 'online',
+                                         'platform': f'platform {rnd.randint(0, 9)}',
+                                         'category_id': rnd.choice(self.categories)}
+
+    def enrol(self, rnd: random.Random):
+        user_id = rnd.choice(self.users)
+        yield 'GET', f'/users/courses/?user_id={user_id}', None
+        yield 'POST', '/users/courses/', {'user_id': user_id, 'course_id': rnd.choice(self.courses),
+                                          'notification_method': 'email'}
+
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(','):
+        name, _, weight = item.partition(':')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def percentile(samples: list, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+async def scrape_busy(host: str, port: int, timeout: float):
+    client = HttpClient(host, port, timeout)
+    try:
+        status, body = await client.request('GET', '/metrics')
+    except (OSError, asyncio.TimeoutError):
+        return None
+    finally:
+        await client.close()
+    if status != 200:
+        return None
+    total = 0
+    for line in body.decode('utf-8').splitlines():
+        if line.startswith('db_busy_total'):
+            total += float(line.rsplit(' ', 1)[1])
+    return total
+
+
+async def worker(number: int, args, scenarios: Scenarios, mix: dict, deadline: float, stats: dict):
+    rnd = random.Random(args.seed + number)
+    client = HttpClient(args.host, args.port, args.timeout)
+    names, weights = list(mix), list(mix.values())
+    try:
+        while time.perf_counter() < deadline:
+            scenario = rnd.choices(names, weights)[0]
+            for method, path, data in getattr(scenarios, scenario)(rnd):
+                start = time.perf_counter()
+                try:
+                    status, _ = await client.request(method, path, data)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                    await client.close()
+                    status = 0
+                stats['latencies'].append(time.perf_counter() - start)
+                if not 200 <= status < 400:
+                    stats['errors'] += 1
+                if time.perf_counter() >= deadline:
+                    break
+    finally:
+        await client.close()
+
+
+async def run_level(args, concurrency: int, scenarios: Scenarios, mix: dict) -> dict:
+    busy_before = await scrape_busy(args.host, args.port, args.timeout)
+    stats = {'latencies': [], 'errors': 0}
+    start = time.perf_counter()
+    deadline = start + args.duration
+    await asyncio.gather(*(worker(i, args, scenarios, mix, deadline, stats) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    busy_after = await scrape_busy(args.host, args.port, args.timeout)
+
+    latencies = sorted(stats['latencies'])
+    requests = len(latencies)
+    return {
+        'concurrency': concurrency,
+        'requests': requests,
+        'throughput_rps': requests / elapsed if elapsed else 0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'error_rate': stats['errors'] / requests if requests else 0,
+        'sqlite_busy': None if busy_before is None or busy_after is None else busy_after - busy_before,
+    }
+
+
+def print_report(levels: list):
+    print(f'{"conc":>6}{"requests":>10}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>9}{"busy":>7}')
+    for level in levels:
+        busy = '-' if level['sqlite_busy'] is None else f'{level["sqlite_busy"]:.0f}'
+        print(f'{level["concurrency"]:>6}{level["requests"]:>10}{level["throughput_rps"]:>10.1f}'
+              f'{level["p50_ms"]:>10.2f}{level["p95_ms"]:>10.2f}{level["p99_ms"]:>10.2f}'
+              f'{level["error_rate"] * 100:>8.2f}%{busy:>7}')
+
+
+async def run(args) -> list:
+    scenarios = Scenarios(args)
+    mix = parse_mix(args.mix)
+    for name in mix:
+        if not hasattr(scenarios, name):
+            raise SystemExit(f'unknown scenario: {name}')
+    levels = []
+    for concurrency in [int(i) for i in args.concurrency.split(',')]:
+        levels.append(await run_level(args, concurrency, scenarios, mix))
+    return levels
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load test a running Shogun server on localhost')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--mix', default='browse:3,edit:1,enrol:1', help='scenario weights, e.g. browse:3,edit:1')
+    parser.add_argument('--concurrency', default='1,4,16', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per concurrency level')
+    parser.add_argument('--timeout', type=float, default=30, help='per request timeout in seconds')
+    parser.add_argument('--course-ids', default='1-10')
+    parser.add_argument('--user-ids', default='1-10')
+    parser.add_argument('--category-ids', default='1-3')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the report as JSON to this path')
+    args = parser.parse_args(argv)
+
+    levels = asyncio.run(run(args))
+    print_report(levels)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'levels': levels}, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
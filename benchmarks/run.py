@@ -0,0 +1,358 @@
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import platform
+import tempfile
+import itertools
+import statistics
+import contextlib
+import tracemalloc
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+from benchmarks.seed import seed, add_arguments  # noqa: E402
+
+
+def load_app():
+    import settings
+    from shogun.main import Shogun
+    from shogun.middleware import middlewares
+    from db.unit_of_work import UnitOfWorkMiddleware
+    from urls import urls
+    os.makedirs(os.path.join(settings.BASE_DIR, settings.LOGS_DIR_NAME), exist_ok=True)
+    settings_dict = {name: getattr(settings, name) for name in dir(settings) if name.isupper()}
+    if settings.CATALOG_ENABLED:
+        from catalog import Catalog
+        from models import connect
+        Catalog.start(connect)
+    return Shogun(urls=urls, settings=settings_dict, middlewares=[*middlewares, UnitOfWorkMiddleware])
+
+
+def make_environ(method: str, path: str, query: str = '', data: dict = None) -> dict:
+    body = urlencode(data).encode('utf-8') if data else b''
+    return {
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_HOST': 'localhost:8000',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8000',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(body),
+    }
+
+
+def call(app, method: str, path: str, query: str = '', data: dict = None) -> bytes:
+    status = []
+
+    def start_response(status_code, headers, exc_info=None):
+        status.append(status_code)
+
+    body = b''.join(app(make_environ(method, path, query, data), start_response))
+    if not status[0].startswith('200'):
+        raise Exception(f'{method} {path}?{query} returned {status[0]}')
+    return body
+
+
+def measure(fn, repeat: int, warmup: int, inner: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(inner):
+            fn()
+        samples.append((time.perf_counter() - start) / inner)
+    samples.sort()
+    return {
+        'median_ms': statistics.median(samples) * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'min_ms': samples[0] * 1000,
+        'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+        'runs': repeat,
+    }
+
+
+def page_sizes(app, method: str, path: str, query: str) -> dict:
+    from shogun.cache import fragment_cache
+    minify = app.settings.get('TEMPLATE_MINIFY', False)
+    sizes = {}
+    try:
+        for name, value in (('raw_bytes', False), ('minified_bytes', True)):
+            app.settings['TEMPLATE_MINIFY'] = value
+            fragment_cache.clear()
+            sizes[name] = len(call(app, method, path, query))
+    finally:
+        app.settings['TEMPLATE_MINIFY'] = minify
+        fragment_cache.clear()
+    saved = sizes['raw_bytes'] - sizes['minified_bytes']
+    return {'bytes': sizes['minified_bytes' if minify else 'raw_bytes'], **sizes, 'bytes_saved': saved,
+            'bytes_saved_pct': round(saved / sizes['raw_bytes'] * 100, 1) if sizes['raw_bytes'] else 0.0}
+
+
+def wsgi_benchmarks(app, ids: dict):
+    course_id, category_id, user_id = ids['course'], ids['category'], ids['user']
+    reads = {
+        'wsgi.index': ('GET', '/', ''),
+        'wsgi.api_courses': ('GET', '/api/courses', ''),
+        'wsgi.course_edit_form': ('GET', '/courses/edit/', f'course_id={course_id}'),
+        'wsgi.category_edit_form': ('GET', '/categories/edit/', f'category_id={category_id}'),
+        'wsgi.user_edit_form': ('GET', '/users/edit/', f'user_id={user_id}'),
+        'wsgi.user_courses_form': ('GET', '/users/courses/', f'user_id={user_id}'),
+    }
+    writes = {
+        'wsgi.category_create': ('POST', '/categories/create/', '',
+                                 {'name': 'bench category', 'parent_category_id': category_id}),
+        'wsgi.course_create': ('POST', '/courses/create/', '',
+                               {'name': 'bench course', 'type': 'online', 'platform': 'bench',
+                                'category_id': category_id}),
+        'wsgi.course_edit': ('POST', '/courses/edit/', '',
+                             {'course_id': course_id, 'name': 'bench course', 'type': 'offline',
+                              'address': 'bench street', 'category_id': category_id}),
+        'wsgi.user_create': ('POST', '/users/create/', '', {'username': 'bench user', 'type': 'student'}),
+        'wsgi.user_edit': ('POST', '/users/edit/', '', {'user_id': user_id, 'username': 'bench user',
+                                                        'type': 'student'}),
+    }
+    for name, (method, path, query) in reads.items():
+        yield name, (lambda m=method, p=path, q=query: call(app, m, p, q)), page_sizes(app, method, path, query)
+    for name, (method, path, query, data) in writes.items():
+        yield name, (lambda m=method, p=path, q=query, d=data: call(app, m, p, q, d)), {}
+
+
+def micro_benchmarks(app, ids: dict):
+    from shogun.request import Request
+    from shogun.template_engine import Engine
+    from models import MapperRegistry
+    import views
+
+    settings = app.settings
+    engine = Engine(settings['BASE_DIR'], settings['TEMPLATES_DIR_NAME'], settings['INCLUDES_DIR_NAME'])
+    minified_engine = Engine(settings['BASE_DIR'], settings['TEMPLATES_DIR_NAME'], settings['INCLUDES_DIR_NAME'],
+                             minify=True)
+    category_mapper = MapperRegistry.get_mapper_by_name('category')
+    course_mapper = MapperRegistry.get_mapper_by_name('course')
+    user_mapper = MapperRegistry.get_mapper_by_name('user')
+
+    index_context = {'categories': category_mapper.list_rows(), 'courses': course_mapper.list_rows(),
+                     'students': user_mapper.list_rows('student'),
+                     'teachers': user_mapper.list_rows('teacher'),
+                     'admins': user_mapper.list_rows('admin'),
+                     'base_url': 'http://localhost:8000/', 'session_id': ''}
+    edit_context = {'course': course_mapper.find_by_id(ids['course']), 'categories': index_context['categories'],
+                    'types': views.engine.get_courses_types(), 'base_url': 'http://localhost:8000/',
+                    'session_id': ''}
+    paths = ['/', '/categories/edit/', '/courses/copy/', '/users/courses/', '/api/courses']
+
+    def find_views():
+        for path in paths:
+            app.find_view(path)
+
+    def parse_request():
+        environ = make_environ('POST', '/courses/edit/', f'course_id={ids["course"]}',
+                               {'course_id': ids['course'], 'name': 'bench', 'type': 'offline',
+                                'address': 'street', 'category_id': ids['category']})
+        Request(environ, settings)
+
+    yield 'engine.build.index', lambda: engine.build(index_context, 'index.html'), {}
+    yield 'engine.build.edit_course', lambda: engine.build(edit_context, 'edit_course.html'), {}
+    yield 'engine.build.index.minified', lambda: minified_engine.build(index_context, 'index.html'), {}
+    yield 'engine.build.edit_course.minified', lambda: minified_engine.build(edit_context, 'edit_course.html'), {}
+    yield 'shogun.find_view', find_views, {'inner': 1000}
+    yield 'request.parse', parse_request, {'inner': 1000}
+    yield 'mapper.category.all', category_mapper.all, {}
+    yield 'mapper.category.find_by_id', lambda: category_mapper.find_by_id(ids['category']), {'inner': 100}
+    yield 'mapper.course.all', course_mapper.all, {}
+    yield 'mapper.course.find_by_id', lambda: course_mapper.find_by_id(ids['course']), {'inner': 100}
+    yield 'mapper.user.all', user_mapper.all, {}
+    yield 'mapper.user.find_by_id', lambda: user_mapper.find_by_id(ids['user']), {'inner': 100}
+    yield 'mapper.user.find_by_type', lambda: user_mapper.find_by_type('teacher'), {}
+    yield 'mapper.category.list_rows', category_mapper.list_rows, {}
+    yield 'mapper.course.list_rows', course_mapper.list_rows, {}
+    yield 'mapper.user.list_rows', lambda: user_mapper.list_rows('teacher'), {}
+
+    from catalog import Catalog
+    from models import connect
+    catalog = Catalog()
+    catalog.load(connect)
+    yield 'catalog.load', lambda: catalog.load(connect), {}
+    yield 'catalog.category_rows', catalog.category_rows, {}
+    yield 'catalog.course_rows', catalog.course_rows, {}
+    yield 'catalog.course.find', lambda: catalog.find('course', ids['course']), {'inner': 100}
+
+    from stats import Columns, EnrolmentStats
+    from models import TimedCursor
+    enrolment_stats = EnrolmentStats()
+
+    def compute_stats():
+        enrolment_stats.invalidate()
+        enrolment_stats.get_report(connect)
+
+    yield 'stats.columns', lambda: Columns(TimedCursor(connect, 'Columns')), {}
+    yield 'stats.report', compute_stats, {}
+
+    from shogun.cache import FragmentCache, SharedCache
+    fragment = engine.build(edit_context, 'edit_course.html')[:8192]
+    memory_cache = FragmentCache()
+    shared_cache = SharedCache(os.path.join(tempfile.mkdtemp(), 'shared.cache'))
+    for cache in (memory_cache, shared_cache):
+        cache.set('bench', ('key', ), fragment, 300, ('courses', ))
+    yield 'cache.memory.get', lambda: memory_cache.get('bench', ('key', )), {'inner': 1000}
+    yield 'cache.shared.get', lambda: shared_cache.get('bench', ('key', )), {'inner': 1000}
+    yield 'cache.shared.set', lambda: shared_cache.set('bench', ('key', ), fragment, 300, ('courses', )), {'inner': 1000}
+    yield 'cache.shared.sync', shared_cache.sync, {'inner': 1000}
+
+
+def measure_memory(build) -> int:
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        objs = build()
+        size = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    del objs
+    return size
+
+
+def memory_benchmarks(rows: int = 100000):
+    from models import MapperRegistry, CourseRow, UserRow
+
+    course_mapper = MapperRegistry.get_mapper_by_name('course')
+    user_mapper = MapperRegistry.get_mapper_by_name('user')
+    course_mapper.cursor.execute('SELECT c.id, c.name, c.type, c.category_id, cat.name, c.address, c.platform, '
+                                 'c.student_count FROM courses c JOIN categories cat ON cat.id = c.category_id')
+    course_rows = list(itertools.islice(itertools.cycle(course_mapper.cursor.fetchall()), rows))
+    user_mapper.cursor.execute('SELECT id, username, type, course_count FROM users')
+    user_rows = list(itertools.islice(itertools.cycle(user_mapper.cursor.fetchall()), rows))
+
+    def construct_courses():
+        return [course_mapper.construct(id_, name, category_id, type_, address, platform, student_count)
+                for id_, name, type_, category_id, category_name, address, platform, student_count in course_rows]
+
+    def construct_users():
+        return [user_mapper.construct(id_, username, type_, course_count)
+                for id_, username, type_, course_count in user_rows]
+
+    suite = {
+        'memory.course.construct': construct_courses,
+        'memory.course.row': lambda: list(map(CourseRow._make, course_rows)),
+        'memory.user.construct': construct_users,
+        'memory.user.row': lambda: list(map(UserRow._make, user_rows)),
+    }
+    for name, build in suite.items():
+        yield name, build, {'rows': rows, 'kb_per_100k_rows': round(measure_memory(build) / rows * 100000 / 1024, 1)}
+
+
+def pick_ids(db_path: str) -> dict:
+    connection = sqlite3.connect(db_path)
+    ids = {
+        'course': connection.execute('SELECT MIN(id) FROM courses').fetchone()[0],
+        'category': connection.execute('SELECT MAX(id) FROM categories').fetchone()[0],
+        'user': connection.execute('SELECT user_id FROM course_user GROUP BY user_id '
+                                   'ORDER BY COUNT(*) DESC LIMIT 1').fetchone()[0],
+    }
+    connection.close()
+    return ids
+
+
+def run(args) -> dict:
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='shogun_bench_'), 'bench.sqlite')
+    os.environ['SHOGUN_DB_PATH'] = db_path
+    dataset = seed(db_path, args.courses, args.users, args.depth, args.branching, args.enrolments, args.seed)
+    app = load_app()
+    ids = pick_ids(db_path)
+
+    results = {}
+    suites = [] if args.skip_wsgi else [wsgi_benchmarks(app, ids)]
+    suites += [] if args.skip_micro else [micro_benchmarks(app, ids)]
+    suites += [] if args.skip_memory else [memory_benchmarks()]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for suite in suites:
+            for name, fn, extra in suite:
+                if args.only and args.only not in name:
+                    continue
+                inner = extra.pop('inner', 1)
+                results[name] = {**measure(fn, args.repeat, args.warmup, inner), **extra}
+                print(name, file=sys.stderr)
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'dataset': dataset,
+        },
+        'results': results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    print(f'{"benchmark":<32}{"baseline ms":>14}{"current ms":>14}{"change":>10}')
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if not base:
+            print(f'{name:<32}{"-":>14}{result["median_ms"]:>14.3f}{"new":>10}')
+            continue
+        ratio = result['median_ms'] / base['median_ms'] if base['median_ms'] else 1
+        flag = ' REGRESSION' if ratio > 1 + threshold else ''
+        print(f'{name:<32}{base["median_ms"]:>14.3f}{result["median_ms"]:>14.3f}{(ratio - 1) * 100:>+9.1f}%{flag}')
+        if 'bytes' in result and 'bytes' in base:
+            print(f'{"  response bytes":<32}{base["bytes"]:>14}{result["bytes"]:>14}')
+        if 'kb_per_100k_rows' in result and 'kb_per_100k_rows' in base:
+            print(f'{"  memory kb/100k rows":<32}{base["kb_per_100k_rows"]:>14.1f}{result["kb_per_100k_rows"]:>14.1f}')
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the Shogun benchmark suite (python -m benchmarks.run)')
+    add_arguments(parser)
+    parser.add_argument('--db', help='path of the seeded database (a temporary file by default)')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--only', help='run only benchmarks whose name contains this string')
+    parser.add_argument('--skip-wsgi', action='store_true')
+    parser.add_argument('--skip-micro', action='store_true')
+    parser.add_argument('--skip-memory', action='store_true')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    parser.add_argument('--input', help='compare previously saved results instead of running')
+    parser.add_argument('--compare', help='baseline results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed slowdown ratio before flagging')
+    args = parser.parse_args(argv)
+
+    if args.input:
+        with open(args.input) as f:
+            current = json.load(f)
+    else:
+        current = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    if not args.compare:
+        print(json.dumps(current, indent=2))
+        return 0
+
+    with open(args.compare) as f:
+        baseline = json.load(f)
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f'{len(regressions)} regression(s): {", ".join(regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import os
+import sys
+import random
+import sqlite3
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BASE_DIR not in sys.path:
+    sys.path.insert(0, BASE_DIR)
+
+COURSE_TYPES = ('offline', 'online')
+USER_TYPES = ('student', 'student', 'student', 'student', 'teacher', 'admin')
+
+
+def seed_categories(cursor, depth: int, branching: int):
+    ids = []
+    level = [None]
+    for d in range(depth):
+        next_level = []
+        for parent in level:
+            for _ in range(branching):
+                cursor.execute('INSERT INTO categories (name, category_id) VALUES (?, ?)',
+                               (f'category {d}.{len(ids)}', parent))
+                ids.append(cursor.lastrowid)
+                next_level.append(cursor.lastrowid)
+        level = next_level
+    return ids
+
+
+def seed(path: str, courses: int = 1000, users: int = 1000, depth: int = 4, branching: int = 3,
+         enrolments: int = 5, seed_value: int = 42):
+    from db.create import create_schema
+    if os.path.exists(path):
+        os.remove(path)
+    rnd = random.Random(seed_value)
+    connection = sqlite3.connect(path)
+    create_schema(connection)
+    cursor = connection.cursor()
+    category_ids = seed_categories(cursor, depth, branching)
+
+    rows = []
+    for i in range(courses):
+        type_ = rnd.choice(COURSE_TYPES)
+        rows.append((f'course {i}', rnd.choice(category_ids), type_,
+                     f'street {i}' if type_ == 'offline' else None,
+                     f'platform {i % 7}' if type_ == 'online' else None))
+    cursor.executemany('INSERT INTO courses (name, category_id, type, address, platform) VALUES (?, ?, ?, ?, ?)', rows)
+
+    cursor.executemany('INSERT INTO users (username, type) VALUES (?, ?)',
+                       [(f'user {i}', rnd.choice(USER_TYPES)) for i in range(users)])
+
+    pairs = set()
+    if courses:
+        for user_id in range(1, users + 1):
+            for _ in range(rnd.randint(0, enrolments * 2)):
+                pairs.add((rnd.randint(1, courses), user_id))
+    cursor.executemany('INSERT INTO course_user (course_id, user_id) VALUES (?, ?)', sorted(pairs))
+
+    connection.commit()
+    connection.close()
+    return {'courses': courses, 'users': users, 'categories': len(category_ids), 'category_depth': depth,
+            'enrolments': len(pairs), 'seed': seed_value}
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--courses', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--depth', type=int, default=4, help='depth of the category tree')
+    parser.add_argument('--branching', type=int, default=3, help='subcategories per category')
+    parser.add_argument('--enrolments', type=int, default=5, help='average courses per user')
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Seed an SQLite database with synthetic data')
+    parser.add_argument('path')
+    add_arguments(parser)
+    args = parser.parse_args(argv)
+    print(seed(args.path, args.courses, args.users, args.depth, args.branching, args.enrolments, args.seed))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import io
+import sys
+import csv
+import json
+import argparse
+from time import perf_counter
+from settings import BULK_CHUNK_SIZE
+from models import connect, Category, CourseFactory, UserFactory, CourseUser, Engine, MapperRegistry
+from models import chunked, placeholders
+from db.unit_of_work import UnitOfWork
+from db.writer import run_in_transaction
+
+
+FORMATS = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson; charset=utf-8'}
+COLUMNS = {
+    'courses': ('id', 'name', 'category_id', 'type', 'address', 'platform'),
+    'users': ('id', 'username', 'type'),
+    'enrolments': ('course_id', 'user_id', 'notification_method'),
+}
+MAPPERS = {'courses': 'course', 'users': 'user', 'enrolments': 'course_user'}
+READ_SIZE = 64 * 1024
+MAX_ERROR_SAMPLES = 100
+
+
+def iter_lines(stream, length: int = None):
+    remaining = length
+    tail = b''
+    while remaining is None or remaining > 0:
+        chunk = stream.read(READ_SIZE if remaining is None else min(READ_SIZE, remaining))
+        if not chunk:
+            break
+        if remaining is not None:
+            remaining -= len(chunk)
+        lines = (tail + chunk).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            yield line.decode('utf-8') + '\n'
+    if tail:
+        yield tail.decode('utf-8')
+
+
+def iter_records(lines, format_: str):
+    if format_ == 'csv':
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        for number, row in enumerate(reader, 2):
+            yield number, dict(zip(header, row))
+    elif format_ == 'ndjson':
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                yield number, json.loads(line)
+    else:
+        raise ValueError(f'unknown format {format_}')
+
+
+def guess_format(name: str, default: str = 'csv') -> str:
+    for format_, content_type in FORMATS.items():
+        if name.endswith(f'.{format_}') or name.startswith(content_type.split(';')[0]):
+            return format_
+    return default
+
+
+class BulkImporter:
+
+    def __init__(self, connection, chunk_size: int = BULK_CHUNK_SIZE):
+        self.connection = connection
+        self.chunk_size = chunk_size
+        self.categories = {}
+        self.course_ids = None
+        self.user_ids = None
+
+    def load_ids(self, table_name: str) -> set:
+        return {row[0] for row in self.connection.execute(f'SELECT id FROM {table_name}')}
+
+    def get_category(self, category_id: int) -> Category:
+        if not self.categories:
+            for id_, in self.connection.execute('SELECT id FROM categories'):
+                category = Category('')
+                category.id = id_
+                self.categories[id_] = category
+        try:
+            return self.categories[category_id]
+        except KeyError:
+            raise ValueError(f'category {category_id} does not exist')
+
+    def build_course(self, row: dict):
+        type_ = row.get('type')
+        if type_ not in CourseFactory.types:
+            raise ValueError(f'unknown course type {type_!r}')
+        if not row.get('name'):
+            raise ValueError('name is required')
+        category = self.get_category(int(row.get('category_id')))
+        params = [row.get(slot) or '' for slot in CourseFactory.types_slots[type_]]
+        return Engine.create_course(type_, *params, row['name'], category)
+
+    def build_user(self, row: dict):
+        type_ = row.get('type')
+        if type_ not in UserFactory.types:
+            raise ValueError(f'unknown user type {type_!r}')
+        if not row.get('username'):
+            raise ValueError('username is required')
+        return Engine.create_user(type_, row['username'])
+
+    def build_enrolment(self, row: dict):
+        if self.course_ids is None:
+            self.course_ids = self.load_ids('courses')
+            self.user_ids = self.load_ids('users')
+        course_id, user_id = int(row.get('course_id')), int(row.get('user_id'))
+        if course_id not in self.course_ids:
+            raise ValueError(f'course {course_id} does not exist')
+        if user_id not in self.user_ids:
+            raise ValueError(f'user {user_id} does not exist')
+        notification_method = row.get('notification_method') or 'email'
+        if notification_method not in CourseUser.notification_methods:
+            raise ValueError(f'unknown notification method {notification_method!r}')
+        return Engine.create_course_user(course_id, user_id, notification_method)
+
+    def flush(self, entity: str, objs: list) -> int:
+        mapper_type = MapperRegistry.mappers[MAPPERS[entity]][1]
+        inserted = run_in_transaction(self.connection, lambda connection: mapper_type(connection).insert_many(
+            objs, ignore=entity == 'enrolments'))
+        UnitOfWork.publish([('insert', mapper_type.table_name, obj) for obj in objs])
+        return inserted
+
+    def import_records(self, entity: str, records):
+        build = {'courses': self.build_course, 'users': self.build_user, 'enrolments': self.build_enrolment}[entity]
+        start = perf_counter()
+        progress = {'entity': entity, 'processed': 0, 'inserted': 0, 'errors': 0}
+        error_samples = []
+        chunk = []
+        for number, row in records:
+            progress['processed'] += 1
+            try:
+                chunk.append(build(row))
+            except (ValueError, TypeError, KeyError) as e:
+                progress['errors'] += 1
+                if len(error_samples) < MAX_ERROR_SAMPLES:
+                    error_samples.append({'line': number, 'error': str(e)})
+            if len(chunk) >= self.chunk_size:
+                progress['inserted'] += self.flush(entity, chunk)
+                chunk = []
+                yield {**progress, 'elapsed': round(perf_counter() - start, 3)}
+        if chunk:
+            progress['inserted'] += self.flush(entity, chunk)
+        yield {**progress, 'elapsed': round(perf_counter() - start, 3), 'done': True, 'error_samples': error_samples}
+
+
+class BulkEnroller:
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.pending = []
+
+    def find_ids(self, table_name: str, ids: list) -> set:
+        found = set()
+        for chunk in chunked(ids):
+            cursor = self.connection.execute(f'SELECT id FROM {table_name} WHERE id IN ({placeholders(chunk)})', chunk)
+            found.update(row[0] for row in cursor)
+        return found
+
+    def enrol(self, course_ids: list, user_ids: list, notification_method: str = 'email') -> list:
+        course_ids = list(dict.fromkeys(course_ids))
+        user_ids = list(dict.fromkeys(user_ids))
+        mapper = MapperRegistry.get_mapper_by_name('course_user')
+        courses = self.find_ids('courses', course_ids)
+        users = self.find_ids('users', user_ids)
+        existing = mapper.find_pairs(courses, users)
+        results = []
+        new = []
+        for course_id in course_ids:
+            for user_id in user_ids:
+                if course_id not in courses:
+                    status = 'unknown course'
+                elif user_id not in users:
+                    status = 'unknown user'
+                elif (course_id, user_id) in existing:
+                    status = 'exists'
+                else:
+                    status = 'enrolled'
+                    new.append(Engine.create_course_user(course_id, user_id, notification_method))
+                results.append({'course_id': course_id, 'user_id': user_id, 'status': status})
+                if status == 'enrolled':
+                    self.pending.append((results[-1], new[-1]))
+        if not new:
+            return results
+        if UnitOfWork.get_active() is not None:
+            for obj in new:
+                obj.mark_new()
+        else:
+            inserted = run_in_transaction(self.connection,
+                                          lambda connection: type(mapper)(connection).insert_or_ignore(new))
+            UnitOfWork.publish([('insert', mapper.table_name, obj) for obj in inserted])
+            self.settle()
+        return results
+
+    def settle(self):
+        for result, obj in self.pending:
+            if obj.inserted is False:
+                result['status'] = 'exists'
+        self.pending = []
+
+
+def export_rows(connection, entity: str, format_: str):
+    columns = COLUMNS[entity]
+    rows = MapperRegistry.mappers[MAPPERS[entity]][1](connection).iter_rows()
+    if format_ == 'ndjson':
+        for row in rows:
+            yield json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(columns)
+    for number, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if number % 1000 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import and export of courses, users and enrolments')
+    commands = parser.add_subparsers(dest='command', required=True)
+    import_parser = commands.add_parser('import')
+    import_parser.add_argument('entity', choices=COLUMNS)
+    import_parser.add_argument('path', help='CSV or NDJSON file, "-" for stdin')
+    import_parser.add_argument('--format', choices=FORMATS)
+    import_parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    export_parser = commands.add_parser('export')
+    export_parser.add_argument('entity', choices=COLUMNS)
+    export_parser.add_argument('-o', '--output', default='-', help='target file, "-" for stdout')
+    export_parser.add_argument('--format', choices=FORMATS)
+    args = parser.parse_args(argv)
+
+    if args.command == 'import':
+        format_ = args.format or guess_format(args.path)
+        stream = sys.stdin.buffer if args.path == '-' else open(args.path, 'rb')
+        with stream:
+            importer = BulkImporter(connect, args.chunk_size)
+            for progress in importer.import_records(args.entity, iter_records(iter_lines(stream), format_)):
+                print(json.dumps(progress), file=sys.stderr)
+        return 1 if progress['errors'] else 0
+
+    format_ = args.format or guess_format(args.output)
+    target = sys.stdout if args.output == '-' else open(args.output, 'w', newline='', encoding='utf-8')
+    for chunk in export_rows(connect, args.entity, format_):
+        target.write(chunk)
+    if target is not sys.stdout:
+        target.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+import threading
+from time import perf_counter
+from models import MapperRegistry, CategoryRow, CourseRow, UserRow, Logger
+from db.unit_of_work import UnitOfWork
+from shogun.cache import SharedCache
+from shogun.log_writers import FileWriter
+from shogun.metrics import registry
+
+TABLES = {'categories': 'category', 'courses': 'course', 'users': 'user'}
+USER_TYPES = ('student', 'teacher', 'admin')
+
+RECORDS = registry.gauge('catalog_records', 'Rows held by the in-memory catalog', ('kind', ))
+CHANGES_APPLIED = registry.counter('catalog_changes_applied_total', 'Committed changes applied to the catalog',
+                                   ('table', 'operation'))
+RELOADS = registry.counter('catalog_reloads_total', 'Full catalog reloads from the database')
+LOAD_DURATION = registry.histogram('catalog_load_duration_seconds', 'Time spent loading the catalog')
+
+catalog_logger = Logger('catalog logger', FileWriter)
+
+
+class UnknownRecord(LookupError):
+    pass
+
+
+class Catalog:
+
+    current = None
+    indexes = ('records', 'children', 'courses_by_category', 'users_by_type', 'course_users', 'user_courses',
+               'student_counts')
+
+    def __init__(self, connection=None):
+        self.connection = connection
+        self.reload_lock = threading.Lock()
+        self.lock = threading.RLock()
+        self.records = {kind: {} for kind in TABLES.values()}
+        self.children = {}
+        self.courses_by_category = {}
+        self.users_by_type = {}
+        self.course_users = {}
+        self.user_courses = {}
+        self.student_counts = {}
+
+    @classmethod
+    def start(cls, connection):
+        catalog = cls(connection)
+        catalog.load(connection)
+        UnitOfWork.add_listener(catalog.apply, first=True)
+        SharedCache.add_listener(catalog.reload)
+        cls.current = catalog
+        return catalog
+
+    @classmethod
+    def get_current(cls):
+        return cls.current
+
+    def load(self, connection):
+        start = perf_counter()
+        fresh = Catalog()
+        for kind in TABLES.values():
+            mapper_type = MapperRegistry.mappers[kind][1]
+            cursor = connection.execute(f"SELECT {', '.join(mapper_type.row_columns)} FROM {mapper_type.table_name} "
+                                        f"ORDER BY id")
+            for row in cursor:
+                fresh.put(kind, dict(zip(mapper_type.row_columns, row)))
+        for course_id, user_id, method in connection.execute(
+                'SELECT course_id, user_id, notification_method FROM course_user'):
+            fresh.enrol(course_id, user_id, method)
+        with self.lock:
+            for name in self.indexes:
+                setattr(self, name, getattr(fresh, name))
+            self.update_gauges()
+        LOAD_DURATION.observe(perf_counter() - start)
+
+    def reload(self):
+        RELOADS.inc()
+        with self.reload_lock:
+            self.load(self.connection)
+
+    def update_gauges(self):
+        for kind, records in self.records.items():
+            RECORDS.labels(kind).set(len(records))
+        RECORDS.labels('enrolment').set(sum(map(len, self.course_users.values())))
+
+    @staticmethod
+    def move(index: dict, old_key, new_key, id_):
+        if old_key == new_key and id_ in index.get(new_key, ()):
+            return
+        index.get(old_key, set()).discard(id_)
+        index.setdefault(new_key, set()).add(id_)
+
+    def put(self, kind: str, record: dict):
+        id_ = record['id']
+        old = self.records[kind].get(id_, {})
+        self.records[kind][id_] = record
+        if kind == 'category':
+            self.move(self.children, old.get('category_id'), record['category_id'], id_)
+        elif kind == 'course':
+            self.move(self.courses_by_category, old.get('category_id'), record['category_id'], id_)
+        else:
+            self.move(self.users_by_type, old.get('type'), record['type'], id_)
+            if old and old['type'] != record['type']:
+                change = (record['type'] == 'student') - (old['type'] == 'student')
+                for course_id in self.user_courses.get(id_, ()):
+                    self.student_counts[course_id] = self.student_counts.get(course_id, 0) + change
+
+    def remove(self, kind: str, id_):
+        record = self.records[kind].get(id_)
+        if record is None:
+            return
+        if kind == 'category':
+            for child_id in list(self.children.pop(id_, ())):
+                self.remove('category', child_id)
+            for course_id in list(self.courses_by_category.pop(id_, ())):
+                self.remove('course', course_id)
+            self.children.get(record['category_id'], set()).discard(id_)
+        elif kind == 'course':
+            for user_id in list(self.course_users.get(id_, ())):
+                self.unenrol(id_, user_id)
+            self.course_users.pop(id_, None)
+            self.student_counts.pop(id_, None)
+            self.courses_by_category.get(record['category_id'], set()).discard(id_)
+        else:
+            for course_id in list(self.user_courses.get(id_, ())):
+                self.unenrol(course_id, id_)
+            self.user_courses.pop(id_, None)
+            self.users_by_type.get(record['type'], set()).discard(id_)
+        del self.records[kind][id_]
+
+    def enrol(self, course_id, user_id, method: str):
+        users = self.course_users.setdefault(course_id, {})
+        if user_id not in users and self.records['user'][user_id]['type'] == 'student':
+            self.student_counts[course_id] = self.student_counts.get(course_id, 0) + 1
+        users[user_id] = method
+        self.user_courses.setdefault(user_id, set()).add(course_id)
+
+    def unenrol(self, course_id, user_id):
+        if self.course_users.get(course_id, {}).pop(user_id, None) is None:
+            return
+        self.user_courses[user_id].discard(course_id)
+        if self.records['user'][user_id]['type'] == 'student':
+            self.student_counts[course_id] -= 1
+
+    @staticmethod
+    def get_record(kind: str, obj) -> dict:
+        mapper_type = MapperRegistry.mappers[kind][1]
+        return {'id': obj.id, **{field.column: field.dump(obj) for field in mapper_type.saved_fields}}
+
+    def apply(self, changes: list):
+        try:
+            with self.lock:
+                for operation, table_name, obj in changes:
+                    self.apply_change(operation, table_name, obj)
+                    CHANGES_APPLIED.labels(table_name, operation).inc()
+                self.update_gauges()
+        except UnknownRecord as e:
+            catalog_logger.log(f'reloading the catalog: {e}')
+            self.reload()
+
+    def apply_change(self, operation: str, table_name: str, obj):
+        if table_name == 'course_user':
+            if operation == 'delete':
+                self.unenrol(obj.course_id, obj.user_id)
+            elif obj.course_id not in self.records['course']:
+                raise UnknownRecord(f'course {obj.course_id} is not in the catalog')
+            elif obj.user_id not in self.records['user']:
+                raise UnknownRecord(f'user {obj.user_id} is not in the catalog')
+            else:
+                self.enrol(obj.course_id, obj.user_id, obj.notification_method)
+        elif operation == 'delete':
+            self.remove(TABLES[table_name], obj.id)
+        elif getattr(obj, 'id', None) is None:
+            raise UnknownRecord(f'{table_name} row without an id')
+        else:
+            self.put(TABLES[table_name], self.get_record(TABLES[table_name], obj))
+
+    def get_counter(self, kind: str, id_) -> int:
+        if kind == 'category':
+            return len(self.courses_by_category.get(id_, ()))
+        if kind == 'course':
+            return self.student_counts.get(id_, 0)
+        return len(self.user_courses.get(id_, ()))
+
+    def category_rows(self):
+        with self.lock:
+            categories = self.records['category']
+            result = []
+            pending = sorted(self.children.get(None, ()), reverse=True)
+            while pending:
+                record = categories[pending.pop()]
+                parent = categories.get(record['category_id'])
+                result.append(CategoryRow(record['id'], record['name'], record['category_id'],
+                                          parent['name'] if parent else '-', self.get_counter('category', record['id'])))
+                pending += sorted(self.children.get(record['id'], ()), reverse=True)
+            return result
+
+    def course_rows(self):
+        with self.lock:
+            categories = self.records['category']
+            return [CourseRow(i['id'], i['name'], i['type'], i['category_id'], categories[i['category_id']]['name'],
+                              i['address'], i['platform'], self.get_counter('course', i['id']))
+                    for i in self.records['course'].values()]
+
+    def user_rows(self, type_=None):
+        with self.lock:
+            users = self.records['user']
+            ids = users if type_ is None else sorted(self.users_by_type.get(type_, ()))
+            return [UserRow(users[i]['id'], users[i]['username'], users[i]['type'], self.get_counter('user', i))
+                    for i in ids]
+
+    def get_row(self, kind: str, id_):
+        mapper_type = MapperRegistry.mappers[kind][1]
+        record = self.records[kind][id_]
+        return tuple(record[column] if column in record else self.get_counter(kind, id_)
+                     for column in mapper_type.columns)
+
+    def construct(self, kind: str, id_):
+        return MapperRegistry.get_mapper_by_name(kind).construct(*self.get_row(kind, id_))
+
+    def find(self, kind: str, id_):
+        with self.lock:
+            if id_ not in self.records[kind]:
+                raise Exception(f'record with id={id_} not found')
+            obj = self.construct(kind, id_)
+            if kind == 'category':
+                parent_id = self.records['category'][id_]['category_id']
+                obj.category = self.construct('category', parent_id) if parent_id is not None else None
+                obj.courses = sorted(self.courses_by_category.get(id_, ()))
+                obj.subcategories = sorted(self.children.get(id_, ()))
+            elif kind == 'course':
+                obj.category = self.construct('category', self.records['course'][id_]['category_id'])
+                obj.users = {f'{type_}s': [] for type_ in USER_TYPES}
+                for user_id in sorted(self.course_users.get(id_, ())):
+                    obj.users[f'{self.records["user"][user_id]["type"]}s'].append(user_id)
+            else:
+                obj.courses = sorted(self.user_courses.get(id_, ()))
+            return obj
+
+    def verify(self, connection) -> dict:
+        drift = {}
+        expected = {
+            'category': MapperRegistry.mappers['category'][1](connection).list_rows(),
+            'course': MapperRegistry.mappers['course'][1](connection).list_rows(),
+            'user': MapperRegistry.mappers['user'][1](connection).list_rows(),
+        }
+        actual = {'category': self.category_rows(), 'course': self.course_rows(), 'user': self.user_rows()}
+        for kind, rows in expected.items():
+            expected_rows = {row.id: row for row in rows}
+            actual_rows = {row.id: row for row in actual[kind]}
+            different = [(expected_rows.get(id_), actual_rows.get(id_)) for id_ in sorted(expected_rows | actual_rows)
+                         if expected_rows.get(id_) != actual_rows.get(id_)]
+            if different:
+                drift[kind] = different
+        if [row.id for row in expected['category']] != [row.id for row in actual['category']]:
+            drift['category order'] = [row.id for row in actual['category']]
+        with self.lock:
+            enrolments = {(course_id, user_id, method) for course_id, users in self.course_users.items()
+                          for user_id, method in users.items()}
+        stored = set(connection.execute('SELECT course_id, user_id, notification_method FROM course_user'))
+        if enrolments != stored:
+            drift['enrolment'] = {'missing': sorted(stored - enrolments), 'extra': sorted(enrolments - stored)}
+        return drift
+
+
+class CatalogReader:
+
+    def __init__(self, catalog: Catalog, kind: str):
+        self.catalog = catalog
+        self.kind = kind
+
+    def list_rows(self, *args):
+        return getattr(self.catalog, f'{self.kind}_rows')(*args)
+
+    def find_by_id(self, id_):
+        return self.catalog.find(self.kind, id_)
+
+
+def get_reader(kind: str):
+    catalog = Catalog.get_current()
+    if catalog is None:
+        return MapperRegistry.get_mapper_by_name(kind)
+    return CatalogReader(catalog, kind)
+
@@ -0,0 +1,58 @@
+import os
+import sys
+import sqlite3
+import argparse
+from settings import BASE_DIR, DB_PATH
+
+COUNTERS = {
+    ('categories', 'courses_count'): "SELECT count(*) FROM courses WHERE courses.category_id = categories.id",
+    ('courses', 'student_count'): "SELECT count(*) FROM course_user JOIN users ON users.id = course_user.user_id "
+                                  "WHERE course_user.course_id = courses.id AND users.type = 'student'",
+    ('users', 'course_count'): "SELECT count(*) FROM course_user WHERE course_user.user_id = users.id",
+}
+
+
+def check(con, limit: int = 20) -> dict:
+    drift = {}
+    for (table_name, column), expected in COUNTERS.items():
+        statement = f"SELECT id, {column}, expected FROM (SELECT id, {column}, ({expected}) AS expected " \
+                    f"FROM {table_name}) WHERE {column} != expected"
+        rows = con.execute(statement).fetchall()
+        if rows:
+            drift[f'{table_name}.{column}'] = {'rows': len(rows), 'samples': rows[:limit]}
+    return drift
+
+
+def rebuild(con) -> dict:
+    updated = {}
+    with con:
+        for (table_name, column), expected in COUNTERS.items():
+            cursor = con.execute(f"UPDATE {table_name} SET {column} = ({expected}) WHERE {column} != ({expected})")
+            updated[f'{table_name}.{column}'] = cursor.rowcount
+    return updated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check or rebuild the denormalized counter columns')
+    parser.add_argument('command', choices=('check', 'rebuild'))
+    parser.add_argument('--db', default=os.path.join(BASE_DIR, DB_PATH))
+    args = parser.parse_args(argv)
+
+    con = sqlite3.connect(args.db)
+    try:
+        if args.command == 'rebuild':
+            for name, count in rebuild(con).items():
+                print(f'{name}: {count} rows fixed')
+            return 0
+        drift = check(con)
+        for name, info in drift.items():
+            print(f'{name}: {info["rows"]} rows out of sync, e.g. (id, stored, actual) {info["samples"][:5]}')
+        if not drift:
+            print('all counters are consistent')
+        return 1 if drift else 0
+    finally:
+        con.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
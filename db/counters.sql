@@ -0,0 +1,36 @@
+CREATE TRIGGER IF NOT EXISTS courses_counters_insert AFTER INSERT ON courses BEGIN
+    UPDATE categories SET courses_count = courses_count + 1 WHERE id = new.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS courses_counters_delete AFTER DELETE ON courses BEGIN
+    UPDATE categories SET courses_count = courses_count - 1 WHERE id = old.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS courses_counters_update AFTER UPDATE OF category_id ON courses
+WHEN old.category_id IS NOT new.category_id BEGIN
+    UPDATE categories SET courses_count = courses_count - 1 WHERE id = old.category_id;
+    UPDATE categories SET courses_count = courses_count + 1 WHERE id = new.category_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS course_user_counters_insert AFTER INSERT ON course_user BEGIN
+    UPDATE courses SET student_count = student_count + 1
+    WHERE id = new.course_id AND (SELECT type FROM users WHERE id = new.user_id) = 'student';
+    UPDATE users SET course_count = course_count + 1 WHERE id = new.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS course_user_counters_delete AFTER DELETE ON course_user BEGIN
+    UPDATE courses SET student_count = student_count - 1
+    WHERE id = old.course_id AND (SELECT type FROM users WHERE id = old.user_id) = 'student';
+    UPDATE users SET course_count = course_count - 1 WHERE id = old.user_id;
+END;
+
+-- enrolments go before the user row so the type lookup above still finds it
+CREATE TRIGGER IF NOT EXISTS users_counters_delete BEFORE DELETE ON users BEGIN
+    DELETE FROM course_user WHERE user_id = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_counters_update AFTER UPDATE OF type ON users
+WHEN old.type IS NOT new.type BEGIN
+    UPDATE courses SET student_count = student_count + (new.type = 'student') - (old.type = 'student')
+    WHERE id IN (SELECT course_id FROM course_user WHERE user_id = new.id);
+END;
@@ -1,15 +1,22 @@
 import sqlite3
 import os
-from settings import BASE_DIR, DB_PATH
+from settings import BASE_DIR, DB_PATH, DB_DIR_NAME
 
+SCHEMA_FILES = ['create.sql', 'search.sql', 'counters.sql']
 
-def create_db():
-    con = sqlite3.connect(os.path.join(BASE_DIR, DB_PATH))
+
+def create_schema(con):
     cur = con.cursor()
-    with open('create.sql', 'r') as f:
-        text = f.read()
-    cur.executescript(text)
+    for name in SCHEMA_FILES:
+        with open(os.path.join(BASE_DIR, DB_DIR_NAME, name), 'r') as f:
+            text = f.read()
+        cur.executescript(text)
     cur.close()
+
+
+def create_db():
+    con = sqlite3.connect(os.path.join(BASE_DIR, DB_PATH))
+    create_schema(con)
     con.close()
 
 
@@ -6,8 +6,10 @@ CREATE TABLE categories (
     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
     name VARCHAR (32),
     category_id INTEGER DEFAULT NULL,
+    courses_count INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
 );
+CREATE INDEX categories_category_id ON categories (category_id);
 
 DROP TABLE IF EXISTS courses;
 CREATE TABLE courses (
@@ -17,22 +19,28 @@ CREATE TABLE courses (
     type VARCHAR (32),
     address VARCHAR (64) DEFAULT NULL,
     platform VARCHAR (64) DEFAULT NULL,
+    student_count INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (category_id) REFERENCES categories(id) ON DELETE CASCADE
 );
+CREATE INDEX courses_category_id ON courses (category_id);
 
 DROP TABLE IF EXISTS users;
 CREATE TABLE users (
     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
     username VARCHAR (32),
-    type VARCHAR (32)
+    type VARCHAR (32),
+    course_count INTEGER NOT NULL DEFAULT 0
 );
 
 DROP TABLE IF EXISTS course_user;
 CREATE TABLE course_user (
     course_id INTEGER NOT NULL,
     user_id INTEGER NOT NULL,
+    notification_method VARCHAR (8) NOT NULL DEFAULT 'email',
     FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE,
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
+CREATE UNIQUE INDEX course_user_course_id_user_id ON course_user (course_id, user_id);
+CREATE INDEX course_user_user_id ON course_user (user_id);
 
 COMMIT TRANSACTION;
\ No newline at end of file
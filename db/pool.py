@@ -0,0 +1,74 @@
+import os
+import queue
+import sqlite3
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+from shogun.metrics import registry
+
+
+IN_USE = registry.gauge('db_pool_connections_in_use', 'Pooled database connections checked out')
+POOL_WAIT = registry.histogram('db_pool_wait_seconds', 'Time spent waiting for a pooled database connection')
+
+
+class ConnectionPool:
+
+    def __init__(self, path: str, size: int = 16, timeout: float = 5.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        return cls(os.path.join(settings['BASE_DIR'], settings['DB_PATH']), settings.get('DB_POOL_SIZE', 16),
+                   settings.get('DB_POOL_TIMEOUT', 5.0))
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA foreign_keys = on')
+        return connection
+
+    def acquire(self):
+        start = perf_counter()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            connection = self.create() or self.wait()
+        POOL_WAIT.observe(perf_counter() - start)
+        IN_USE.inc()
+        return connection
+
+    def create(self):
+        with self.lock:
+            if self.created >= self.size:
+                return None
+            self.created += 1
+        try:
+            return self.connect()
+        except sqlite3.Error:
+            with self.lock:
+                self.created -= 1
+            raise
+
+    def wait(self):
+        try:
+            return self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise sqlite3.OperationalError(f'no database connection available within {self.timeout}s') from None
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def release(self, connection):
+        if connection.in_transaction:
+            connection.rollback()
+        IN_USE.dec()
+        self.idle.put(connection)
@@ -0,0 +1,59 @@
+CREATE VIRTUAL TABLE IF NOT EXISTS courses_fts USING fts5(
+    name, address, platform,
+    content='courses', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS courses_fts_insert AFTER INSERT ON courses BEGIN
+    INSERT INTO courses_fts (rowid, name, address, platform) VALUES (new.id, new.name, new.address, new.platform);
+END;
+
+CREATE TRIGGER IF NOT EXISTS courses_fts_delete AFTER DELETE ON courses BEGIN
+    INSERT INTO courses_fts (courses_fts, rowid, name, address, platform)
+    VALUES ('delete', old.id, old.name, old.address, old.platform);
+END;
+
+CREATE TRIGGER IF NOT EXISTS courses_fts_update AFTER UPDATE OF name, address, platform ON courses BEGIN
+    INSERT INTO courses_fts (courses_fts, rowid, name, address, platform)
+    VALUES ('delete', old.id, old.name, old.address, old.platform);
+    INSERT INTO courses_fts (rowid, name, address, platform) VALUES (new.id, new.name, new.address, new.platform);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS categories_fts USING fts5(
+    name,
+    content='categories', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS categories_fts_insert AFTER INSERT ON categories BEGIN
+    INSERT INTO categories_fts (rowid, name) VALUES (new.id, new.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS categories_fts_delete AFTER DELETE ON categories BEGIN
+    INSERT INTO categories_fts (categories_fts, rowid, name) VALUES ('delete', old.id, old.name);
+END;
+
+CREATE TRIGGER IF NOT EXISTS categories_fts_update AFTER UPDATE OF name ON categories BEGIN
+    INSERT INTO categories_fts (categories_fts, rowid, name) VALUES ('delete', old.id, old.name);
+    INSERT INTO categories_fts (rowid, name) VALUES (new.id, new.name);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    username,
+    content='users', content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+END;
+
+CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF username ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+    INSERT INTO users_fts (rowid, username) VALUES (new.id, new.username);
+END;
+
+INSERT INTO courses_fts (courses_fts) VALUES ('rebuild');
+INSERT INTO categories_fts (categories_fts) VALUES ('rebuild');
+INSERT INTO users_fts (users_fts) VALUES ('rebuild');
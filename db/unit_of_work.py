@@ -1,15 +1,55 @@
 import threading
+import contextvars
+from time import perf_counter
+from itertools import groupby
+from collections import Counter
+from contextlib import contextmanager
+from shogun.metrics import registry
+from shogun.middleware import BaseMiddleware
+from db.writer import Writer, run_in_transaction
+from db.pool import ConnectionPool
+
+
+OBJECTS_FLUSHED = registry.counter('uow_objects_flushed_total', 'Objects written by unit of work commits', ('operation', ))
+COMMIT_LATENCY = registry.histogram('uow_commit_duration_seconds', 'Unit of work commit latency')
+
+
+class ScopedConnection:
+
+    def __init__(self, pool: ConnectionPool):
+        self.pool = pool
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if self.connection is None:
+                self.connection = self.pool.acquire()
+            return self.connection
+
+    def release(self):
+        with self.lock:
+            connection, self.connection = self.connection, None
+        if connection is not None:
+            self.pool.release(connection)
 
 
 class UnitOfWork:
 
     current = threading.local()
+    scoped_connection = contextvars.ContextVar('scoped_connection', default=None)
+    listeners = []
+    shared = None
 
     def __init__(self):
         self.new_objects = []
         self.dirty_objects = []
         self.removed_objects = []
         self.registry = None
+        self.connection = None
+        self.changes = None
+        self.savepoints = 0
+        self.notifications = []
 
     def set_registry(self, registry):
         self.registry = registry
@@ -23,26 +63,167 @@ class UnitOfWork:
     def register_removed(self, obj):
         self.removed_objects.append(obj)
 
-    def commit(self):
-        self.insert_new()
-        self.update_dirty()
-        self.delete_removed()
+    def begin(self, connection):
+        self.clear()
+        self.notifications = []
+        self.connection = connection
+        self.changes = []
 
-    def insert_new(self):
-        for obj in self.new_objects:
-            self.registry.get_mapper(obj).insert(obj)
-        self.new_objects = []
+    def end(self):
+        try:
+            if self.changes or self.new_objects or self.dirty_objects or self.removed_objects or \
+                    self.connection.in_transaction:
+                self.complete(self.connection, self.changes)
+        finally:
+            self.connection = None
+            self.changes = None
 
-    def update_dirty(self):
-        for obj in self.dirty_objects:
-            self.registry.get_mapper(obj).update(obj)
-        self.dirty_objects = []
+    def rollback(self):
+        self.clear()
+        self.notifications = []
+        if self.connection is not None and self.connection.in_transaction:
+            self.connection.rollback()
+        self.connection = None
+        self.changes = None
+
+    def commit(self, wait: bool = False):
+        if self.changes is None:
+            self.complete(self.registry.get_connection(), [])
+        elif Writer.get_current() is None:
+            try:
+                self.flush(self.connection)
+                self.changes += self.get_changes()
+            finally:
+                self.clear()
+        elif wait:
+            changes, self.changes = self.changes, []
+            self.complete(self.connection, changes)
+
+    def complete(self, connection, changes: list):
+        start = perf_counter()
+        notifications = self.notifications
+        try:
+            run_in_transaction(connection, self.flush)
+            changes = changes + self.get_changes()
+        finally:
+            self.clear()
+            self.notifications = []
+        COMMIT_LATENCY.observe(perf_counter() - start)
+        for operation, count in Counter(i[0] for i in changes).items():
+            OBJECTS_FLUSHED.labels(operation).inc(count)
+        self.publish(changes)
+        self.notify(notifications)
 
-    def delete_removed(self):
-        for obj in self.removed_objects:
-            self.registry.get_mapper(obj).delete(obj)
+    @contextmanager
+    def savepoint(self):
+        immediate = self.changes is not None and Writer.get_current() is None
+        name = f'uow_{self.savepoints}'
+        if immediate:
+            self.commit()
+            if not self.connection.in_transaction:
+                self.connection.execute('BEGIN')
+            self.connection.execute(f'SAVEPOINT {name}')
+        pending = [(objs, len(objs)) for objs in (self.new_objects, self.dirty_objects, self.removed_objects,
+                                                  self.notifications)]
+        changes = len(self.changes) if self.changes is not None else 0
+        self.savepoints += 1
+        try:
+            yield self
+            if immediate:
+                self.commit()
+        except BaseException:
+            if immediate:
+                self.connection.execute(f'ROLLBACK TO {name}')
+                self.connection.execute(f'RELEASE {name}')
+            for objs, count in pending:
+                del objs[count:]
+            if self.changes is not None:
+                del self.changes[changes:]
+            raise
+        else:
+            if immediate:
+                self.connection.execute(f'RELEASE {name}')
+        finally:
+            self.savepoints -= 1
+
+    def clear(self):
+        self.new_objects = []
+        self.dirty_objects = []
         self.removed_objects = []
 
+    def get_changes(self) -> list:
+        changes = []
+        for operation, objs in (('insert', self.new_objects), ('update', self.dirty_objects),
+                                ('delete', self.removed_objects)):
+            for obj in objs:
+                changes.append((operation, self.registry.get_mapper_type(obj).table_name, obj))
+        return changes
+
+    @classmethod
+    def add_listener(cls, listener, first: bool = False):
+        if first:
+            cls.listeners.insert(0, listener)
+        else:
+            cls.listeners.append(listener)
+
+    @classmethod
+    def share(cls, shared):
+        cls.shared = shared
+
+    @classmethod
+    def sync(cls):
+        if cls.shared is not None:
+            cls.shared.sync()
+
+    @classmethod
+    def publish(cls, changes: list):
+        if changes:
+            if cls.shared is not None:
+                cls.shared.bump()
+            for listener in cls.listeners:
+                listener(changes)
+
+    @staticmethod
+    def notify(notifications: list):
+        for obj, changes in notifications:
+            notify = getattr(obj, 'notify', None)
+            if notify is not None:
+                for column, old, new in changes:
+                    notify(column, old, new)
+
+    def flush(self, connection):
+        self.insert_new(connection)
+        self.update_dirty(connection)
+        self.delete_removed(connection)
+
+    def insert_new(self, connection):
+        inserted = []
+        for mapper, objs in self.group_by_mapper(self.new_objects, connection):
+            if mapper.ignore_conflicts:
+                objs = mapper.insert_or_ignore(objs)
+            elif mapper.id_column:
+                for obj in objs:
+                    mapper.insert(obj)
+            else:
+                mapper.insert_many(objs)
+            inserted += objs
+        self.new_objects = inserted
+
+    def update_dirty(self, connection):
+        updated = []
+        for mapper, objs in self.group_by_mapper(self.dirty_objects, connection):
+            updated += mapper.update_many(objs)
+        self.dirty_objects = [obj for obj, _ in updated]
+        self.notifications += updated
+
+    def delete_removed(self, connection):
+        for mapper, objs in self.group_by_mapper(self.removed_objects, connection):
+            mapper.delete_many(objs)
+
+    def group_by_mapper(self, objs, connection):
+        for mapper_type, group in groupby(objs, self.registry.get_mapper_type):
+            yield mapper_type(connection), list(group)
+
     @staticmethod
     def new_current():
         __class__.set_current(UnitOfWork())
@@ -54,3 +235,65 @@ class UnitOfWork:
     @classmethod
     def get_current(cls):
         return cls.current.unit_of_work
+
+    @classmethod
+    def get_active(cls):
+        unit_of_work = getattr(cls.current, 'unit_of_work', None)
+        return unit_of_work if unit_of_work is not None and unit_of_work.connection is not None else None
+
+    @classmethod
+    def get_current_connection(cls):
+        unit_of_work = cls.get_active()
+        if unit_of_work is not None:
+            return unit_of_work.connection
+        scoped = cls.scoped_connection.get()
+        return scoped.get() if scoped is not None else None
+
+
+class UnitOfWorkMiddleware(BaseMiddleware):
+
+    pool = None
+
+    @classmethod
+    def get_pool(cls, settings: dict) -> ConnectionPool:
+        if cls.pool is None:
+            cls.pool = ConnectionPool.from_settings(settings)
+        return cls.pool
+
+    def to_request(self, request):
+        if 'shogun.async' in request.environ:
+            scoped = ScopedConnection(self.get_pool(request.settings))
+            request.environ['shogun.connection'] = (scoped, UnitOfWork.scoped_connection.set(scoped))
+            return None
+        unit_of_work = getattr(UnitOfWork.current, 'unit_of_work', None)
+        if unit_of_work is None:
+            return None
+        unit_of_work.begin(self.get_pool(request.settings).acquire())
+        request.environ['shogun.unit_of_work'] = unit_of_work
+        UnitOfWork.sync()
+        return None
+
+    def release_scoped(self, request):
+        scoped = request.environ.pop('shogun.connection', None)
+        if scoped is not None:
+            scoped, token = scoped
+            UnitOfWork.scoped_connection.reset(token)
+            scoped.release()
+
+    def to_response(self, response):
+        self.release_scoped(response.request)
+        unit_of_work = response.request.environ.pop('shogun.unit_of_work', None)
+        if unit_of_work is not None:
+            connection = unit_of_work.connection
+            try:
+                unit_of_work.end()
+            finally:
+                self.pool.release(connection)
+
+    def on_exception(self, request, exception):
+        self.release_scoped(request)
+        unit_of_work = request.environ.pop('shogun.unit_of_work', None)
+        if unit_of_work is not None:
+            connection = unit_of_work.connection
+            unit_of_work.rollback()
+            self.pool.release(connection)
@@ -0,0 +1,138 @@
+import queue
+import atexit
+import sqlite3
+import threading
+from time import monotonic, perf_counter
+from concurrent.futures import Future
+from shogun.metrics import registry
+
+
+BATCH_SIZE = registry.histogram('db_writer_batch_size', 'Units of work merged into one writer transaction',
+                                buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+QUEUE_WAIT = registry.histogram('db_writer_queue_seconds', 'Time a unit of work waited for the writer thread')
+GROUP_COMMIT_LATENCY = registry.histogram('db_writer_commit_duration_seconds', 'Writer transaction duration')
+WORK_FAILED = registry.counter('db_writer_failed_total', 'Units of work rolled back by the writer thread')
+
+
+class Writer:
+
+    current = None
+
+    def __init__(self, path: str, window: float = 0.002, max_batch: int = 64):
+        self.path = path
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.connection = None
+        self.thread = None
+
+    @classmethod
+    def start(cls, path: str, window: float = 0.002, max_batch: int = 64):
+        writer = cls(path, window, max_batch)
+        writer.thread = threading.Thread(target=writer.run, name='shogun-writer', daemon=True)
+        writer.thread.start()
+        cls.current = writer
+        atexit.register(writer.stop)
+        return writer
+
+    @classmethod
+    def get_current(cls):
+        return cls.current
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute('PRAGMA foreign_keys = on')
+        connection.execute('PRAGMA journal_mode = wal')
+        return connection
+
+    def submit(self, work) -> Future:
+        future = Future()
+        self.queue.put((work, future, perf_counter()))
+        return future
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if Writer.current is self:
+            Writer.current = None
+
+    def next_batch(self):
+        item = self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                item = self.queue.get(timeout=max(deadline - monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self.queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        self.connection = self.connect()
+        try:
+            while True:
+                batch = self.next_batch()
+                if batch is None:
+                    return
+                self.commit(batch)
+        finally:
+            self.connection.close()
+
+    def commit(self, batch: list):
+        start = perf_counter()
+        BATCH_SIZE.observe(len(batch))
+        done = []
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            for _, future, _ in batch:
+                if future.set_running_or_notify_cancel():
+                    future.set_exception(e)
+            return
+        for work, future, submitted in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            QUEUE_WAIT.observe(start - submitted)
+            self.connection.execute('SAVEPOINT work')
+            try:
+                result = work(self.connection)
+            except BaseException as e:
+                self.connection.execute('ROLLBACK TO work')
+                self.connection.execute('RELEASE work')
+                WORK_FAILED.inc()
+                future.set_exception(e)
+                continue
+            self.connection.execute('RELEASE work')
+            done.append((future, result))
+        try:
+            self.connection.execute('COMMIT')
+        except sqlite3.Error as e:
+            if self.connection.in_transaction:
+                self.connection.execute('ROLLBACK')
+            for future, _ in done:
+                future.set_exception(e)
+            return
+        finally:
+            GROUP_COMMIT_LATENCY.observe(perf_counter() - start)
+        for future, result in done:
+            future.set_result(result)
+
+
+def run_in_transaction(connection, work):
+    writer = Writer.get_current()
+    if writer is not None:
+        return writer.submit(work).result()
+    try:
+        result = work(connection)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return result
@@ -0,0 +1,123 @@
+import json
+import asyncio
+import threading
+from collections import deque, Counter
+from itertools import islice
+from time import time_ns
+from settings import CHANGE_FEED_SIZE
+from catalog import TABLES, Catalog
+from db.unit_of_work import UnitOfWork
+from shogun.metrics import registry
+
+EVENTS = registry.counter('change_feed_events_total', 'Committed changes published to the change feed',
+                          ('table', 'operation'))
+SUBSCRIBERS = registry.gauge('change_feed_subscribers', 'Open change feed streams')
+RESETS = registry.counter('change_feed_resets_total', 'Clients told to reload because they fell out of the buffer')
+
+
+def format_event(id_: int, event: str, data: dict) -> str:
+    return f'id: {id_}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+class ChangeFeed:
+
+    def __init__(self, size: int = 1024):
+        self.events = deque(maxlen=size)
+        self.last_id = time_ns() // 1000
+        self.waiters = set()
+        self.lock = threading.Lock()
+
+    def publish(self, changes: list):
+        changes = [i for i in changes if i[1] in TABLES]
+        if not changes:
+            return
+        known = [i for i in changes if getattr(i[2], 'id', None) is not None]
+        with self.lock:
+            skipped = max(len(known) - self.events.maxlen, 0)
+            self.last_id += skipped
+            for operation, table_name, obj in known[skipped:]:
+                self.last_id += 1
+                data = {'table': table_name, 'operation': operation, 'id': obj.id}
+                if operation != 'delete':
+                    data['record'] = Catalog.get_record(TABLES[table_name], obj)
+                self.events.append((self.last_id, format_event(self.last_id, operation, data)))
+            if len(known) < len(changes):
+                self.append_reset()
+            waiters, self.waiters = self.waiters, set()
+        for (operation, table_name), count in Counter(i[:2] for i in changes).items():
+            EVENTS.labels(table_name, operation).inc(count)
+        for wake in waiters:
+            wake()
+
+    def append_reset(self):
+        self.last_id += 1
+        self.events.append((self.last_id, format_event(self.last_id, 'reset', {'last_event_id': self.last_id})))
+
+    def reset(self):
+        with self.lock:
+            self.append_reset()
+            waiters, self.waiters = self.waiters, set()
+        for wake in waiters:
+            wake()
+
+    def since(self, last_id: int):
+        with self.lock:
+            if last_id == self.last_id:
+                return [], last_id
+            if last_id > self.last_id or not self.events or last_id < self.events[0][0] - 1:
+                RESETS.inc()
+                return [format_event(self.last_id, 'reset', {'last_event_id': self.last_id})], self.last_id
+            return [i[1] for i in islice(self.events, last_id - self.events[0][0] + 1, None)], self.last_id
+
+    def get_last_id(self) -> int:
+        with self.lock:
+            return self.last_id
+
+    async def wait(self, last_id: int, timeout: float):
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: ready.done() or ready.set_result(None))
+
+        with self.lock:
+            if self.last_id != last_id:
+                return
+            self.waiters.add(wake)
+        try:
+            await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self.lock:
+                self.waiters.discard(wake)
+
+    def poll(self, last_id, retry: int):
+        if last_id is None:
+            last_id = self.get_last_id()
+            chunks = [format_event(last_id, 'ready', {'last_event_id': last_id})]
+        else:
+            chunks, last_id = self.since(last_id)
+        return f'retry: {retry}\n\n' + ''.join(chunks), last_id
+
+    @staticmethod
+    async def sync(executor):
+        if UnitOfWork.shared is not None:
+            await asyncio.get_running_loop().run_in_executor(executor, UnitOfWork.sync)
+
+    async def stream(self, last_id, heartbeat: float, retry: int, executor=None):
+        SUBSCRIBERS.inc()
+        try:
+            await self.sync(executor)
+            chunk, last_id = self.poll(last_id, retry)
+            yield chunk
+            while True:
+                await self.wait(last_id, heartbeat)
+                await self.sync(executor)
+                chunks, last_id = self.since(last_id)
+                yield ''.join(chunks) or ': heartbeat\n\n'
+        finally:
+            SUBSCRIBERS.dec()
+
+
+change_feed = ChangeFeed(CHANGE_FEED_SIZE)
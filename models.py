@@ -2,9 +2,40 @@ import os
 import abc
 import sqlite3
 from copy import deepcopy
+from collections import namedtuple
+from time import perf_counter
 from jsonpickle import dumps
 from settings import BASE_DIR, DB_PATH
 from db.unit_of_work import UnitOfWork
+from shogun.timing import Timings
+from shogun.metrics import registry
+
+
+QUERY_LATENCY = registry.histogram('db_query_duration_seconds', 'SQL statement latency', ('mapper', ))
+ROWS_RETURNED = registry.counter('db_rows_returned_total', 'Rows fetched by mappers', ('mapper', ))
+DB_BUSY = registry.counter('db_busy_total', 'Statements rejected because the database was locked', ('mapper', ))
+UPDATES_SKIPPED = registry.counter('db_updates_skipped_total', 'Dirty objects left unwritten because nothing changed',
+                                   ('mapper', ))
+SQL_CHUNK_SIZE = 500
+
+
+def chunked(items, size=SQL_CHUNK_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def placeholders(items):
+    return ', '.join('?' * len(items))
+
+
+def group_ids(cursor, statement, ids):
+    result = {}
+    for chunk in chunked(ids):
+        cursor.execute(statement.format(placeholders(chunk)), chunk)
+        for key, id_ in cursor.fetchall():
+            result.setdefault(key, []).append(id_)
+    return result
 
 
 class Observer(metaclass=abc.ABCMeta):
@@ -48,6 +79,69 @@ class Subject:
             observer.update(state, old, new)
 
 
+class Relation:
+
+    def __init__(self, loader, key='id', default=list):
+        self.loader = loader
+        self.key = key
+        self.default = default
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.name]
+        except KeyError:
+            pass
+        siblings = obj.__dict__.get('_siblings')
+        if siblings is None:
+            obj.__dict__[self.name] = self.default()
+        else:
+            siblings.load(self, obj)
+        return obj.__dict__[self.name]
+
+    def __set__(self, obj, value):
+        obj.__dict__[self.name] = value
+
+    @staticmethod
+    def get_names(cls):
+        try:
+            return cls.__dict__['_relations']
+        except KeyError:
+            names = [name for name in dir(cls) if isinstance(getattr(cls, name, None), Relation)]
+            cls._relations = names
+            return names
+
+
+class Siblings:
+
+    def __init__(self, mapper, objs):
+        self.mapper = mapper
+        self.objs = objs
+        for obj in objs:
+            for name in Relation.get_names(type(obj)):
+                obj.__dict__.pop(name, None)
+            obj._siblings = self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def load(self, relation, obj):
+        pending = [i for i in self.objs if relation.name not in i.__dict__]
+        if not any(i is obj for i in pending):
+            pending.append(obj)
+        keys = {i.__dict__.get(relation.key) for i in pending}
+        keys.discard(None)
+        values = getattr(self.mapper, relation.loader)(list(keys)) if keys else {}
+        for i in pending:
+            key = i.__dict__.get(relation.key)
+            i.__dict__[relation.name] = values[key] if key in values else relation.default()
+
+
 class DomainObject:
 
     def mark_new(self):
@@ -62,15 +156,26 @@ class DomainObject:
 
 class Category(DomainObject):
 
+    category = Relation('load_categories', '_category_id', lambda: None)
+    courses = Relation('load_courses')
+    subcategories = Relation('load_subcategories')
+
     def __init__(self, name: str, category=None):
         self.name = name
         self.courses = []
         self.subcategories = []
         self.category = category
+        self._courses_count = None
 
     @property
     def courses_count(self):
-        return len(self.courses)
+        if self._courses_count is None:
+            return len(self.courses)
+        return self._courses_count
+
+    @courses_count.setter
+    def courses_count(self, value):
+        self._courses_count = value
 
     @property
     def get_category(self):
@@ -83,10 +188,14 @@ class Category(DomainObject):
 
 class Course(Subject, DomainObject):
 
+    category = Relation('load_categories', '_category_id', lambda: None)
+    users = Relation('load_users', default=lambda: {'students': [], 'teachers': [], 'admins': []})
+
     def __init__(self, name: str, category):
         self.name = name
         self.category = category
         self.users = {'students': [], 'teachers': [], 'admins': []}
+        self._student_count = None
         super().__init__()
 
     def __str__(self):
@@ -112,7 +221,13 @@ class Course(Subject, DomainObject):
 
     @property
     def student_count(self):
-        return len(self.users['students'])
+        if self._student_count is None:
+            return len(self.users['students'])
+        return self._student_count
+
+    @student_count.setter
+    def student_count(self, value):
+        self._student_count = value
 
 
 class OfflineCourse(Course):
@@ -154,14 +269,23 @@ class CourseFactory:
 
 class User(DomainObject):
 
+    courses = Relation('load_courses')
+
     def __init__(self, type_: str, username: str):
         self.username = username
         self.type_ = type_
         self.courses = []
+        self._course_count = None
 
     @property
     def course_count(self):
-        return len(self.courses)
+        if self._course_count is None:
+            return len(self.courses)
+        return self._course_count
+
+    @course_count.setter
+    def course_count(self, value):
+        self._course_count = value
 
 
 class Student(User):
@@ -189,6 +313,18 @@ class UserFactory:
         return cls.types[type_](type_, *args, **kwargs)
 
 
+class CategoryRow(namedtuple('CategoryRow', 'id name category_id parent_name courses_count')):
+    __slots__ = ()
+
+
+class CourseRow(namedtuple('CourseRow', 'id name type_ category_id category_name address platform student_count')):
+    __slots__ = ()
+
+
+class UserRow(namedtuple('UserRow', 'id username type_ course_count')):
+    __slots__ = ()
+
+
 class Engine:
 
     @staticmethod
@@ -204,8 +340,8 @@ class Engine:
         return UserFactory.create(type_, username)
 
     @staticmethod
-    def create_course_user(course_id: int, user_id: int):
-        return CourseUser(course_id, user_id)
+    def create_course_user(course_id: int, user_id: int, notification_method: str = 'email'):
+        return CourseUser(course_id, user_id, notification_method)
 
     @staticmethod
     def get_courses_types():
@@ -220,352 +356,434 @@ class Engine:
         return CourseFactory.types_slots
 
 
-class CategoryMapper:
+class TimedCursor(sqlite3.Cursor):
 
-    def __init__(self, connection):
-        self.connection = connection
-        self.cursor = connection.cursor()
-        self.table_name = 'categories'
+    def __init__(self, connection, mapper_name: str):
+        super().__init__(connection)
+        self.mapper_name = mapper_name
 
-    def construct(self, id_, name):
-        category = Category(name)
-        category.id = id_
-        category.courses = self.get_courses_ids(id_)
-        category.subcategories = self.get_subcategories_ids(id_)
-        return category
+    def execute(self, *args, **kwargs):
+        return self.timed(super().execute, *args, **kwargs)
 
-    def all(self):
-        statement = f"SELECT * FROM {self.table_name}"
-        self.cursor.execute(statement)
-        result = []
-        primaries = []
-        categories = {}
-        for cat in self.cursor.fetchall():
-            id_, name, category_id = cat
-            category = self.construct(id_, name)
-            if not category_id:
-                primaries.append(id_)
-            categories[id_] = category
-        self._sort_algo(primaries, result, categories)
-        return result
-
-    def _sort_algo(self, ids, result, categories, parent=None):
-        for id_ in ids:
-            category = categories[id_]
-            category.category = parent
-            result.append(category)
-            self._sort_algo(category.subcategories, result, categories, category)
-
-    def find_by_id(self, id_):
-        statement = f"SELECT name, category_id FROM {self.table_name} WHERE id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchone()
-
-        if result:
-            name, category_id = result
-            category = self.construct(id_, name)
-            if category_id:
-                category.category = self.find_by_id(category_id)
-            return category
-        raise Exception(f'record with id={id_} not found')
-
-    def find_by_ids(self, ids):
-        statement = f"SELECT id, name, category_id FROM {self.table_name} WHERE id IN ({', '.join(ids)})"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-
-        categories = []
-        for cat in result:
-            id_, name, category_id = cat
-            category = self.construct(id_, name)
-            if category_id:
-                category.category = self.find_by_id(category_id)
-            categories.append(category)
-        return categories
-
-    def get_courses_ids(self, id_):
-        statement = f"SELECT id FROM courses WHERE category_id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-        return list(map(lambda x: x[0], result))
-
-    def get_subcategories_ids(self, id_):
-        statement = f"SELECT id FROM categories WHERE category_id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-        return list(map(lambda x: x[0], result))
-
-    def insert(self, obj):
-        category_id = "NULL" if obj.category is None else obj.category.id
-        statement = f"INSERT INTO {self.table_name} (name, category_id) " \
-                    f"VALUES ('{obj.name}', {category_id})"
-        self.cursor.execute(statement)
+    def executemany(self, *args, **kwargs):
+        return self.timed(super().executemany, *args, **kwargs)
 
+    def timed(self, method, *args, **kwargs):
+        start = perf_counter()
         try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
-
-    def update(self, obj):
-        category_id = f"{obj.category.id}" if obj.category else "NULL"
-        print(category_id)
-        statement = f"UPDATE {self.table_name} " \
-                    f"SET name='{obj.name}', category_id={category_id} " \
-                    f"WHERE id={obj.id}"
-        print(statement)
-        self.cursor.execute(statement)
+            return method(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e) or 'busy' in str(e):
+                DB_BUSY.labels(self.mapper_name).inc()
+            raise
+        finally:
+            duration = perf_counter() - start
+            QUERY_LATENCY.labels(self.mapper_name).observe(duration)
+            timings = Timings.get_current()
+            if timings:
+                timings.add_query(self.mapper_name, duration)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            ROWS_RETURNED.labels(self.mapper_name).inc()
+        return row
+
+    def fetchall(self):
+        rows = super().fetchall()
+        ROWS_RETURNED.labels(self.mapper_name).inc(len(rows))
+        return rows
+
+    def fetchmany(self, *args, **kwargs):
+        rows = super().fetchmany(*args, **kwargs)
+        ROWS_RETURNED.labels(self.mapper_name).inc(len(rows))
+        return rows
+
+    def iter_rows(self, chunk_size: int = 1000):
+        while True:
+            rows = self.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield from rows
+
+
+class Field:
+
+    def __init__(self, column, attr=None, dump=None, load=True, save=True):
+        self.column = column
+        self.attr = attr or column
+        self.dump = dump or (lambda obj: getattr(obj, self.attr, None))
+        self.load = load
+        self.save = save
+
+
+class Mapper:
+
+    model = None
+    table_name = None
+    id_column = 'id'
+    key = ('id', )
+    fields = ()
+    ignore_conflicts = False
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.table_name is None:
+            return
+        id_columns = [cls.id_column] if cls.id_column else []
+        cls.columns = id_columns + [field.column for field in cls.fields]
+        cls.positions = {column: index for index, column in enumerate(cls.columns)}
+        cls.saved_fields = [field for field in cls.fields if field.save]
+        cls.row_columns = id_columns + [field.column for field in cls.saved_fields]
+        cls.loaded_fields = [(cls.columns.index(field.column), field.attr) for field in cls.fields if field.load]
+        cls.update_fields = [field for field in cls.saved_fields if field.column not in cls.key]
+        cls.update_positions = [cls.positions[field.column] for field in cls.update_fields]
+        cls.update_statements = {}
+        saved_columns = [field.column for field in cls.saved_fields]
+        key_clause = ' AND '.join(f'{column}=?' for column in cls.key)
+
+        cls.select_sql = f"SELECT {', '.join(cls.columns)} FROM {cls.table_name}"
+        cls.find_by_id_sql = f"{cls.select_sql} WHERE {cls.id_column}=?"
+        cls.insert_sql = f"INSERT INTO {cls.table_name} ({', '.join(saved_columns)}) " \
+                         f"VALUES ({placeholders(saved_columns)})"
+        cls.insert_or_ignore_sql = cls.insert_sql.replace('INSERT', 'INSERT OR IGNORE', 1)
+        cls.delete_sql = f"DELETE FROM {cls.table_name} WHERE {key_clause}"
 
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
-
-    def delete(self, obj):
-        self.cursor.execute('PRAGMA foreign_keys = on')
-        statement = f"DELETE FROM {self.table_name} WHERE id={obj.id}"
-        self.cursor.execute(statement)
-
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+    def __init__(self, connection):
+        self.connection = connection
+        self.cursor = TimedCursor(connection, self.__class__.__name__)
 
+    def create(self, row):
+        raise NotImplementedError
 
-class CourseMapper:
+    def construct(self, *row):
+        obj = self.create(row)
+        if self.id_column:
+            obj.id = row[0]
+        for index, attr in self.loaded_fields:
+            setattr(obj, attr, row[index])
+        obj._row = row
+        return obj
 
-    def __init__(self, connection):
-        self.connection = connection
-        self.cursor = connection.cursor()
-        self.table_name = 'courses'
-
-    def construct(self, id_, name, category, type_, address, platform):
-        other_params = {'address': address, 'platform': platform}
-        slots = CourseFactory.types_slots[type_]
-        params = []
-        for slot in slots:
-            params.append(other_params[slot])
-        course = CourseFactory.create(type_, *params, name, category)
-        course.id = id_
-        course.users = self.get_users_ids(id_)
-        return course
+    def construct_all(self, rows):
+        objs = [self.construct(*row) for row in rows]
+        Siblings(self, objs)
+        return objs
 
     def all(self):
-        statement = f"SELECT * FROM {self.table_name}"
-        self.cursor.execute(statement)
-        result = []
-        categories = {}
-        for course in self.cursor.fetchall():
-            id_, name, category_id, type_, address, platform = course
-            try:
-                category = categories[category_id]
-            except KeyError:
-                category = CategoryMapper(self.connection).find_by_id(category_id)
-                categories[category_id] = category
-            course = self.construct(id_, name, category, type_, address, platform)
-            result.append(course)
-        return result
+        self.cursor.execute(self.select_sql)
+        return self.construct_all(self.cursor.fetchall())
 
     def find_by_id(self, id_):
-        statement = f"SELECT name, category_id, type, address, platform FROM {self.table_name} WHERE id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchone()
-
-        if result:
-            name, category_id, type_, address, platform = result
-            category = CategoryMapper(self.connection).find_by_id(category_id)
-            course = self.construct(id_, name, category, type_, address, platform)
-            return course
+        self.cursor.execute(self.find_by_id_sql, (id_, ))
+        row = self.cursor.fetchone()
+        if row:
+            return self.construct_all([row])[0]
         raise Exception(f'record with id={id_} not found')
 
     def find_by_ids(self, ids):
-        statement = f"SELECT id, name, category_id, type, address, platform FROM {self.table_name} " \
-                    f"WHERE id IN ({', '.join(ids)})"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-
-        courses = []
-        for course in result:
-            id_, name, category_id, type_, address, platform = course
-            category = CategoryMapper(self.connection).find_by_id(category_id)
-            course = self.construct(id_, name, category, type_, address, platform)
-            courses.append(course)
-        return courses
-
-    def get_users_ids(self, id_):
-        statement = f"SELECT user_id, type FROM course_user JOIN users ON id=user_id WHERE course_id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-        users = {'students': [], 'teachers': [], 'admins': []}
-        for user in result:
-            users[f'{user[1]}s'].append(user[0])
-        return users
+        rows = {}
+        for chunk in chunked(ids):
+            self.cursor.execute(f"{self.select_sql} WHERE {self.id_column} IN ({placeholders(chunk)})", chunk)
+            for row in self.cursor.fetchall():
+                rows[row[0]] = row
+        return self.construct_all([rows[id_] for id_ in ids if id_ in rows])
+
+    def find_where(self, clause, params=()):
+        self.cursor.execute(f"{self.select_sql} WHERE {clause}", params)
+        return self.construct_all(self.cursor.fetchall())
+
+    def project(self, columns=None, clause=None, params=()):
+        columns = columns or self.row_columns
+        unknown = set(columns) - set(self.columns)
+        if unknown:
+            raise ValueError(f'unknown columns for {self.table_name}: {", ".join(sorted(unknown))}')
+        statement = f"SELECT {', '.join(columns)} FROM {self.table_name}"
+        if clause:
+            statement += f" WHERE {clause}"
+        self.cursor.execute(f"{statement} ORDER BY {', '.join(self.key)}", params)
+        return self.cursor
+
+    def iter_rows(self, columns=None):
+        return self.project(columns).iter_rows()
+
+    def dump(self, obj):
+        return [field.dump(obj) for field in self.saved_fields]
+
+    def dump_key(self, obj):
+        return [getattr(obj, column) for column in self.key]
 
     def insert(self, obj):
-        slots = obj.__slots__
-        statement = f"INSERT INTO {self.table_name} (name, type, category_id, {' ,'.join([*slots])}) " \
-                    f"VALUES ('{obj.name}',  '{obj.type_}', {obj.category.id}, '" + \
-                    ", '".join([getattr(obj, slot) for slot in slots]) + "')"
-        self.cursor.execute(statement)
-
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+        self.cursor.execute(self.insert_sql, self.dump(obj))
+        if self.id_column:
+            obj.id = self.cursor.lastrowid
+
+    def insert_many(self, objs, ignore=False):
+        self.cursor.executemany(self.insert_or_ignore_sql if ignore else self.insert_sql,
+                                [self.dump(obj) for obj in objs])
+        return self.cursor.rowcount
+
+    def insert_or_ignore(self, objs):
+        inserted = []
+        for obj in objs:
+            self.cursor.execute(self.insert_or_ignore_sql, self.dump(obj))
+            obj.inserted = self.cursor.rowcount > 0
+            if obj.inserted:
+                inserted.append(obj)
+        return inserted
 
     def update(self, obj):
-        slots = obj.__slots__
-        statement = f"UPDATE {self.table_name} SET name='{obj.name}', type='{obj.type_}', category_id={obj.category.id}, " + \
-                    ", ".join([slot + "='" + str(getattr(obj, slot) + "'") for slot in slots]) + \
-                    f" WHERE id={obj.id}"
-        self.cursor.execute(statement)
-
+        self.update_many([obj])
+
+    def update_many(self, objs):
+        if not self.update_fields:
+            raise NotImplementedError(f'{self.table_name} rows have no updatable columns')
+        self.load_snapshots(objs)
+        groups = {}
+        for obj in objs:
+            changes = self.diff(obj)
+            if changes:
+                groups.setdefault(tuple(column for column, _, _ in changes), []).append((obj, changes))
+            else:
+                UPDATES_SKIPPED.labels(self.__class__.__name__).inc()
+        updated = []
+        for columns, items in groups.items():
+            self.cursor.executemany(self.get_update_sql(columns),
+                                    [[new for _, _, new in changes] + self.dump_key(obj) for obj, changes in items])
+            for obj, changes in items:
+                self.take_snapshot(obj, changes)
+            updated += items
+        return updated
+
+    def get_update_sql(self, columns):
         try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+            return self.update_statements[columns]
+        except KeyError:
+            statement = f"UPDATE {self.table_name} SET {', '.join(f'{column}=?' for column in columns)} " \
+                        f"WHERE {' AND '.join(f'{column}=?' for column in self.key)}"
+            self.update_statements[columns] = statement
+            return statement
+
+    def load_snapshots(self, objs):
+        missing = [obj for obj in objs if getattr(obj, '_row', None) is None]
+        if not missing or not self.id_column:
+            return
+        rows = {}
+        for chunk in chunked([obj.id for obj in missing]):
+            self.cursor.execute(f"{self.select_sql} WHERE {self.id_column} IN ({placeholders(chunk)})", chunk)
+            for row in self.cursor.fetchall():
+                rows[row[0]] = row
+        for obj in missing:
+            obj._row = rows.get(obj.id)
+
+    def diff(self, obj):
+        row = getattr(obj, '_row', None)
+        changes = []
+        for field, position in zip(self.update_fields, self.update_positions):
+            new = field.dump(obj)
+            old = row[position] if row is not None else None
+            if row is None or new != old:
+                changes.append((field.column, old, new))
+        return changes
+
+    def take_snapshot(self, obj, changes):
+        row = list(obj._row) if getattr(obj, '_row', None) is not None else [None] * len(self.columns)
+        for column, _, new in changes:
+            row[self.positions[column]] = new
+        obj._row = tuple(row)
 
     def delete(self, obj):
-        self.cursor.execute('PRAGMA foreign_keys = on')
-        statement = f"DELETE FROM {self.table_name} WHERE id={obj.id}"
-        self.cursor.execute(statement)
+        self.delete_many([obj])
 
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+    def delete_many(self, objs):
+        self.cursor.executemany(self.delete_sql, [self.dump_key(obj) for obj in objs])
 
 
-class UserMapper:
+def dump_category_id(obj):
+    if 'category' not in obj.__dict__:
+        return obj.__dict__.get('_category_id')
+    return obj.category.id if obj.category else None
 
-    def __init__(self, connection):
-        self.connection = connection
-        self.cursor = connection.cursor()
-        self.table_name = 'users'
 
-    def construct(self, id_, username, type_):
-        user = UserFactory.create(type_, username)
-        user.id = id_
-        user.courses = self.get_courses_ids(id_)
-        return user
+class CategoryMapper(Mapper):
+
+    model = Category
+    table_name = 'categories'
+    fields = (
+        Field('name'),
+        Field('category_id', '_category_id', dump=dump_category_id),
+        Field('courses_count', save=False),
+    )
+
+    def create(self, row):
+        return Category(row[self.positions['name']])
 
     def all(self):
-        statement = f"SELECT * FROM {self.table_name}"
-        self.cursor.execute(statement)
+        categories = {category.id: category for category in super().all()}
         result = []
-
-        for user in self.cursor.fetchall():
-            id_, username, type_ = user
-            user = self.construct(id_, username, type_)
-            result.append(user)
+        primaries = []
+        for category in categories.values():
+            category.subcategories = []
+        for category in categories.values():
+            if category._category_id:
+                categories[category._category_id].subcategories.append(category.id)
+            else:
+                primaries.append(category.id)
+        self._sort_algo(primaries, result, categories)
         return result
 
-    def find_by_id(self, id_):
-        statement = f"SELECT type, username FROM {self.table_name} WHERE id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchone()
-
-        if result:
-            type_, username = result
-            user = self.construct(id_, username, type_)
-            return user
-        raise Exception(f'record with id={id_} not found')
+    def _sort_algo(self, ids, result, categories, parent=None):
+        for id_ in ids:
+            category = categories[id_]
+            category.category = parent
+            result.append(category)
+            self._sort_algo(category.subcategories, result, categories, category)
 
-    def find_by_ids(self, ids):
-        statement = f"SELECT id, name, type FROM {self.table_name} WHERE id IN ({', '.join(ids)})"
+    def list_rows(self):
+        statement = f"SELECT c.id, c.name, c.category_id, IFNULL(p.name, '-'), c.courses_count " \
+                    f"FROM {self.table_name} c LEFT JOIN {self.table_name} p ON p.id = c.category_id"
         self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-
-        users = []
-        for user in result:
-            id_, name, type_ = user
-            user = self.construct(id_, name, type_)
-            users.append(user)
-        return users
+        children = {}
+        for row in map(CategoryRow._make, self.cursor.fetchall()):
+            children.setdefault(row.category_id, []).append(row)
+        result = []
+        self._sort_rows(children, None, result)
+        return result
 
-    def find_by_type(self, type_):
-        statement = f"SELECT id, username, type FROM users WHERE type='{type_}'"
+    def _sort_rows(self, children, parent_id, result):
+        for row in children.get(parent_id, ()):
+            result.append(row)
+            self._sort_rows(children, row.id, result)
+
+    def load_categories(self, ids):
+        return {category.id: category for category in self.find_by_ids(ids)}
+
+    def load_courses(self, ids):
+        statement = 'SELECT category_id, id FROM courses WHERE category_id IN ({}) ORDER BY id'
+        return group_ids(self.cursor, statement, ids)
+
+    def load_subcategories(self, ids):
+        statement = 'SELECT category_id, id FROM categories WHERE category_id IN ({}) ORDER BY id'
+        return group_ids(self.cursor, statement, ids)
+
+
+class CourseMapper(Mapper):
+
+    model = Course
+    table_name = 'courses'
+    fields = (
+        Field('name'),
+        Field('category_id', '_category_id', dump=dump_category_id),
+        Field('type', 'type_', load=False),
+        Field('address', load=False),
+        Field('platform', load=False),
+        Field('student_count', save=False),
+    )
+
+    def create(self, row):
+        positions = self.positions
+        type_ = row[positions['type']]
+        params = [row[positions[slot]] for slot in CourseFactory.types_slots[type_]]
+        return CourseFactory.create(type_, *params, row[positions['name']], None)
+
+    def list_rows(self):
+        statement = f"SELECT c.id, c.name, c.type, c.category_id, cat.name, c.address, c.platform, c.student_count " \
+                    f"FROM {self.table_name} c JOIN categories cat ON cat.id = c.category_id"
         self.cursor.execute(statement)
-        result = self.cursor.fetchall()
+        return list(map(CourseRow._make, self.cursor.fetchall()))
+
+    def load_categories(self, ids):
+        return CategoryMapper(self.connection).load_categories(ids)
+
+    def attach_observers(self, course):
+        enrolments = CourseUserMapper(self.connection).find_where('course_id=?', (course.id, ))
+        users = {user.id: user for user in UserMapper(self.connection).find_by_ids([i.user_id for i in enrolments])}
+        for enrolment in enrolments:
+            course.add_observer(users[enrolment.user_id], enrolment.notification_method)
+
+    def load_users(self, ids):
+        result = {}
+        for chunk in chunked(ids):
+            statement = f"SELECT course_id, user_id, type FROM course_user JOIN users ON id=user_id " \
+                        f"WHERE course_id IN ({placeholders(chunk)}) ORDER BY user_id"
+            self.cursor.execute(statement, chunk)
+            for course_id, user_id, type_ in self.cursor.fetchall():
+                if course_id not in result:
+                    result[course_id] = {'students': [], 'teachers': [], 'admins': []}
+                result[course_id][f'{type_}s'].append(user_id)
+        return result
 
-        users = []
-        for user in result:
-            id_, name, type_ = user
-            user = self.construct(id_, name, type_)
-            users.append(user)
-        return users
 
-    def get_courses_ids(self, id_):
-        statement = f"SELECT course_id FROM course_user WHERE user_id={id_}"
-        self.cursor.execute(statement)
-        result = self.cursor.fetchall()
-        return list(map(lambda x: x[0], result))
+class UserMapper(Mapper):
 
-    def insert(self, obj):
-        statement = f"INSERT INTO {self.table_name} (username, type) " \
-                    f"VALUES ('{obj.username}', '{obj.type_}')"
-        self.cursor.execute(statement)
-
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+    model = User
+    table_name = 'users'
+    fields = (
+        Field('username'),
+        Field('type', 'type_', load=False),
+        Field('course_count', save=False),
+    )
 
-    def update(self, obj):
-        statement = f"UPDATE {self.table_name} " \
-                    f"SET username='{obj.username}', type='{obj.type_}' " \
-                    f"WHERE id={obj.id}"
-        self.cursor.execute(statement)
+    def create(self, row):
+        return UserFactory.create(row[self.positions['type']], row[self.positions['username']])
 
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+    def find_by_type(self, type_):
+        return self.find_where('type=?', (type_, ))
 
-    def delete(self, obj):
-        self.cursor.execute('PRAGMA foreign_keys = on')
-        statement = f"DELETE FROM {self.table_name} WHERE id={obj.id}"
-        self.cursor.execute(statement)
+    def list_rows(self, type_=None):
+        statement = f"SELECT id, username, type, course_count FROM {self.table_name}"
+        if type_ is None:
+            self.cursor.execute(statement)
+        else:
+            self.cursor.execute(f"{statement} WHERE type=?", (type_, ))
+        return list(map(UserRow._make, self.cursor.fetchall()))
 
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+    def load_courses(self, ids):
+        statement = 'SELECT user_id, course_id FROM course_user WHERE user_id IN ({}) ORDER BY course_id'
+        return group_ids(self.cursor, statement, ids)
 
 
 class CourseUser(DomainObject):
 
-    def __init__(self, course_id, user_id):
+    notification_methods = ('email', 'sms')
+    inserted = None
+
+    def __init__(self, course_id, user_id, notification_method='email'):
         self.course_id = course_id
         self.user_id = user_id
+        self.notification_method = notification_method
 
 
-class CourseUserMapper:
+class CourseUserMapper(Mapper):
 
-    def __init__(self, connection):
-        self.connection = connection
-        self.cursor = connection.cursor()
-        self.table_name = 'course_user'
+    model = CourseUser
+    table_name = 'course_user'
+    id_column = None
+    key = ('course_id', 'user_id')
+    ignore_conflicts = True
+    fields = (
+        Field('course_id'),
+        Field('user_id'),
+        Field('notification_method'),
+    )
 
-    def insert(self, obj):
-        statement = f"INSERT INTO {self.table_name} (course_id, user_id) VALUES ({obj.course_id}, {obj.user_id})"
-        self.cursor.execute(statement)
+    def create(self, row):
+        return CourseUser(*row)
 
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
+    def find_pairs(self, course_ids, user_ids):
+        pairs = set()
+        for course_chunk in chunked(course_ids, SQL_CHUNK_SIZE // 2):
+            for user_chunk in chunked(user_ids, SQL_CHUNK_SIZE // 2):
+                statement = f"SELECT course_id, user_id FROM {self.table_name} " \
+                            f"WHERE course_id IN ({placeholders(course_chunk)}) " \
+                            f"AND user_id IN ({placeholders(user_chunk)})"
+                self.cursor.execute(statement, [*course_chunk, *user_chunk])
+                pairs.update(self.cursor.fetchall())
+        return pairs
 
-    def delete(self, obj):
-        statement = f"DELETE FROM {self.table_name} WHERE course_id={obj.course_id} AND user_id={obj.user_id}"
-        self.cursor.execute(statement)
-
-        try:
-            self.connection.commit()
-        except Exception as e:
-            raise Exception(e.args)
 
-
-connect = sqlite3.connect(os.path.join(BASE_DIR, DB_PATH))
+connect = sqlite3.connect(os.path.join(BASE_DIR, DB_PATH), check_same_thread=False)
+connect.execute('PRAGMA foreign_keys = on')
 
 
 class MapperRegistry:
@@ -576,16 +794,37 @@ class MapperRegistry:
         'user': (User, UserMapper),
         'course_user': (CourseUser, CourseUserMapper)
     }
+    types = {model: mapper for model, mapper in mappers.values()}
+
+    @classmethod
+    def get_mapper_type(cls, obj):
+        type_ = type(obj)
+        try:
+            return cls.types[type_]
+        except KeyError:
+            for base in type_.__mro__:
+                if base in cls.types:
+                    cls.types[type_] = cls.types[base]
+                    return cls.types[type_]
+            raise KeyError(f'no mapper registered for {type_.__name__}')
 
     @classmethod
     def get_mapper(cls, obj):
-        for mapper in cls.mappers.values():
-            if isinstance(obj, mapper[0]):
-                return mapper[1](connect)
+        return cls.get_mapper_type(obj)(cls.get_connection())
 
     @classmethod
     def get_mapper_by_name(cls, name):
-        return cls.mappers[name][1](connect)
+        return cls.mappers[name][1](cls.get_connection())
+
+    @staticmethod
+    def get_connection():
+        return UnitOfWork.get_current_connection() or connect
+
+    @classmethod
+    def warm_up(cls, connection):
+        for _, mapper_type in cls.mappers.values():
+            if mapper_type.id_column:
+                connection.execute(mapper_type.find_by_id_sql, (0, )).fetchall()
 
 
 class JSONSerializer:
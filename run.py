@@ -1,6 +1,14 @@
+import os
+import argparse
+from time import perf_counter
 from wsgiref.simple_server import make_server
 from shogun.main import Shogun
-from urls import urls
+from shogun import server
+from shogun.template_engine import precompile_templates
+from shogun.static import get_static_files
+from shogun.cache import SharedCache
+from db.writer import Writer
+from db.unit_of_work import UnitOfWork, UnitOfWorkMiddleware
 import settings
 from shogun.middleware import middlewares
 
@@ -12,9 +20,62 @@ def get_settings():
     return settings_dict
 
 
-application = Shogun(urls=urls, settings=get_settings(), middlewares=middlewares)
+def create_app(report: list = None) -> Shogun:
+    report = [] if report is None else report
+    start = perf_counter()
 
+    def lap(phase: str, detail: str = ''):
+        nonlocal start
+        now = perf_counter()
+        report.append((phase, now - start, detail))
+        start = now
 
-with make_server('', 8000, application) as httpd:
-    print("Запуск на порту 8000...")
-    httpd.serve_forever()
+    from models import MapperRegistry
+    from urls import urls
+    from views import init_unit_of_work
+    from catalog import Catalog
+    lap('imports')
+    app = Shogun(urls=urls, settings=get_settings(), middlewares=[*middlewares, UnitOfWorkMiddleware],
+                 thread_initializer=init_unit_of_work)
+    lap('routes', f'{app.compile_routes()} urls')
+    stats = precompile_templates(app.settings)
+    lap('templates', f'{stats["compiled"]} compiled, {stats["cached"]} from cache')
+    lap('static', f'{get_static_files(app.settings).precompute()} files')
+    pool = UnitOfWorkMiddleware.get_pool(app.settings)
+    with pool.connection() as connection:
+        MapperRegistry.warm_up(connection)
+    if app.settings.get('DB_WRITER_ENABLED'):
+        Writer.start(os.path.join(app.settings['BASE_DIR'], app.settings['DB_PATH']), app.settings['DB_WRITER_WINDOW'],
+                     app.settings['DB_WRITER_MAX_BATCH'])
+    lap('database', 'single writer thread' if app.settings.get('DB_WRITER_ENABLED') else '')
+    if app.settings.get('SHARED_CACHE_ENABLED'):
+        shared = SharedCache.get_current(app.settings)
+        UnitOfWork.share(shared)
+        lap('shared', f'{shared.slots} x {shared.slot_size} byte slots in {shared.path}')
+    if app.settings.get('CATALOG_ENABLED'):
+        catalog = Catalog.start(pool.connect())
+        lap('catalog', ', '.join(f'{len(records)} {kind} rows' for kind, records in catalog.records.items()))
+    return app
+
+
+startup_report = []
+application = create_app(startup_report)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--server', choices=('wsgi', 'asgi'), default='wsgi')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--startup-report', action='store_true', help='print the time spent in each startup phase')
+    args = parser.parse_args()
+
+    if args.startup_report:
+        for phase, duration, detail in startup_report:
+            print(f'{phase:<10} {duration * 1000:8.2f} ms  {detail}')
+        print(f'{"total":<10} {sum(i[1] for i in startup_report) * 1000:8.2f} ms')
+    print(f"Запуск на порту {args.port}...")
+    if args.server == 'asgi':
+        server.run(application.asgi, '', args.port)
+    else:
+        with make_server('', args.port, application) as httpd:
+            httpd.serve_forever()
@@ -0,0 +1,98 @@
+import re
+import sys
+import argparse
+from settings import SEARCH_PER_PAGE, SEARCH_MAX_CANDIDATES
+from models import connect, TimedCursor, MapperRegistry
+
+KINDS = {'courses': 'course', 'categories': 'category', 'users': 'user'}
+TERM_PATTERN = re.compile(r'\w+')
+MAX_TERMS = 8
+
+
+def get_terms(query: str) -> list:
+    return TERM_PATTERN.findall(query)[:MAX_TERMS]
+
+
+def build_match(query: str) -> str:
+    terms = [f'"{term}"' for term in get_terms(query)]
+    if terms:
+        terms[-1] += '*'
+    return ' AND '.join(terms)
+
+
+class SearchResult:
+
+    def __init__(self, kind: str, items: list, page: int, has_next: bool):
+        self.kind = kind
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+
+class Searcher:
+
+    def __init__(self, connection, per_page: int = SEARCH_PER_PAGE, max_candidates: int = SEARCH_MAX_CANDIDATES):
+        self.connection = connection
+        self.per_page = per_page
+        self.max_candidates = max_candidates
+        self.cursor = TimedCursor(connection, self.__class__.__name__)
+
+    def find_ids(self, kind: str, match: str, page: int) -> list:
+        statement = f"SELECT rowid FROM {kind}_fts WHERE {kind}_fts MATCH ? ORDER BY rank LIMIT ? OFFSET ?"
+        self.cursor.execute(statement, (match, self.per_page + 1, (page - 1) * self.per_page))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def search(self, kind: str, query: str, page: int = 1) -> SearchResult:
+        if kind not in KINDS:
+            raise ValueError(f'kind must be one of {", ".join(KINDS)}')
+        match = build_match(query)
+        page = max(page, 1)
+        if not match or (page - 1) * self.per_page >= self.max_candidates:
+            return SearchResult(kind, [], page, False)
+        ids = self.find_ids(kind, match, page)
+        has_next = len(ids) > self.per_page and page * self.per_page < self.max_candidates
+        ids = ids[:self.per_page]
+        items = MapperRegistry.get_mapper_by_name(KINDS[kind]).find_by_ids(ids) if ids else []
+        return SearchResult(kind, items, page, has_next)
+
+    def search_all(self, query: str, page: int = 1) -> dict:
+        return {kind: self.search(kind, query, page) for kind in KINDS}
+
+    def rebuild(self):
+        for kind in KINDS:
+            self.cursor.execute(f"INSERT INTO {kind}_fts ({kind}_fts) VALUES ('rebuild')")
+        self.connection.commit()
+
+    def optimize(self):
+        for kind in KINDS:
+            self.cursor.execute(f"INSERT INTO {kind}_fts ({kind}_fts) VALUES ('optimize')")
+        self.connection.commit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Full-text search over courses, categories and users')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('rebuild', help='repopulate the search indexes from the content tables')
+    commands.add_parser('optimize', help='merge the search index b-trees')
+    query_parser = commands.add_parser('query')
+    query_parser.add_argument('query')
+    query_parser.add_argument('--kind', choices=KINDS)
+    query_parser.add_argument('--page', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    searcher = Searcher(connect)
+    if args.command == 'rebuild':
+        searcher.rebuild()
+    elif args.command == 'optimize':
+        searcher.optimize()
+    else:
+        kinds = [args.kind] if args.kind else KINDS
+        for kind in kinds:
+            result = searcher.search(kind, args.query, args.page)
+            for item in result.items:
+                print(kind, item.id, getattr(item, 'name', None) or getattr(item, 'username', ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
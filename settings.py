@@ -6,4 +6,46 @@ INCLUDES_DIR_NAME = 'includes'
 LOGS_DIR_NAME = 'logs'
 DB_DIR_NAME = 'db'
 DB_NAME = 'db.sqlite'
-DB_PATH = os.path.join(DB_DIR_NAME, DB_NAME)
+DB_PATH = os.environ.get('SHOGUN_DB_PATH', os.path.join(DB_DIR_NAME, DB_NAME))
+TIMING_ENABLED = False
+TIMING_LOG_WRITER = 'console'
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_DIR_NAME = 'profiles'
+ASGI_MAX_WORKERS = 8
+BULK_CHUNK_SIZE = 5000
+BULK_ENROL_MAX_PAIRS = 100000
+BATCH_MAX_OPERATIONS = 1000
+DB_WRITER_ENABLED = False
+DB_WRITER_WINDOW = 0.002
+DB_WRITER_MAX_BATCH = 64
+DB_POOL_SIZE = 16
+DB_POOL_TIMEOUT = 5.0
+SEARCH_PER_PAGE = 20
+SEARCH_MAX_CANDIDATES = 1000
+FRAGMENT_CACHE_ENABLED = True
+FRAGMENT_CACHE_MAX_ENTRIES = 1024
+TEMPLATE_CACHE_DIR_NAME = 'template_cache'
+TEMPLATE_AUTO_RELOAD = True
+TEMPLATE_MINIFY = False
+SHARED_CACHE_ENABLED = False
+SHARED_CACHE_PATH = os.path.join(TEMPLATE_CACHE_DIR_NAME, 'shared.cache')
+SHARED_CACHE_SLOTS = 1024
+SHARED_CACHE_SLOT_SIZE = 16384
+STATIC_DIR_NAME = 'static'
+STATIC_URL = '/static/'
+STATIC_MAX_AGE = 31536000
+ADMISSION_ENABLED = True
+ADMISSION_MAX_IN_FLIGHT = 64
+ADMISSION_QUEUE_SIZE = 128
+ADMISSION_QUEUE_TIMEOUT = 1.0
+ADMISSION_RETRY_AFTER = 1
+ADMISSION_ROUTE_LIMITS = {'^$': 8, '^search$': 8, '^api/enrolments$': 2, '^api/batch$': 2, '^api/import$': 2,
+                          '^api/export$': 2, '^api/catalog/verify$': 1}
+ADMISSION_ROUTE_PRIORITIES = {'^api/courses$': 10, '^static/': 10, '^metrics$': 20}
+ADMISSION_ROUTE_TIMEOUTS = {'^api/enrolments$': 5.0, '^api/batch$': 5.0, '^api/import$': 5.0, '^api/export$': 5.0}
+CATALOG_ENABLED = False
+STATS_TOP_DEFAULT = 10
+STATS_TOP_MAX = 100
+CHANGE_FEED_SIZE = 1024
+CHANGE_FEED_HEARTBEAT = 15.0
+CHANGE_FEED_RETRY = 3000
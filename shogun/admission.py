@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from bisect import insort
+from itertools import count
+from time import monotonic
+from shogun.metrics import registry
+
+
+IN_FLIGHT = registry.gauge('admission_in_flight', 'Requests currently admitted', ('route', ))
+QUEUE_DEPTH = registry.gauge('admission_queue_depth', 'Requests waiting for admission')
+SHED = registry.counter('admission_shed_total', 'Requests rejected by admission control', ('route', 'reason'))
+WAIT_TIME = registry.histogram('admission_wait_seconds', 'Time spent waiting for admission', ('route', ))
+
+
+class Waiter:
+
+    __slots__ = ('route', 'priority', 'deadline', 'sequence', 'wake', 'granted')
+
+    def __init__(self, route: str, priority: int, deadline: float, sequence: int, wake):
+        self.route = route
+        self.priority = priority
+        self.deadline = deadline
+        self.sequence = sequence
+        self.wake = wake
+        self.granted = False
+
+    def __lt__(self, other):
+        return (-self.priority, self.deadline, self.sequence) < (-other.priority, other.deadline, other.sequence)
+
+
+class Admission:
+
+    def __init__(self, max_in_flight: int = 64, route_limits: dict = None, priorities: dict = None,
+                 queue_size: int = 128):
+        self.max_in_flight = max_in_flight
+        self.route_limits = route_limits or {}
+        self.priorities = priorities or {}
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.route_in_flight = {}
+        self.waiters = []
+        self.sequence = count()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        return cls(settings.get('ADMISSION_MAX_IN_FLIGHT', 64), settings.get('ADMISSION_ROUTE_LIMITS'),
+                   settings.get('ADMISSION_ROUTE_PRIORITIES'), settings.get('ADMISSION_QUEUE_SIZE', 128))
+
+    def can_run(self, route: str) -> bool:
+        return self.in_flight < self.max_in_flight and \
+            self.route_in_flight.get(route, 0) < self.route_limits.get(route, self.max_in_flight)
+
+    def take(self, route: str):
+        self.in_flight += 1
+        self.route_in_flight[route] = self.route_in_flight.get(route, 0) + 1
+        IN_FLIGHT.labels(route).inc()
+
+    def enqueue(self, route: str, deadline: float, wake):
+        with self.lock:
+            if self.can_run(route):
+                self.take(route)
+                return None, None
+            if wake is None:
+                return 'busy', None
+            if len(self.waiters) >= self.queue_size:
+                return 'queue_full', None
+            if deadline <= monotonic():
+                return 'deadline', None
+            waiter = Waiter(route, self.priorities.get(route, 0), deadline, next(self.sequence), wake)
+            insort(self.waiters, waiter)
+            QUEUE_DEPTH.set(len(self.waiters))
+            return None, waiter
+
+    def leave(self, waiter: Waiter):
+        with self.lock:
+            if waiter.granted:
+                return None
+            self.waiters.remove(waiter)
+            QUEUE_DEPTH.set(len(self.waiters))
+            return 'deadline'
+
+    def acquire(self, route: str, deadline: float, block: bool = True):
+        event = threading.Event()
+        reason, waiter = self.enqueue(route, deadline, event.set if block else None)
+        if waiter is None:
+            return reason
+        event.wait(max(deadline - monotonic(), 0))
+        return self.leave(waiter)
+
+    async def acquire_async(self, route: str, deadline: float):
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(None))
+
+        reason, waiter = self.enqueue(route, deadline, wake)
+        if waiter is None:
+            return reason
+        try:
+            await asyncio.wait_for(granted, max(deadline - monotonic(), 0))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self.leave(waiter) is None:
+                self.release(route)
+            raise
+        return self.leave(waiter)
+
+    def release(self, route: str):
+        with self.lock:
+            self.in_flight -= 1
+            self.route_in_flight[route] -= 1
+            IN_FLIGHT.labels(route).dec()
+            now = monotonic()
+            for waiter in list(self.waiters):
+                if self.in_flight >= self.max_in_flight:
+                    break
+                if waiter.deadline <= now or not self.can_run(waiter.route):
+                    continue
+                self.waiters.remove(waiter)
+                self.take(waiter.route)
+                waiter.granted = True
+                waiter.wake()
+            QUEUE_DEPTH.set(len(self.waiters))
@@ -0,0 +1,205 @@
+import asyncio
+import contextvars
+from functools import partial
+from urllib.parse import unquote
+from concurrent.futures import Executor
+
+
+CHUNK_SIZE = 64 * 1024
+
+current_executor = contextvars.ContextVar('current_executor', default=None)
+
+
+class AsgiInput:
+
+    def __init__(self, receive, loop: asyncio.AbstractEventLoop):
+        self.receive = receive
+        self.loop = loop
+        self.buffer = bytearray()
+        self.more_body = True
+
+    async def receive_chunk(self) -> bytes:
+        message = await self.receive()
+        if message['type'] == 'http.disconnect':
+            self.more_body = False
+            return b''
+        self.more_body = message.get('more_body', False)
+        return message.get('body', b'')
+
+    def take(self, size: int) -> bytes:
+        if size < 0 or size >= len(self.buffer):
+            data = bytes(self.buffer)
+            self.buffer.clear()
+        else:
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+        return data
+
+    async def aread(self, size: int = -1) -> bytes:
+        while self.more_body and (size < 0 or len(self.buffer) < size):
+            self.buffer += await self.receive_chunk()
+        return self.take(size)
+
+    def read(self, size: int = -1) -> bytes:
+        if self.more_body and (size < 0 or len(self.buffer) < size) and self.loop_is_current():
+            raise RuntimeError('blocking read of the request body inside the event loop, use aread()')
+        while self.more_body and (size < 0 or len(self.buffer) < size):
+            self.buffer += asyncio.run_coroutine_threadsafe(self.receive_chunk(), self.loop).result()
+        return self.take(size)
+
+    def loop_is_current(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def readline(self, size: int = -1) -> bytes:
+        while self.more_body and b'\n' not in self.buffer and (size < 0 or len(self.buffer) < size):
+            self.buffer += asyncio.run_coroutine_threadsafe(self.receive_chunk(), self.loop).result()
+        end = self.buffer.find(b'\n') + 1 or len(self.buffer)
+        return self.take(end if size < 0 else min(end, size))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def __aiter__(self):
+        return self.iter_chunks()
+
+    async def iter_chunks(self):
+        if self.buffer:
+            yield self.take(-1)
+        while self.more_body:
+            chunk = await self.receive_chunk()
+            if chunk:
+                yield chunk
+
+
+def build_environ(scope: dict, body: AsgiInput) -> dict:
+    server_name, server_port = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'] if 'path' in scope else unquote(scope['raw_path'].decode('latin-1')),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server_name,
+        'SERVER_PORT': str(server_port),
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'CONTENT_TYPE': '',
+        'CONTENT_LENGTH': '',
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'asgi.scope': scope,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            environ[name] = value
+        elif f'HTTP_{name}' in environ:
+            environ[f'HTTP_{name}'] += f',{value}'
+        else:
+            environ[f'HTTP_{name}'] = value
+    environ.setdefault('HTTP_HOST', f'{server_name}:{server_port}')
+    return environ
+
+
+async def read_form_body(environ: dict):
+    content_type = environ.get('CONTENT_TYPE', '')
+    if not content_type or content_type.startswith(('application/x-www-form-urlencoded', 'text/plain')):
+        body = environ['wsgi.input']
+        body.buffer += await body.aread()
+
+
+async def run_sync(func, *args, **kwargs):
+    executor = current_executor.get()
+    if executor is None:
+        return func(*args, **kwargs)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, partial(context.run, func, *args, **kwargs))
+
+
+def iterate_async(loop: asyncio.AbstractEventLoop, iterable):
+    iterator = iterable.__aiter__()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(iterator.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        if hasattr(iterator, 'aclose'):
+            loop.run_until_complete(iterator.aclose())
+        loop.close()
+
+
+def run_coroutine(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        response = loop.run_until_complete(coroutine)
+    except BaseException:
+        loop.close()
+        raise
+    if getattr(response, 'is_async', False):
+        response.body = iterate_async(loop, response.body)
+    else:
+        loop.close()
+    return response
+
+
+async def send_response(response, send, executor: Executor):
+    await send({
+        'type': 'http.response.start',
+        'status': int(str(response.status_code).split(' ')[0]),
+        'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1'))
+                    for name, value in response.headers.items()],
+    })
+    if getattr(response, 'is_file', False) and not response.head_only and \
+            'http.response.zerocopy' in response.request.environ.get('asgi.scope', {}).get('extensions', {}):
+        with response.open() as f:
+            await send({'type': 'http.response.zerocopy', 'file': f, 'offset': response.offset,
+                        'count': response.length})
+        return
+    if getattr(response, 'is_async', False):
+        chunks = response.encode_async()
+        try:
+            async for chunk in chunks:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            await chunks.aclose()
+    elif getattr(response, 'is_streaming', False):
+        loop = asyncio.get_running_loop()
+        chunks = iter(response.get_chunks())
+        try:
+            while True:
+                chunk = await loop.run_in_executor(executor, next, chunks, None)
+                if chunk is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if hasattr(chunks, 'close'):
+                await loop.run_in_executor(executor, chunks.close)
+    else:
+        body = response.body
+        for offset in range(0, len(body), CHUNK_SIZE) or [0]:
+            await send({'type': 'http.response.body', 'body': body[offset:offset + CHUNK_SIZE],
+                        'more_body': offset + CHUNK_SIZE < len(body)})
+        return
+    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+
+async def lifespan(app, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            app.get_executor()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            app.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
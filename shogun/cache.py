@@ -0,0 +1,301 @@
+import os
+import mmap
+import fcntl
+import struct
+import hashlib
+import threading
+from time import monotonic, time
+from contextlib import contextmanager
+from collections import OrderedDict
+from typing import Iterable, Optional
+from shogun.metrics import registry
+
+
+CACHE_LOOKUPS = registry.counter('fragment_cache_lookups_total', 'Fragment cache lookups', ('fragment', 'result'))
+CACHE_EVICTIONS = registry.counter('fragment_cache_evictions_total', 'Fragments dropped from the cache', ('reason', ))
+CACHE_ENTRIES = registry.gauge('fragment_cache_entries', 'Fragments currently cached')
+GENERATION_SYNCS = registry.counter('shared_cache_syncs_total', 'Commits from other processes picked up by this one')
+
+SHARED_MAGIC = b'SHOGUNC1'
+HEADER = struct.Struct('<8sIIQ')
+HEADER_SIZE = 4096
+TAG_SLOTS = 256
+TAG_OFFSET = HEADER.size
+SLOT_HEADER = struct.Struct('<IQdHHI')
+STAMP = struct.Struct('<HQ')
+SEQUENCE = struct.Struct('<I')
+GENERATION = struct.Struct('<Q')
+PROBES = 4
+INIT_LOCK = 0
+PEERS_LOCK = 1
+
+
+class FragmentCache:
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.tags = {}
+        self.generations = {}
+        self.lock = threading.Lock()
+
+    def get(self, fragment: str, key: tuple) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get((fragment, key))
+            if entry is not None and entry[0] and entry[0] < monotonic():
+                self.discard((fragment, key), 'expired')
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end((fragment, key))
+        CACHE_LOOKUPS.labels(fragment, 'miss' if entry is None else 'hit').inc()
+        return None if entry is None else entry[2]
+
+    def get_stamps(self, tags: Iterable[str]) -> list:
+        with self.lock:
+            return [(tag, self.generations.get(tag, 0)) for tag in tags]
+
+    def set(self, fragment: str, key: tuple, value: str, ttl: int = 0, tags: Iterable[str] = (), stamps: list = None):
+        tags = tuple(tags) or (fragment, )
+        with self.lock:
+            if stamps is not None and any(self.generations.get(tag, 0) != generation for tag, generation in stamps):
+                CACHE_EVICTIONS.labels('invalidated').inc()
+                return
+            if (fragment, key) in self.entries:
+                self.discard((fragment, key))
+            self.entries[(fragment, key)] = (monotonic() + ttl if ttl else 0, tags, value)
+            for tag in tags:
+                self.tags.setdefault(tag, set()).add((fragment, key))
+            while len(self.entries) > self.max_entries:
+                self.discard(next(iter(self.entries)), 'size')
+            CACHE_ENTRIES.set(len(self.entries))
+
+    def discard(self, entry_key: tuple, reason: str = None):
+        _, tags, _ = self.entries.pop(entry_key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(entry_key)
+                if not keys:
+                    del self.tags[tag]
+        if reason:
+            CACHE_EVICTIONS.labels(reason).inc()
+
+    def invalidate(self, *tags: str) -> int:
+        dropped = 0
+        with self.lock:
+            for tag in tags:
+                self.generations[tag] = self.generations.get(tag, 0) + 1
+                for entry_key in list(self.tags.get(tag, ())):
+                    self.discard(entry_key, 'invalidated')
+                    dropped += 1
+            CACHE_ENTRIES.set(len(self.entries))
+        return dropped
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tags.clear()
+            CACHE_ENTRIES.set(0)
+
+
+class SharedCache:
+
+    current = None
+    listeners = []
+
+    def __init__(self, path: str, slots: int = 1024, slot_size: int = 16384, max_local_entries: int = 1024):
+        self.path = path
+        self.max_local_entries = max_local_entries
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        with self.locked(INIT_LOCK):
+            try:
+                fcntl.lockf(self.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, PEERS_LOCK)
+                alone = True
+            except OSError:
+                alone = False
+            if alone:
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, HEADER_SIZE + slots * slot_size)
+                os.pwrite(self.fd, HEADER.pack(SHARED_MAGIC, slots, slot_size, 0), 0)
+            fcntl.lockf(self.fd, fcntl.LOCK_SH, 1, PEERS_LOCK)
+            magic, self.slots, self.slot_size, self.seen = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+            if magic != SHARED_MAGIC:
+                raise RuntimeError(f'{path} is not a shared cache file')
+        self.map = mmap.mmap(self.fd, HEADER_SIZE + self.slots * self.slot_size)
+
+    @classmethod
+    def from_settings(cls, settings: dict):
+        return cls(os.path.join(settings.get('BASE_DIR', ''), settings['SHARED_CACHE_PATH']),
+                   settings.get('SHARED_CACHE_SLOTS', 1024), settings.get('SHARED_CACHE_SLOT_SIZE', 16384),
+                   settings.get('FRAGMENT_CACHE_MAX_ENTRIES', 1024))
+
+    @classmethod
+    def get_current(cls, settings: dict):
+        if cls.current is None:
+            cls.current = cls.from_settings(settings)
+        return cls.current
+
+    @classmethod
+    def add_listener(cls, listener):
+        cls.listeners.append(listener)
+
+    @contextmanager
+    def locked(self, offset: int = INIT_LOCK):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, offset)
+
+    @staticmethod
+    def get_key(fragment: str, key: tuple):
+        key_bytes = repr((fragment, key)).encode()
+        return key_bytes, int.from_bytes(hashlib.blake2b(key_bytes, digest_size=8).digest(), 'little') or 1
+
+    @staticmethod
+    def get_tag_slot(tag: str) -> int:
+        return int.from_bytes(hashlib.blake2b(tag.encode(), digest_size=2).digest(), 'little') % TAG_SLOTS
+
+    def get_stamps(self, tags: Iterable[str]) -> list:
+        slots = sorted({self.get_tag_slot(tag) for tag in tags})
+        return [(slot, GENERATION.unpack_from(self.map, TAG_OFFSET + slot * GENERATION.size)[0]) for slot in slots]
+
+    def is_fresh(self, stamps: list, expires: float) -> bool:
+        return (not expires or expires > time()) and all(
+            GENERATION.unpack_from(self.map, TAG_OFFSET + slot * GENERATION.size)[0] == generation
+            for slot, generation in stamps)
+
+    def get_offsets(self, hash_: int):
+        for probe in range(PROBES):
+            yield HEADER_SIZE + (hash_ + probe) % self.slots * self.slot_size
+
+    def read(self, offset: int, hash_: int, key_bytes: bytes) -> Optional[str]:
+        for _ in range(PROBES):
+            sequence, slot_hash, expires, key_size, stamp_count, value_size = SLOT_HEADER.unpack_from(self.map, offset)
+            if slot_hash != hash_:
+                return None
+            start = offset + SLOT_HEADER.size
+            end = start + stamp_count * STAMP.size + key_size + value_size
+            if sequence % 2 or end > offset + self.slot_size:
+                continue
+            payload = self.map[start:end]
+            if SEQUENCE.unpack_from(self.map, offset)[0] != sequence:
+                continue
+            stamps = [STAMP.unpack_from(payload, i * STAMP.size) for i in range(stamp_count)]
+            position = stamp_count * STAMP.size
+            if payload[position:position + key_size] != key_bytes or not self.is_fresh(stamps, expires):
+                return None
+            return payload[position + key_size:].decode()
+        return None
+
+    def get(self, fragment: str, key: tuple) -> Optional[str]:
+        key_bytes, hash_ = self.get_key(fragment, key)
+        value = None
+        for offset in self.get_offsets(hash_):
+            value = self.read(offset, hash_, key_bytes)
+            if value is not None:
+                break
+        if value is None:
+            with self.lock:
+                entry = self.local.get(key_bytes)
+                if entry is not None and self.is_fresh(entry[0], entry[1]):
+                    self.local.move_to_end(key_bytes)
+                    value = entry[2]
+        CACHE_LOOKUPS.labels(fragment, 'miss' if value is None else 'hit').inc()
+        return value
+
+    def set(self, fragment: str, key: tuple, value: str, ttl: int = 0, tags: Iterable[str] = (), stamps: list = None):
+        key_bytes, hash_ = self.get_key(fragment, key)
+        stamps = self.get_stamps(tuple(tags) or (fragment, )) if stamps is None else stamps
+        if not self.is_fresh(stamps, 0):
+            CACHE_EVICTIONS.labels('invalidated').inc()
+            return
+        expires = time() + ttl if ttl else 0
+        value_bytes = value.encode()
+        payload = b''.join(STAMP.pack(*stamp) for stamp in stamps) + key_bytes + value_bytes
+        if SLOT_HEADER.size + len(payload) > self.slot_size or len(stamps) > 0xffff or len(key_bytes) > 0xffff:
+            with self.lock:
+                self.local[key_bytes] = (stamps, expires, value)
+                self.local.move_to_end(key_bytes)
+                while len(self.local) > self.max_local_entries:
+                    self.local.popitem(last=False)
+                    CACHE_EVICTIONS.labels('size').inc()
+            return
+        with self.lock, self.locked():
+            offset, reason = self.choose_slot(hash_, key_bytes)
+            sequence = SEQUENCE.unpack_from(self.map, offset)[0] | 1
+            SEQUENCE.pack_into(self.map, offset, sequence)
+            SLOT_HEADER.pack_into(self.map, offset, sequence, hash_, expires, len(key_bytes), len(stamps),
+                                  len(value_bytes))
+            self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(payload)] = payload
+            SEQUENCE.pack_into(self.map, offset, sequence + 1)
+            self.local.pop(key_bytes, None)
+        if reason:
+            CACHE_EVICTIONS.labels(reason).inc()
+
+    def choose_slot(self, hash_: int, key_bytes: bytes):
+        offsets = list(self.get_offsets(hash_))
+        for offset in offsets:
+            _, slot_hash, _, key_size, stamp_count, _ = SLOT_HEADER.unpack_from(self.map, offset)
+            start = offset + SLOT_HEADER.size + stamp_count * STAMP.size
+            if not slot_hash or slot_hash == hash_ and self.map[start:start + key_size] == key_bytes:
+                return offset, None
+        for offset in offsets:
+            _, _, expires, _, stamp_count, _ = SLOT_HEADER.unpack_from(self.map, offset)
+            stamps = [STAMP.unpack_from(self.map, offset + SLOT_HEADER.size + i * STAMP.size)
+                      for i in range(stamp_count)]
+            if not self.is_fresh(stamps, expires):
+                return offset, 'expired'
+        return offsets[0], 'size'
+
+    def invalidate(self, *tags: str) -> int:
+        slots = {self.get_tag_slot(tag) for tag in tags}
+        with self.lock, self.locked():
+            for slot in slots:
+                offset = TAG_OFFSET + slot * GENERATION.size
+                GENERATION.pack_into(self.map, offset, GENERATION.unpack_from(self.map, offset)[0] + 1)
+        return len(slots)
+
+    def clear(self):
+        with self.lock, self.locked():
+            for offset in range(HEADER_SIZE, len(self.map), self.slot_size):
+                sequence = SEQUENCE.unpack_from(self.map, offset)[0] | 1
+                SLOT_HEADER.pack_into(self.map, offset, sequence + 1, 0, 0, 0, 0, 0)
+            self.local.clear()
+
+    def get_generation(self) -> int:
+        return GENERATION.unpack_from(self.map, HEADER.size - GENERATION.size)[0]
+
+    def bump(self) -> int:
+        with self.lock, self.locked():
+            generation = self.get_generation() + 1
+            GENERATION.pack_into(self.map, HEADER.size - GENERATION.size, generation)
+            if generation == self.seen + 1:
+                self.seen = generation
+        return generation
+
+    def sync(self) -> bool:
+        generation = self.get_generation()
+        if generation == self.seen:
+            return False
+        with self.lock:
+            if generation == self.seen:
+                return False
+            self.seen = generation
+        GENERATION_SYNCS.inc()
+        for listener in self.listeners:
+            listener()
+        return True
+
+
+fragment_cache = FragmentCache()
+
+
+def get_fragment_cache(settings: dict):
+    if settings.get('SHARED_CACHE_ENABLED'):
+        return SharedCache.get_current(settings)
+    fragment_cache.max_entries = settings.get('FRAGMENT_CACHE_MAX_ENTRIES', fragment_cache.max_entries)
+    return fragment_cache
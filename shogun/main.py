@@ -1,30 +1,162 @@
-from typing import List, Type
-import re
+from typing import List, Type, Callable
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import inspect
 from shogun.url import Url
 from shogun.view import View
 from shogun.request import Request
 from shogun.response import Response
 from shogun.exceptions import UrlNotFound, MethodNotAllowed
 from shogun.middleware import BaseMiddleware
+from shogun.timing import Timings
+from shogun.metrics import registry
+from shogun import asgi
+
+
+REQUESTS = registry.counter('shogun_requests_total', 'Handled HTTP requests', ('route', 'method', 'status'))
+REQUEST_LATENCY = registry.histogram('shogun_request_duration_seconds', 'Request handling latency', ('route', ))
 
 
 class Shogun:
 
-    __slots__ = ('urls', 'settings', 'middlewares')
+    __slots__ = ('urls', 'settings', 'middlewares', 'thread_initializer', 'executor')
 
-    def __init__(self, urls: List[Url], settings: dict, middlewares: List[Type[BaseMiddleware]]):
+    def __init__(self, urls: List[Url], settings: dict, middlewares: List[Type[BaseMiddleware]],
+                 thread_initializer: Callable = None):
         self.urls = urls
         self.settings = settings
         self.middlewares = middlewares
+        self.thread_initializer = thread_initializer
+        self.executor = None
 
     def __call__(self, environ: dict, start_response):
+        response = self.dispatch(environ)
+        start_response(str(response.status_code), list(response.headers.items()))
+        if getattr(response, 'is_file', False):
+            file_wrapper = response.get_file_wrapper(environ)
+            if file_wrapper is not None:
+                return file_wrapper
+        return response.get_chunks()
+
+    async def asgi(self, scope: dict, receive, send):
+        if scope['type'] == 'lifespan':
+            return await asgi.lifespan(self, receive, send)
+        if scope['type'] != 'http':
+            raise NotImplementedError(f'unsupported ASGI scope type {scope["type"]}')
+
+        executor = self.get_executor()
+        loop = asyncio.get_running_loop()
+        environ = asgi.build_environ(scope, asgi.AsgiInput(receive, loop))
+        token = asgi.current_executor.set(executor)
+        try:
+            response = await self.apply_middlewares_to_environ(environ)
+            if response is None and self.is_async_view(environ):
+                await asgi.read_form_body(environ)
+                response = await self.dispatch_async(environ)
+            elif response is None:
+                response = await loop.run_in_executor(executor, self.dispatch, environ)
+        except (UrlNotFound, MethodNotAllowed) as e:
+            response = Response(Request(environ, self.settings, read_body=False), f'{e.code} {e.text}', body=e.text)
+        finally:
+            asgi.current_executor.reset(token)
+        await asgi.send_response(response, send, executor)
+
+    def get_executor(self) -> ThreadPoolExecutor:
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.settings.get('ASGI_MAX_WORKERS', 8), 'shogun',
+                                               self.thread_initializer)
+        return self.executor
+
+    def compile_routes(self) -> int:
+        for url in self.urls:
+            url.compile()
+        return len(self.urls)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def dispatch(self, environ: dict) -> Response:
+        timings, start = self.begin(environ)
+        status = '500'
+        try:
+            response = self.handle(environ, timings)
+            status = response.status_code.split(' ')[0]
+        except Exception as e:
+            status = str(getattr(e, 'code', status))
+            raise
+        finally:
+            self.end(environ, timings, start, status)
+        timings.report(response)
+        return response
+
+    async def dispatch_async(self, environ: dict) -> Response:
+        timings, start = self.begin(environ)
+        status = '500'
+        try:
+            response = await self.handle_async(environ, timings)
+            status = response.status_code.split(' ')[0]
+        except Exception as e:
+            status = str(getattr(e, 'code', status))
+            raise
+        finally:
+            self.end(environ, timings, start, status)
+        timings.report(response)
+        return response
+
+    def begin(self, environ: dict):
+        return Timings.start(environ, self.settings), perf_counter()
+
+    @staticmethod
+    def end(environ: dict, timings, start: float, status: str):
+        timings.stop()
+        route = environ.get('shogun.route', '')
+        REQUESTS.labels(route, environ['REQUEST_METHOD'], status).inc()
+        REQUEST_LATENCY.labels(route).observe(perf_counter() - start)
+
+    def handle(self, environ: dict, timings) -> Response:
+        request = None
+        try:
+            view, request = self.prepare(environ, timings)
+            response = self.apply_middlewares_to_request(request)
+            timings.lap('middleware')
+            if response is None:
+                response = self.get_response(environ, view, request)
+                if inspect.iscoroutine(response):
+                    response = asgi.run_coroutine(response)
+        except Exception as e:
+            self.apply_middlewares_to_exception(request or Request(environ, self.settings, read_body=False), e)
+            raise
+        return self.finish(response, timings)
+
+    async def handle_async(self, environ: dict, timings) -> Response:
+        environ['shogun.async'] = True
+        request = None
+        try:
+            view, request = self.prepare(environ, timings)
+            response = self.apply_middlewares_to_request(request)
+            timings.lap('middleware')
+            if response is None:
+                response = await self.get_response(environ, view, request)
+        except Exception as e:
+            self.apply_middlewares_to_exception(request or Request(environ, self.settings, read_body=False), e)
+            raise
+        return self.finish(response, timings)
+
+    def prepare(self, environ: dict, timings):
         view = self.get_view(environ)
+        timings.lap('route')
         request = self.get_request(environ)
-        self.apply_middlewares_to_request(request)
-        response = self.get_response(environ, view, request)
+        timings.lap('request')
+        return view, request
+
+    def finish(self, response: Response, timings) -> Response:
+        timings.lap('view')
         self.apply_middlewares_to_response(response)
-        start_response(str(response.status_code), list(response.headers.items()))
-        return iter([response.body])
+        timings.lap('middleware')
+        return response
 
     @staticmethod
     def prepare_url(url: str) -> str:
@@ -34,16 +166,27 @@ class Shogun:
             url = url[1:]
         return url
 
-    def find_view(self, raw_url: str) -> Type[View]:
+    def find_url(self, raw_url: str) -> Url:
         url = self.prepare_url(raw_url)
         for u in self.urls:
-            if re.match(u.url, url):
-                return u.view
+            if (u.pattern or u.compile()).match(url):
+                return u
         raise UrlNotFound
 
+    def find_view(self, raw_url: str) -> Type[View]:
+        return self.find_url(raw_url).view
+
     def get_view(self, environ: dict) -> View:
-        raw_url = environ['PATH_INFO']
-        return self.find_view(raw_url)()
+        url = self.find_url(environ['PATH_INFO'])
+        environ['shogun.route'] = url.url
+        return url.view()
+
+    def is_async_view(self, environ: dict) -> bool:
+        try:
+            view = self.find_view(environ['PATH_INFO'])
+        except UrlNotFound:
+            return False
+        return inspect.iscoroutinefunction(getattr(view, environ['REQUEST_METHOD'].lower(), None))
 
     def get_request(self, environ: dict) -> Request:
         return Request(environ, self.settings)
@@ -55,9 +198,27 @@ class Shogun:
             raise MethodNotAllowed
         return getattr(view, method)(request)
 
+    async def apply_middlewares_to_environ(self, environ: dict):
+        try:
+            environ['shogun.route'] = self.find_url(environ['PATH_INFO']).url
+        except UrlNotFound:
+            return None
+        for i in self.middlewares:
+            response = await i().to_environ(environ, self.settings)
+            if response is not None:
+                return response
+        return None
+
     def apply_middlewares_to_request(self, request: Request):
         for i in self.middlewares:
-            i().to_request(request)
+            response = i().to_request(request)
+            if response is not None:
+                return response
+        return None
+
+    def apply_middlewares_to_exception(self, request: Request, exception: Exception):
+        for i in self.middlewares:
+            i().on_exception(request, exception)
 
     def apply_middlewares_to_response(self, response: Response):
         for i in self.middlewares:
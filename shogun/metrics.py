@@ -0,0 +1,192 @@
+import threading
+from bisect import bisect_left
+from typing import Tuple
+from shogun.view import View
+from shogun.request import Request
+from shogun.response import Response
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def format_labels(names: Tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+
+    __slots__ = ('lock', 'value')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self, name: str, label_names: tuple, label_values: tuple):
+        yield f'{name}{format_labels(label_names, label_values)} {format_value(self.value)}'
+
+
+class GaugeChild(CounterChild):
+
+    __slots__ = ()
+
+    def set(self, value: float):
+        with self.lock:
+            self.value = value
+
+    def dec(self, amount: float = 1):
+        with self.lock:
+            self.value -= amount
+
+
+class HistogramChild:
+
+    __slots__ = ('lock', 'buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple):
+        self.lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+
+    def observe(self, value: float):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def samples(self, name: str, label_names: tuple, label_values: tuple):
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float('inf')), counts):
+            cumulative += count
+            le = f'le="{format_value(bound)}"'
+            yield f'{name}_bucket{format_labels(label_names, label_values, le)} {cumulative}'
+        yield f'{name}_sum{format_labels(label_names, label_values)} {format_value(total)}'
+        yield f'{name}_count{format_labels(label_names, label_values)} {cumulative}'
+
+
+class Metric:
+
+    type_ = ''
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *label_values):
+        child = self.children.get(label_values)
+        if child is None:
+            with self.lock:
+                child = self.children.get(label_values)
+                if child is None:
+                    child = self.children[label_values] = self.new_child()
+        return child
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_}']
+        for label_values, child in list(self.children.items()):
+            lines.extend(child.samples(self.name, self.label_names, label_values))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    type_ = 'counter'
+
+    def new_child(self):
+        return CounterChild()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+
+    type_ = 'gauge'
+
+    def new_child(self):
+        return GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.labels().dec(amount)
+
+
+class Histogram(Metric):
+
+    type_ = 'histogram'
+
+    def __init__(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def new_child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Tuple[str, ...] = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in list(self.metrics.values())) + '\n'
+
+
+registry = Registry()
+
+
+class MetricsView(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        return Response(request, headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'},
+                        body=registry.render())
@@ -1,17 +1,25 @@
 from urllib.parse import parse_qs
 from uuid import uuid4
+from time import monotonic
 from shogun.request import Request
 from shogun.response import Response
+from shogun.admission import Admission, SHED, WAIT_TIME
 
 
 class BaseMiddleware:
 
+    async def to_environ(self, environ: dict, settings: dict):
+        pass
+
     def to_request(self, request: Request):
         pass
 
     def to_response(self, response: Response):
         pass
 
+    def on_exception(self, request: Request, exception: Exception):
+        pass
+
 
 class Session(BaseMiddleware):
 
@@ -30,4 +38,89 @@ class Session(BaseMiddleware):
             response.update_headers({'Set-Cookie': f'session_id={uuid4()}'})
 
 
-middlewares = [Session]
\ No newline at end of file
+class ReleasingBody:
+
+    def __init__(self, body, release):
+        self.body = body
+        self.release = release
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            if hasattr(self.body, 'close'):
+                self.body.close()
+        finally:
+            if not self.released:
+                self.released = True
+                self.release()
+
+
+class AdmissionControl(BaseMiddleware):
+
+    admission = None
+
+    @classmethod
+    def get_admission(cls, settings: dict) -> Admission:
+        if cls.admission is None:
+            cls.admission = Admission.from_settings(settings)
+        return cls.admission
+
+    @staticmethod
+    def get_deadline(route: str, settings: dict) -> float:
+        timeout = settings.get('ADMISSION_ROUTE_TIMEOUTS', {}).get(route, settings.get('ADMISSION_QUEUE_TIMEOUT', 1.0))
+        return monotonic() + timeout
+
+    @staticmethod
+    def shed(request: Request, route: str, reason: str) -> Response:
+        SHED.labels(route, reason).inc()
+        retry_after = request.settings.get('ADMISSION_RETRY_AFTER', 1)
+        return Response(request, '503 Service Unavailable', {'Retry-After': str(retry_after)}, 'Service Unavailable')
+
+    async def to_environ(self, environ: dict, settings: dict):
+        if not settings.get('ADMISSION_ENABLED', False):
+            return None
+        route = environ['shogun.route']
+        start = monotonic()
+        reason = await self.get_admission(settings).acquire_async(route, self.get_deadline(route, settings))
+        WAIT_TIME.labels(route).observe(monotonic() - start)
+        if reason is not None:
+            return self.shed(Request(environ, settings, read_body=False), route, reason)
+        environ['shogun.admission'] = route
+        return None
+
+    def to_request(self, request: Request):
+        settings = request.settings
+        environ = request.environ
+        if not settings.get('ADMISSION_ENABLED', False) or 'shogun.admission' in environ:
+            return None
+        route = environ.get('shogun.route', '')
+        start = monotonic()
+        admission = self.get_admission(settings)
+        reason = admission.acquire(route, self.get_deadline(route, settings), 'shogun.async' not in environ)
+        WAIT_TIME.labels(route).observe(monotonic() - start)
+        if reason is not None:
+            return self.shed(request, route, reason)
+        environ['shogun.admission'] = route
+        return None
+
+    def release(self, request: Request):
+        route = request.environ.pop('shogun.admission', None)
+        if route is not None:
+            self.admission.release(route)
+
+    def to_response(self, response: Response):
+        if response.is_streaming and not response.is_async and not getattr(response, 'is_file', False):
+            route = response.request.environ.pop('shogun.admission', None)
+            if route is not None:
+                response.body = ReleasingBody(response.body, lambda: self.admission.release(route))
+            return
+        self.release(response.request)
+
+    def on_exception(self, request: Request, exception: Exception):
+        self.release(request)
+
+
+middlewares = [AdmissionControl, Session]
\ No newline at end of file
@@ -1,14 +1,18 @@
 from urllib.parse import parse_qs
 
 
+FORM_CONTENT_TYPES = ('application/x-www-form-urlencoded', 'text/plain')
+
+
 class Request:
 
-    def __init__(self, environ: dict, settings: dict):
+    def __init__(self, environ: dict, settings: dict, read_body: bool = True):
         self.environ = environ
         self.GET = {}
         self.POST = {}
         self.build_get_params_dict(environ['QUERY_STRING'])
-        self.build_post_params_dict(self.get_post_data())
+        if read_body and self.is_form:
+            self.build_post_params_dict(self.get_post_data())
         self.settings = settings
         self.extra = {}
         self.set_base_url()
@@ -19,10 +23,23 @@ class Request:
     def build_get_params_dict(self, raw_params: str):
         self.GET = parse_qs(raw_params)
 
+    @property
+    def is_form(self) -> bool:
+        content_type = self.environ.get('CONTENT_TYPE', '')
+        return not content_type or content_type.startswith(FORM_CONTENT_TYPES)
+
+    @property
+    def content_length(self) -> int:
+        content_length = self.environ.get('CONTENT_LENGTH')
+        return int(content_length) if content_length else 0
+
+    @property
+    def stream(self):
+        return self.environ['wsgi.input']
+
     def get_post_data(self):
-        content_length = self.environ['CONTENT_LENGTH']
-        content_length = int(content_length) if content_length else 0
-        data = self.environ['wsgi.input'].read(content_length) if content_length > 0 else b''
+        content_length = self.content_length
+        data = self.stream.read(content_length) if content_length > 0 else b''
         return data
 
     def build_post_params_dict(self, raw_bytes: bytes):
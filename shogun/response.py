@@ -1,8 +1,14 @@
+import os
+from time import perf_counter
 from shogun.request import Request
+from shogun.timing import Timings
 
 
 class Response:
 
+    is_streaming = False
+    is_async = False
+
     def __init__(self, request: Request, status_code: str = '200 OK', headers: dict = None, body: str = ''):
         self.status_code = status_code
         self.headers = {}
@@ -21,10 +27,113 @@ class Response:
         self.headers = {'Content-Type': 'text/html; charset=utf-8', 'Content-Length': '0'}
 
     def set_body(self, raw_body: str):
+        timings = Timings.get_current()
+        start = perf_counter()
         self.body = raw_body.encode('utf-8')
         self.update_headers(
             {'Content-Length': str(len(self.body))}
         )
+        if timings:
+            timings.split('encode', perf_counter() - start)
 
     def update_headers(self, headers: dict):
         self.headers.update(headers)
+
+    def get_chunks(self):
+        return [self.body]
+
+
+class StreamingResponse(Response):
+
+    is_streaming = True
+
+    def __init__(self, request: Request, status_code: str = '200 OK', headers: dict = None, body=()):
+        super().__init__(request, status_code, headers, body)
+        self.headers.pop('Content-Length', None)
+
+    def set_body(self, raw_body):
+        self.body = raw_body
+
+    @property
+    def is_async(self) -> bool:
+        return hasattr(self.body, '__aiter__')
+
+    @staticmethod
+    def encode(chunk) -> bytes:
+        return chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+    def get_chunks(self):
+        return Chunks(self)
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+
+    async def encode_async(self):
+        try:
+            async for chunk in self.body:
+                if chunk:
+                    yield self.encode(chunk)
+        finally:
+            if hasattr(self.body, 'aclose'):
+                await self.body.aclose()
+
+
+class Chunks:
+
+    def __init__(self, response: StreamingResponse):
+        self.response = response
+        self.chunks = iter(response.body)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        try:
+            chunk = next(self.chunks)
+            while not chunk:
+                chunk = next(self.chunks)
+        except StopIteration:
+            self.close()
+            raise
+        return self.response.encode(chunk)
+
+    def close(self):
+        self.response.close()
+
+
+class FileResponse(StreamingResponse):
+
+    is_file = True
+    chunk_size = 64 * 1024
+
+    def __init__(self, request: Request, path: str, offset: int = 0, length: int = None, status_code: str = '200 OK',
+                 headers: dict = None, head_only: bool = False):
+        super().__init__(request, status_code, headers)
+        self.path = path
+        self.size = os.path.getsize(path)
+        self.offset = offset
+        self.length = self.size - offset if length is None else length
+        self.head_only = head_only
+        self.headers['Content-Length'] = str(self.length)
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def get_file_wrapper(self, environ: dict):
+        if self.head_only or self.offset or self.length != self.size or 'wsgi.file_wrapper' not in environ:
+            return None
+        return environ['wsgi.file_wrapper'](self.open(), self.chunk_size)
+
+    def get_chunks(self):
+        if self.head_only:
+            return
+        with self.open() as f:
+            f.seek(self.offset)
+            remaining = self.length
+            while remaining > 0:
+                chunk = f.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
@@ -0,0 +1,295 @@
+import os
+import asyncio
+import traceback
+from http import HTTPStatus
+from urllib.parse import unquote
+
+
+MAX_HEAD_SIZE = 64 * 1024
+READ_SIZE = 64 * 1024
+
+
+class BadRequest(Exception):
+    pass
+
+
+class RequestBody:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, headers: dict):
+        self.reader = reader
+        self.writer = writer
+        self.chunked = headers.get(b'transfer-encoding', b'').lower() == b'chunked'
+        self.remaining = 0 if self.chunked else int(headers.get(b'content-length', b'0') or 0)
+        self.expect_continue = headers.get(b'expect', b'').lower() == b'100-continue'
+        self.complete = not self.chunked and not self.remaining
+        self.received = False
+        self.disconnected = asyncio.Event()
+
+    async def read_chunk(self) -> bytes:
+        if self.expect_continue:
+            self.expect_continue = False
+            self.writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+            await self.writer.drain()
+        if self.chunked:
+            size = int((await self.reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if not size:
+                while await self.reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                self.complete = True
+                return b''
+            data = await self.reader.readexactly(size)
+            await self.reader.readexactly(2)
+            return data
+        data = await self.reader.read(min(self.remaining, READ_SIZE))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', self.remaining)
+        self.remaining -= len(data)
+        self.complete = not self.remaining
+        return data
+
+    async def receive(self) -> dict:
+        if self.complete and self.received:
+            await self.disconnected.wait()
+            return {'type': 'http.disconnect'}
+        self.received = True
+        if self.complete:
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        try:
+            data = await self.read_chunk()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.disconnected.set()
+            return {'type': 'http.disconnect'}
+        return {'type': 'http.request', 'body': data, 'more_body': not self.complete}
+
+    async def discard(self) -> bool:
+        while not self.complete and not self.expect_continue:
+            await self.read_chunk()
+        return self.complete
+
+
+class ResponseWriter:
+
+    def __init__(self, writer: asyncio.StreamWriter, method: str, version: str, keep_alive: bool):
+        self.writer = writer
+        self.head_only = method == 'HEAD'
+        self.version = version
+        self.keep_alive = keep_alive
+        self.status = 500
+        self.headers = []
+        self.started = False
+        self.finished = False
+        self.chunked = False
+
+    def write_head(self, body: bytes, more_body: bool):
+        names = {name.lower() for name, _ in self.headers}
+        headers = list(self.headers)
+        if b'content-length' not in names:
+            if not more_body:
+                headers.append((b'content-length', str(len(body)).encode('latin-1')))
+            elif self.version == 'HTTP/1.1':
+                self.chunked = True
+                headers.append((b'transfer-encoding', b'chunked'))
+            else:
+                self.keep_alive = False
+        headers.append((b'connection', b'keep-alive' if self.keep_alive else b'close'))
+        try:
+            phrase = HTTPStatus(self.status).phrase
+        except ValueError:
+            phrase = ''
+        lines = [f'{self.version} {self.status} {phrase}'.encode('latin-1')]
+        lines += [name + b': ' + value for name, value in headers]
+        self.writer.write(b'\r\n'.join(lines) + b'\r\n\r\n')
+        self.started = True
+
+    async def send_file(self, message: dict):
+        file = message['file']
+        offset = message.get('offset', 0)
+        count = message.get('count')
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        more_body = message.get('more_body', False)
+        if not self.started:
+            self.write_head(b'', True)
+        if not self.head_only and count:
+            if self.chunked:
+                self.writer.write(b'%x\r\n' % count)
+            await self.writer.drain()
+            await asyncio.get_running_loop().sendfile(self.writer.transport, file, offset, count)
+            if self.chunked:
+                self.writer.write(b'\r\n')
+        if self.chunked and not more_body and not self.head_only:
+            self.writer.write(b'0\r\n\r\n')
+        self.finished = not more_body
+        await self.writer.drain()
+
+    async def send(self, message: dict):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+            self.headers = [(bytes(name), bytes(value)) for name, value in message.get('headers', [])]
+            return
+        if message['type'] == 'http.response.zerocopy' and not self.finished:
+            return await self.send_file(message)
+        if message['type'] != 'http.response.body' or self.finished:
+            return
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if not self.started:
+            self.write_head(body, more_body)
+        if not self.head_only:
+            if self.chunked:
+                if body:
+                    self.writer.write(b'%x\r\n%s\r\n' % (len(body), body))
+                if not more_body:
+                    self.writer.write(b'0\r\n\r\n')
+            elif body:
+                self.writer.write(body)
+        self.finished = not more_body
+        await self.writer.drain()
+
+
+class Connection:
+
+    def __init__(self, app, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.app = app
+        self.reader = reader
+        self.writer = writer
+        self.server = writer.get_extra_info('sockname')
+        self.client = writer.get_extra_info('peername')
+
+    async def read_request(self):
+        try:
+            head = await self.reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise BadRequest('request head too large')
+        lines = head[:-4].split(b'\r\n')
+        try:
+            method, target, version = lines[0].decode('latin-1').split(' ')
+            headers = []
+            for line in lines[1:]:
+                name, value = line.split(b':', 1)
+                headers.append((name.strip().lower(), value.strip()))
+        except ValueError:
+            raise BadRequest('malformed request head')
+        path, _, query = target.partition('?')
+        return {
+            'type': 'http',
+            'asgi': {'version': '3.0', 'spec_version': '2.3'},
+            'http_version': version.split('/')[-1],
+            'method': method.upper(),
+            'scheme': 'http',
+            'path': unquote(path, 'latin-1'),
+            'raw_path': path.encode('latin-1'),
+            'query_string': query.encode('latin-1'),
+            'root_path': '',
+            'headers': headers,
+            'extensions': {'http.response.zerocopy': {}},
+            'client': self.client[:2] if self.client else None,
+            'server': self.server[:2] if self.server else None,
+        }
+
+    @staticmethod
+    def wants_keep_alive(scope: dict) -> bool:
+        connection = dict(scope['headers']).get(b'connection', b'').lower()
+        if scope['http_version'] == '1.1':
+            return connection != b'close'
+        return connection == b'keep-alive'
+
+    async def handle(self, scope: dict) -> bool:
+        body = RequestBody(self.reader, self.writer, dict(scope['headers']))
+        response = ResponseWriter(self.writer, scope['method'], f'HTTP/{scope["http_version"]}',
+                                  self.wants_keep_alive(scope))
+        try:
+            await self.app(scope, body.receive, response.send)
+        except ConnectionError:
+            return False
+        except Exception:
+            traceback.print_exc()
+            if not response.started:
+                response.keep_alive = False
+                await response.send({'type': 'http.response.start', 'status': 500,
+                                     'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+                await response.send({'type': 'http.response.body', 'body': b'Internal Server Error'})
+            return False
+        finally:
+            body.disconnected.set()
+        if not response.finished:
+            return False
+        return response.keep_alive and await body.discard()
+
+    async def serve(self):
+        try:
+            while True:
+                try:
+                    scope = await self.read_request()
+                except BadRequest as e:
+                    self.writer.write(b'HTTP/1.1 400 Bad Request\r\nconnection: close\r\ncontent-length: %d\r\n\r\n%s'
+                                      % (len(str(e)), str(e).encode('latin-1')))
+                    break
+                if scope is None or not await self.handle(scope):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+
+class Lifespan:
+
+    def __init__(self, app):
+        self.app = app
+        self.messages = asyncio.Queue()
+        self.started = asyncio.Event()
+        self.stopped = asyncio.Event()
+        self.task = None
+
+    async def send(self, message: dict):
+        if message['type'].startswith('lifespan.startup'):
+            self.started.set()
+        elif message['type'].startswith('lifespan.shutdown'):
+            self.stopped.set()
+
+    async def run(self):
+        try:
+            await self.app({'type': 'lifespan', 'asgi': {'version': '3.0'}}, self.messages.get, self.send)
+        except Exception:
+            pass
+        finally:
+            self.started.set()
+            self.stopped.set()
+
+    async def startup(self):
+        self.task = asyncio.create_task(self.run())
+        await self.messages.put({'type': 'lifespan.startup'})
+        await self.started.wait()
+
+    async def shutdown(self):
+        await self.messages.put({'type': 'lifespan.shutdown'})
+        await self.stopped.wait()
+
+
+async def serve(app, host: str = '', port: int = 8000):
+    lifespan = Lifespan(app)
+    await lifespan.startup()
+
+    async def on_connection(reader, writer):
+        await Connection(app, reader, writer).serve()
+
+    server = await asyncio.start_server(on_connection, host or None, port, limit=MAX_HEAD_SIZE)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await lifespan.shutdown()
+
+
+def run(app, host: str = '', port: int = 8000):
+    try:
+        asyncio.run(serve(app, host, port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,190 @@
+import os
+import re
+import sys
+import gzip
+import shutil
+import hashlib
+import argparse
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from shogun.view import View
+from shogun.request import Request
+from shogun.response import Response, FileResponse
+from shogun.exceptions import UrlNotFound
+
+
+FINGERPRINT_PATTERN = re.compile(r'^(?P<stem>.+)\.(?P<hash>[0-9a-f]{12})(?P<suffix>\.[^./]+)$')
+RANGE_PATTERN = re.compile(r'^bytes=(?P<start>\d*)-(?P<end>\d*)$')
+HASH_LENGTH = 12
+READ_SIZE = 64 * 1024
+
+
+class StaticFiles:
+
+    hashes = {}
+
+    def __init__(self, directory: str, url: str = '/static/', max_age: int = 31536000):
+        self.directory = os.path.realpath(directory)
+        self.url_prefix = url
+        self.max_age = max_age
+
+    def find(self, name: str):
+        path = os.path.realpath(os.path.join(self.directory, name))
+        if not path.startswith(self.directory + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def get_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        cached = self.hashes.get(path)
+        if cached is None or cached[0] != stamp:
+            file_hash = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                    file_hash.update(chunk)
+            cached = self.hashes[path] = (stamp, file_hash.hexdigest()[:HASH_LENGTH])
+        return cached[1]
+
+    def url(self, name: str) -> str:
+        path = self.find(name)
+        if path is None:
+            return f'{self.url_prefix}{name}'
+        stem, suffix = os.path.splitext(name)
+        return f'{self.url_prefix}{stem}.{self.get_hash(path)}{suffix}'
+
+    def resolve(self, name: str):
+        fingerprint = FINGERPRINT_PATTERN.match(name)
+        if fingerprint:
+            path = self.find(fingerprint.group('stem') + fingerprint.group('suffix'))
+            if path is not None:
+                return path, self.get_hash(path) == fingerprint.group('hash')
+        return self.find(name), False
+
+    @staticmethod
+    def has_gzip(path: str) -> bool:
+        try:
+            return os.path.getmtime(f'{path}.gz') >= os.path.getmtime(path)
+        except OSError:
+            return False
+
+    def iter_files(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.gz'):
+                    yield os.path.join(root, name)
+
+    def compress(self, min_size: int = 256) -> int:
+        count = 0
+        for path in self.iter_files():
+            if os.path.getsize(path) < min_size or self.has_gzip(path):
+                continue
+            with open(path, 'rb') as source, gzip.open(f'{path}.gz.tmp', 'wb', 9) as target:
+                shutil.copyfileobj(source, target, READ_SIZE)
+            os.replace(f'{path}.gz.tmp', f'{path}.gz')
+            count += 1
+        return count
+
+    def precompute(self) -> int:
+        count = 0
+        for path in self.iter_files():
+            self.get_hash(path)
+            count += 1
+        return count
+
+
+def get_static_files(settings: dict) -> StaticFiles:
+    return StaticFiles(os.path.join(settings.get('BASE_DIR', ''), settings.get('STATIC_DIR_NAME', 'static')),
+                       settings.get('STATIC_URL', '/static/'), settings.get('STATIC_MAX_AGE', 31536000))
+
+
+def get_range(header: str, size: int):
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or not (match.group('start') or match.group('end')):
+        return None
+    if not match.group('start'):
+        return max(size - int(match.group('end')), 0), size - 1
+    start = int(match.group('start'))
+    end = min(int(match.group('end')), size - 1) if match.group('end') else size - 1
+    return start, end
+
+
+def is_not_modified(environ: dict, etag: str, mtime: float) -> bool:
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [i.strip().removeprefix('W/') for i in if_none_match.split(',')]
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class StaticView(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        return self.serve(request)
+
+    def head(self, request: Request, *args, **kwargs) -> Response:
+        return self.serve(request, head_only=True)
+
+    @staticmethod
+    def serve(request: Request, head_only: bool = False) -> Response:
+        static = get_static_files(request.settings)
+        name = request.environ['PATH_INFO'].lstrip('/')[len(static.url_prefix.lstrip('/')):]
+        path, immutable = static.resolve(name)
+        if path is None:
+            return Response(request, f'{UrlNotFound.code} {UrlNotFound.text}', body=UrlNotFound.text)
+
+        environ = request.environ
+        etag = f'"{static.get_hash(path)}"'
+        mtime = os.path.getmtime(path)
+        headers = {
+            'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'Cache-Control': f'public, max-age={static.max_age}, immutable' if immutable else 'no-cache',
+            'Last-Modified': formatdate(mtime, usegmt=True),
+            'Accept-Ranges': 'bytes',
+            'Vary': 'Accept-Encoding',
+        }
+        range_header = environ.get('HTTP_RANGE')
+        if range_header and environ.get('HTTP_IF_RANGE', etag) not in (etag, headers['Last-Modified']):
+            range_header = None
+
+        if not range_header and 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', '') and static.has_gzip(path):
+            path = f'{path}.gz'
+            etag = f'{etag[:-1]}-gzip"'
+            headers['Content-Encoding'] = 'gzip'
+        headers['ETag'] = etag
+
+        if is_not_modified(environ, etag, mtime):
+            response = Response(request, '304 Not Modified', headers)
+            response.headers.pop('Content-Length')
+            response.headers.pop('Content-Type')
+            return response
+        if not range_header:
+            return FileResponse(request, path, headers=headers, head_only=head_only)
+
+        size = os.path.getsize(path)
+        byte_range = get_range(range_header, size)
+        if byte_range is None:
+            return FileResponse(request, path, headers=headers, head_only=head_only)
+        start, end = byte_range
+        if start >= size or start > end:
+            return Response(request, '416 Range Not Satisfiable', {**headers, 'Content-Range': f'bytes */{size}'})
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        return FileResponse(request, path, start, end - start + 1, '206 Partial Content', headers, head_only)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Precompress static files next to their sources')
+    parser.add_argument('directory')
+    parser.add_argument('--min-size', type=int, default=256)
+    args = parser.parse_args(argv)
+    print(f'{StaticFiles(args.directory).compress(args.min_size)} files compressed')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,22 +1,93 @@
 import os
 import re
-from typing import List
+import json
+import hashlib
+import tempfile
+from time import perf_counter
+from typing import List, Tuple
 from shogun.request import Request
+from shogun.timing import Timings
+from shogun.metrics import registry
+from shogun.cache import FragmentCache, get_fragment_cache
+from shogun.static import StaticFiles, get_static_files
 
 
 BASE_PATTERN = re.compile(r'{% extends (?P<base>[a-zA-Z_]+) %}')
 BASE_BLOCK_PATTERN = re.compile(r'{% block [a-zA-Z_]+ %}')
 INCLUDE_PATTERN = re.compile(r'{% include [a-zA-Z_]+ %}')
-FOR_PATTERN = re.compile(r'{% [a-zA-Z_]+ : for [a-zA-Z_]+ in [a-zA-Z_]+ %}')
-IF_PATTERN = re.compile(r'{% [a-zA-Z_]+ : if .+ %}')
-VAR_PATTERN = re.compile(r'{{ (?P<variable>[a-zA-Z0-9_.\[\]"\']+) }}')
+TOKEN_PATTERN = re.compile(r'({%.*?%}|{{ [a-zA-Z0-9_.\[\]"\']+ }})')
+FOR_PATTERN = re.compile(r'{% (?P<name>[a-zA-Z_]+) : for (?P<variable>[a-zA-Z_]+) in (?P<seq>[a-zA-Z_]+) %}$')
+IF_PATTERN = re.compile(r'{% (?P<name>[a-zA-Z_]+) : if (?P<left>.+) == (?P<right>.+) %}$')
+CACHE_PATTERN = re.compile(
+    r'{% cache (?P<name>[a-zA-Z_]+) (?P<key>[a-zA-Z0-9_.,-]+) (?P<ttl>\d+)(?: (?P<tags>[a-zA-Z_,]+))? %}$')
+STATIC_PATTERN = re.compile(r'{% static (?P<path>[a-zA-Z0-9_./-]+) %}$')
+END_PATTERN = re.compile(r'{% end(?P<kind>for|if|cache) (?P<name>[a-zA-Z_]+) %}$')
+ELSE_TAG = '{% else %}'
+COMPILER_VERSION = 2
+MINIFY_TOKEN_PATTERN = re.compile(
+    r'<(?P<raw>pre|textarea|script|style)\b.*?</(?P=raw)\s*>|<!--.*?-->|{%.*?%}|{{.*?}}|<[^>]*>|\s+', re.I | re.S)
+BLOCK_TAG_PATTERN = re.compile(
+    r'</?(?:html|head|body|title|meta|link|base|script|style|noscript|div|p|table|caption|colgroup|col|thead|tbody|'
+    r'tfoot|tr|th|td|ul|ol|li|dl|dt|dd|form|fieldset|legend|h[1-6]|hr|br|header|footer|nav|section|article|aside|'
+    r'main|option|optgroup|pre)\b|<!doctype', re.I)
+
+RENDER_LATENCY = registry.histogram('template_render_duration_seconds', 'Template render time', ('template', ))
+COMPILATIONS = registry.counter('template_compilations_total', 'Templates compiled or loaded from the disk cache',
+                                ('source', ))
+MINIFIED_BYTES = registry.gauge('template_minified_bytes_saved', 'Source bytes removed by minification',
+                                ('template', ))
+
+
+def tokenize_html(source: str) -> List[str]:
+    tokens = []
+    position = 0
+    for match in MINIFY_TOKEN_PATTERN.finditer(source):
+        if match.start() > position:
+            tokens.append(source[position:match.start()])
+        tokens.append(match.group())
+        position = match.end()
+    if position < len(source):
+        tokens.append(source[position:])
+    return tokens
+
+
+def minify_html(source: str) -> str:
+    tokens = tokenize_html(source)
+    transparent = [i.isspace() or i.startswith(('{%', '<!--')) and not i.startswith('{% static ') for i in tokens]
+    blocks = [bool(BLOCK_TAG_PATTERN.match(i)) for i in tokens]
+    before = [True] * len(tokens)
+    block = True
+    for index, token in enumerate(tokens):
+        before[index] = block
+        if not transparent[index]:
+            block = blocks[index]
+    result = []
+    block = True
+    for index in range(len(tokens) - 1, -1, -1):
+        token = tokens[index]
+        if not token.isspace():
+            result.append(token)
+        elif not before[index] and not block:
+            result.append(' ')
+        if not transparent[index]:
+            block = blocks[index]
+    return ''.join(reversed(result))
 
 
 class Engine:
 
-    def __init__(self, base_dir: str, templates_dir_name: str, includes_dir_name: str):
+    compiled = {}
+
+    def __init__(self, base_dir: str, templates_dir_name: str, includes_dir_name: str, cache: FragmentCache = None,
+                 cache_dir: str = None, auto_reload: bool = True, static: StaticFiles = None, minify: bool = False):
         self.template_dir = os.path.join(base_dir, templates_dir_name)
         self.include_dir = os.path.join(self.template_dir, includes_dir_name)
+        self.cache = cache
+        self.cache_dir = cache_dir
+        self.auto_reload = auto_reload
+        self.static = static
+        self.minify = minify
+        self.dependencies = None
 
     def get_template_as_string(self, template_name: str, include: bool = False) -> str:
         template_path = os.path.join(self.template_dir, template_name)
@@ -24,9 +95,18 @@ class Engine:
             template_path = os.path.join(self.include_dir, template_name)
         if not os.path.isfile(template_path):
             raise Exception(f'{template_path} is not a file')
+        if self.dependencies is not None:
+            self.dependencies.append(os.path.relpath(template_path, self.template_dir))
         with open(template_path) as f:
             return f.read()
 
+    def get_template_names(self) -> List[str]:
+        names = []
+        for root, dirs, files in os.walk(self.template_dir):
+            dirs[:] = [i for i in dirs if os.path.join(root, i) != self.include_dir]
+            names += [os.path.relpath(os.path.join(root, i), self.template_dir) for i in files if i.endswith('.html')]
+        return sorted(names)
+
     @staticmethod
     def check_base(block: str) -> bool:
         return bool(BASE_PATTERN.search(block))
@@ -35,31 +115,11 @@ class Engine:
     def get_block_pattern(block_name: str):
         return re.compile(fr'{{% block {block_name} %}}(?P<content>[\S\s]+)(?={{% endblock {block_name} %}}){{% endblock {block_name} %}}')
 
-    @staticmethod
-    def get_if_pattern(block_name: str):
-        return re.compile(
-            fr'{{% {block_name} : if (?P<left_variable>.+) == (?P<right_variable>.+) %}}(?P<if_true>[\S\s]+)(?={{% else %}}){{% else %}}(?P<if_false>[\S\s]+)(?={{% endif {block_name} %}}){{% endif {block_name} %}}')
-
-    @staticmethod
-    def get_for_pattern(block_name: str):
-        return re.compile(
-            fr'{{% {block_name} : for (?P<variable>[a-zA-Z_]+) in (?P<seq>[a-zA-Z_]+) %}}(?P<content>[\S\s]+)(?={{% endfor {block_name} %}}){{% endfor {block_name} %}}')
-
     @staticmethod
     def get_blocks_names(block: str) -> List[str]:
         base_blocks = BASE_BLOCK_PATTERN.findall(block)
         return [i.replace('{% block ', '').replace(' %}', '') for i in base_blocks]
 
-    @staticmethod
-    def get_if_names(block: str) -> List[str]:
-        used_if = IF_PATTERN.findall(block)
-        return [i[3:i.find(':') - 1] for i in used_if]
-
-    @staticmethod
-    def get_for_names(block: str) -> List[str]:
-        used_for = FOR_PATTERN.findall(block)
-        return [i[3:i.find(':') - 1] for i in used_for]
-
     def build_includes(self, block: str) -> str:
         used_includes = INCLUDE_PATTERN.findall(block)
         if not used_includes:
@@ -88,67 +148,222 @@ class Engine:
 
         return base_block
 
-    @staticmethod
-    def build_vars(context: dict, block: str) -> str:
-        used_vars = VAR_PATTERN.findall(block)
-        if not used_vars:
-            return block
+    def load_source(self, template_name: str) -> Tuple[str, List[str]]:
+        self.dependencies = []
+        try:
+            template = self.get_template_as_string(template_name)
+            if self.check_base(template):
+                template = self.build_base(template)
+            return self.build_includes(template), self.dependencies
+        finally:
+            self.dependencies = None
 
-        for var in used_vars:
-            template_var = '{{ %s }}' % var
-            if var.find('.') != -1:
-                variable = var[:var.find('.')]
-                param = var[var.find('.') + 1:]
-                context_var = str(context.get(variable, '').__getattribute__(param))
+    @staticmethod
+    def parse(source: str) -> list:
+        nodes = []
+        stack = []
+        body = nodes
+        for token in TOKEN_PATTERN.split(source):
+            if not token:
+                continue
+            if token.startswith('{{ '):
+                variable, _, param = token[3:-3].partition('.')
+                body.append(['var', variable, param])
+                continue
+            for_tag = FOR_PATTERN.match(token)
+            if_tag = IF_PATTERN.match(token)
+            cache_tag = CACHE_PATTERN.match(token)
+            end_tag = END_PATTERN.match(token)
+            static_tag = STATIC_PATTERN.match(token)
+            if static_tag:
+                body.append(['static', static_tag.group('path')])
+                continue
+            elif for_tag:
+                node = ['for', for_tag.group('name'), for_tag.group('variable'), for_tag.group('seq'), []]
+                child = node[4]
+            elif if_tag:
+                node = ['if', if_tag.group('name'), Engine.parse(if_tag.group('left')),
+                        Engine.parse(if_tag.group('right')), [], []]
+                child = node[4]
+            elif cache_tag:
+                key = cache_tag.group('key')
+                node = ['cache', cache_tag.group('name'), [] if key == '-' else key.split(','),
+                        int(cache_tag.group('ttl')), [i for i in (cache_tag.group('tags') or '').split(',') if i], []]
+                child = node[5]
+            elif token == ELSE_TAG and stack and stack[-1][0][0] == 'if':
+                body = stack[-1][0][5]
+                continue
+            elif end_tag:
+                if not stack or stack[-1][0][:2] != [end_tag.group('kind'), end_tag.group('name')]:
+                    raise Exception(f'unexpected {token}')
+                body = stack.pop()[1]
+                continue
             else:
-                context_var = str(context.get(var, ''))
-            block = re.sub(template_var, context_var, block)
-
-        return block
+                body.append(token)
+                continue
+            body.append(node)
+            stack.append((node, body))
+            body = child
+        if stack:
+            raise Exception(f'{{% {stack[-1][0][1]} %}} is not closed')
+        return nodes
+
+    def get_stamp(self, dependencies: List[str]) -> tuple:
+        stamp = []
+        for dependency in dependencies:
+            stat = os.stat(os.path.join(self.template_dir, dependency))
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(stamp)
+
+    def get_source_hash(self, dependencies: List[str]) -> str:
+        source_hash = hashlib.sha256(f'{COMPILER_VERSION}:{int(self.minify)}'.encode())
+        for dependency in dependencies:
+            source_hash.update(dependency.encode())
+            with open(os.path.join(self.template_dir, dependency), 'rb') as f:
+                source_hash.update(f.read())
+        return source_hash.hexdigest()
+
+    def get_cache_path(self, template_name: str) -> str:
+        return os.path.join(self.cache_dir, f'{template_name}.min.json' if self.minify else f'{template_name}.json')
+
+    def get_key(self, template_name: str) -> tuple:
+        return os.path.join(self.template_dir, template_name), self.minify
+
+    def read_cache(self, template_name: str):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.get_cache_path(template_name)) as f:
+                compiled = json.load(f)
+            if compiled['hash'] == self.get_source_hash(compiled['dependencies']):
+                return compiled
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def write_cache(self, template_name: str, compiled: dict):
+        if not self.cache_dir:
+            return
+        cache_path = self.get_cache_path(template_name)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path), suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(compiled, f)
+            os.replace(temp_path, cache_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def compile(self, template_name: str) -> bool:
+        compiled = self.read_cache(template_name)
+        from_cache = compiled is not None
+        if not from_cache:
+            source, dependencies = self.load_source(template_name)
+            if self.minify:
+                minified = minify_html(source)
+                MINIFIED_BYTES.labels(template_name).set(len(source.encode()) - len(minified.encode()))
+                source = minified
+            compiled = {'hash': self.get_source_hash(dependencies), 'dependencies': dependencies,
+                        'nodes': self.parse(source)}
+            self.write_cache(template_name, compiled)
+        COMPILATIONS.labels('disk' if from_cache else 'source').inc()
+        self.compiled[self.get_key(template_name)] = (
+            compiled['dependencies'], self.get_stamp(compiled['dependencies']), compiled['nodes'])
+        return from_cache
+
+    def get_nodes(self, template_name: str) -> list:
+        compiled = self.compiled.get(self.get_key(template_name))
+        if compiled is None or self.auto_reload and self.get_stamp(compiled[0]) != compiled[1]:
+            self.compile(template_name)
+            compiled = self.compiled[self.get_key(template_name)]
+        return compiled[2]
 
-    def build_if(self, context: dict, block: str) -> str:
-        if_names = self.get_if_names(block)
+    @staticmethod
+    def get_var(context: dict, var: str):
+        if var.find('.') != -1:
+            variable = var[:var.find('.')]
+            param = var[var.find('.') + 1:]
+            return context.get(variable, '').__getattribute__(param)
+        return context.get(var, '')
+
+    def render(self, context: dict, nodes: list) -> str:
+        parts = []
+        for node in nodes:
+            if node.__class__ is str:
+                parts.append(node)
+            elif node[0] == 'var':
+                value = context.get(node[1], '')
+                parts.append(str(value.__getattribute__(node[2]) if node[2] else value))
+            elif node[0] == 'for':
+                parts.append(self.render_for(context, node))
+            elif node[0] == 'if':
+                parts.append(self.render_if(context, node))
+            elif node[0] == 'static':
+                parts.append(self.static.url(node[1]) if self.static else node[1])
+            else:
+                parts.append(self.render_cache(context, node))
+        return ''.join(parts)
+
+    def render_for(self, context: dict, node: list) -> str:
+        _, _, variable, seq, body = node
+        seq = context.get(seq, [])
+        return ''.join(self.render({**context, variable: i}, body) for i in (seq() if callable(seq) else seq))
+
+    def render_if(self, context: dict, node: list) -> str:
+        _, _, left, right, if_true, if_false = node
+        return self.render(context, if_true if self.render(context, left) == self.render(context, right) else if_false)
+
+    def render_cache(self, context: dict, node: list) -> str:
+        _, name, key, ttl, tags, body = node
+        if self.cache is None:
+            return self.render(context, body)
+        key = tuple(str(self.get_var(context, var)) for var in key)
+        fragment = self.cache.get(name, key)
+        if fragment is None:
+            stamps = self.cache.get_stamps(tags or (name, ))
+            fragment = self.render(context, body)
+            self.cache.set(name, key, fragment, ttl, tags, stamps)
+        return fragment
 
-        for name in if_names:
-            pattern = self.get_if_pattern(name)
-            current_if = pattern.search(block)
-            left_variable = self.build_vars(context, current_if.group('left_variable'))
-            right_variable = self.build_vars(context, current_if.group('right_variable'))
-            result = bool(left_variable == right_variable)
-            build_if = current_if.group('if_true') if result else current_if.group('if_false')
-            block = re.sub(pattern, build_if, block)
+    def build(self, context: dict, template_name: str) -> str:
+        return self.render(context, self.get_nodes(template_name))
 
-        return block
 
-    def build_for(self, context: dict, block: str) -> str:
-        for_names = self.get_for_names(block)
+def get_engine(settings: dict) -> Engine:
+    assert settings.get('BASE_DIR')
+    assert settings.get('TEMPLATES_DIR_NAME')
+    assert settings.get('INCLUDES_DIR_NAME')
 
-        for name in for_names:
-            pattern = self.get_for_pattern(name)
-            current_for = pattern.search(block)
-            build_for = ''
-            for i in context.get(current_for.group('seq'), []):
-                build_if = self.build_if({**context, current_for.group('variable'): i}, current_for.group('content'))
-                build_for += self.build_vars({**context, current_for.group('variable'): i}, build_if)
-            block = re.sub(pattern, build_for, block)
+    cache = get_fragment_cache(settings) if settings.get('FRAGMENT_CACHE_ENABLED') else None
+    cache_dir = None
+    if settings.get('TEMPLATE_CACHE_DIR_NAME'):
+        cache_dir = os.path.join(settings.get('BASE_DIR'), settings.get('TEMPLATE_CACHE_DIR_NAME'))
+    return Engine(settings.get('BASE_DIR'), settings.get('TEMPLATES_DIR_NAME'), settings.get('INCLUDES_DIR_NAME'),
+                  cache, cache_dir, settings.get('TEMPLATE_AUTO_RELOAD', True), get_static_files(settings),
+                  settings.get('TEMPLATE_MINIFY', False))
 
-        return block
 
-    def build(self, context: dict, template_name: str) -> str:
-        template = self.get_template_as_string(template_name)
-        if self.check_base(template):
-            template = self.build_base(template)
-        template = self.build_includes(template)
-        template = self.build_for(context, template)
-        template = self.build_if(context, template)
-        return self.build_vars(context, template)
+def precompile_templates(settings: dict) -> dict:
+    engine = get_engine(settings)
+    stats = {'compiled': 0, 'cached': 0}
+    for template_name in engine.get_template_names():
+        stats['cached' if engine.compile(template_name) else 'compiled'] += 1
+    return stats
 
 
 def build_template(request: Request, context: dict, template_name: str) -> str:
-    assert request.settings.get('BASE_DIR')
-    assert request.settings.get('TEMPLATES_DIR_NAME')
-    assert request.settings.get('INCLUDES_DIR_NAME')
-
-    engine = Engine(request.settings.get('BASE_DIR'), request.settings.get('TEMPLATES_DIR_NAME'),
-                    request.settings.get('INCLUDES_DIR_NAME'))
-    return engine.build(context, template_name)
+    timings = Timings.get_current()
+    start = perf_counter()
+    engine = get_engine(request.settings)
+    body = engine.build(context, template_name)
+    duration = perf_counter() - start
+    RENDER_LATENCY.labels(template_name).observe(duration)
+    if timings:
+        timings.add_template(template_name, duration)
+    return body
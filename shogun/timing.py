@@ -0,0 +1,122 @@
+import os
+import json
+import random
+import cProfile
+import contextvars
+from time import perf_counter, time
+from shogun.log_writers import ConsoleWriter, FileWriter
+
+
+WRITERS = {'console': ConsoleWriter, 'file': FileWriter}
+
+
+class NullTimings:
+
+    def lap(self, name: str):
+        pass
+
+    def stop(self):
+        pass
+
+    def report(self, response):
+        pass
+
+
+class Timings:
+
+    current = contextvars.ContextVar('timings', default=None)
+
+    def __init__(self, method: str, path: str, settings: dict):
+        self.method = method
+        self.path = path
+        self.settings = settings
+        self.started = perf_counter()
+        self.last = self.started
+        self.finished = None
+        self.phases = {}
+        self.queries = {}
+        self.templates = {}
+        self.profiler = None
+
+    @classmethod
+    def start(cls, environ: dict, settings: dict):
+        if not settings.get('TIMING_ENABLED'):
+            return NullTimings()
+        timings = cls(environ['REQUEST_METHOD'], environ['PATH_INFO'], settings)
+        if random.random() < settings.get('PROFILE_SAMPLE_RATE', 0):
+            timings.profiler = cProfile.Profile()
+            timings.profiler.enable()
+        cls.set_current(timings)
+        return timings
+
+    @classmethod
+    def set_current(cls, timings):
+        cls.current.set(timings)
+
+    @classmethod
+    def get_current(cls):
+        return cls.current.get()
+
+    def add(self, name: str, duration: float):
+        self.phases[name] = self.phases.get(name, 0) + duration
+
+    def lap(self, name: str):
+        now = perf_counter()
+        self.add(name, now - self.last)
+        self.last = now
+
+    def split(self, name: str, duration: float):
+        self.add(name, duration)
+        self.last += duration
+
+    def add_query(self, mapper: str, duration: float):
+        count, total = self.queries.get(mapper, (0, 0))
+        self.queries[mapper] = (count + 1, total + duration)
+
+    def add_template(self, template_name: str, duration: float):
+        self.templates[template_name] = self.templates.get(template_name, 0) + duration
+
+    def stop(self):
+        self.finished = perf_counter()
+        if self.profiler:
+            self.profiler.disable()
+        self.set_current(None)
+
+    @property
+    def total(self) -> float:
+        return (self.finished or perf_counter()) - self.started
+
+    def get_server_timing(self) -> str:
+        metrics = [f'{name};dur={duration * 1000:.3f}' for name, duration in self.phases.items()]
+        for mapper, (count, duration) in self.queries.items():
+            metrics.append(f'sql;desc="{mapper} x{count}";dur={duration * 1000:.3f}')
+        for template_name, duration in self.templates.items():
+            metrics.append(f'tpl;desc="{template_name}";dur={duration * 1000:.3f}')
+        metrics.append(f'total;dur={self.total * 1000:.3f}')
+        return ', '.join(metrics)
+
+    def get_log_line(self, status_code: str) -> str:
+        return json.dumps({
+            'method': self.method,
+            'path': self.path,
+            'status': status_code.split(' ')[0],
+            'total_ms': round(self.total * 1000, 3),
+            'phases_ms': {name: round(duration * 1000, 3) for name, duration in self.phases.items()},
+            'sql': {mapper: {'count': count, 'ms': round(duration * 1000, 3)}
+                    for mapper, (count, duration) in self.queries.items()},
+            'templates_ms': {name: round(duration * 1000, 3) for name, duration in self.templates.items()},
+        })
+
+    def dump_profile(self):
+        profiles_dir = os.path.join(self.settings.get('BASE_DIR', ''), self.settings.get('PROFILE_DIR_NAME', 'profiles'))
+        os.makedirs(profiles_dir, exist_ok=True)
+        slug = self.path.strip('/').replace('/', '_') or 'index'
+        self.profiler.dump_stats(os.path.join(profiles_dir, f'{int(time() * 1000)}_{self.method}_{slug}.prof'))
+
+    def report(self, response):
+        response.update_headers({'Server-Timing': self.get_server_timing()})
+        writer = WRITERS.get(self.settings.get('TIMING_LOG_WRITER'))
+        if writer:
+            writer.write('timing', self.get_log_line(response.status_code))
+        if self.profiler:
+            self.dump_profile()
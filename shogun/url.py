@@ -1,5 +1,6 @@
-from dataclasses import dataclass
-from typing import Type
+import re
+from dataclasses import dataclass, field
+from typing import Type, Pattern
 from shogun.view import View
 
 
@@ -7,4 +8,10 @@ from shogun.view import View
 class Url:
     url: str
     view: Type[View]
+    pattern: Pattern = field(default=None, init=False, repr=False, compare=False)
+
+    def compile(self) -> Pattern:
+        if self.pattern is None:
+            self.pattern = re.compile(self.url)
+        return self.pattern
     
\ No newline at end of file
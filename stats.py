@@ -0,0 +1,168 @@
+import sys
+import json
+import heapq
+import argparse
+import threading
+from array import array
+from itertools import compress
+from collections import Counter
+from time import perf_counter
+from settings import STATS_TOP_DEFAULT
+from models import connect, TimedCursor
+from shogun.metrics import registry
+
+COURSE_TYPES = ('offline', 'online')
+USER_TYPES = ('student', 'teacher', 'admin')
+UNKNOWN_TYPE = 255
+
+COMPUTE_DURATION = registry.histogram('stats_compute_duration_seconds', 'Time spent scanning and aggregating stats')
+LOOKUPS = registry.counter('stats_cache_lookups_total', 'Enrolment stats cache lookups', ('result', ))
+
+
+def type_code(column: str, types: tuple) -> str:
+    cases = ' '.join(f"WHEN '{name}' THEN {code}" for code, name in enumerate(types))
+    return f'CASE {column} {cases} ELSE {UNKNOWN_TYPE} END'
+
+
+def scan(cursor, statement: str, typecodes: str) -> list:
+    cursor.execute(statement)
+    columns = list(zip(*cursor.fetchall())) or [()] * len(typecodes)
+    return [array(typecode, column) for typecode, column in zip(typecodes, columns)]
+
+
+def top_k(ids: array, values: array, k: int) -> list:
+    return [(ids[i], values[i]) for i in heapq.nlargest(k, range(len(values)), key=values.__getitem__)]
+
+
+def summary(values: array) -> dict:
+    if not values:
+        return {'count': 0, 'total': 0, 'mean': 0, 'median': 0, 'max': 0}
+    total = sum(values)
+    return {'count': len(values), 'total': total, 'mean': round(total / len(values), 2),
+            'median': sorted(values)[len(values) // 2], 'max': max(values)}
+
+
+class Columns:
+
+    def __init__(self, cursor):
+        self.category_ids, self.category_parents = scan(
+            cursor, 'SELECT id, IFNULL(category_id, 0) FROM categories', 'qq')
+        self.course_ids, self.course_categories, self.course_types, self.course_students = scan(
+            cursor, f"SELECT id, category_id, {type_code('type', COURSE_TYPES)}, student_count FROM courses", 'qqBI')
+        self.user_ids, self.user_types, self.user_courses = scan(
+            cursor, f"SELECT id, {type_code('type', USER_TYPES)}, course_count FROM users", 'qBI')
+
+    @staticmethod
+    def get_names(cursor, table_name: str, column: str, ids: list) -> dict:
+        if not ids:
+            return {}
+        cursor.execute(f"SELECT id, {column} FROM {table_name} WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        return dict(cursor.fetchall())
+
+    def subtree_courses(self) -> array:
+        direct = Counter(self.course_categories)
+        totals = array('q', map(direct.__getitem__, self.category_ids))
+        positions = {id_: index for index, id_ in enumerate(self.category_ids)}
+        parents = array('q', (positions.get(parent, -1) for parent in self.category_parents))
+        depths = array('I', bytes(4 * len(parents)))
+        for index in range(len(parents)):
+            path = []
+            while index >= 0 and not depths[index] and len(path) <= len(parents):
+                path.append(index)
+                index = parents[index]
+            depth = depths[index] if index >= 0 else 0
+            for i in reversed(path):
+                depth += 1
+                depths[i] = depth
+        for index in sorted(range(len(parents)), key=depths.__getitem__, reverse=True):
+            if parents[index] >= 0:
+                totals[parents[index]] += totals[index]
+        return totals
+
+    def report(self, cursor, top: int) -> dict:
+        teachers = list(map(USER_TYPES.index('teacher').__eq__, self.user_types))
+        teacher_ids = array('q', compress(self.user_ids, teachers))
+        teacher_load = array('I', compress(self.user_courses, teachers))
+        subtree = self.subtree_courses()
+        direct = Counter(self.course_categories)
+
+        top_courses = top_k(self.course_ids, self.course_students, top)
+        top_categories = top_k(self.category_ids, subtree, top)
+        top_teachers = top_k(teacher_ids, teacher_load, top)
+        course_names = self.get_names(cursor, 'courses', 'name', [id_ for id_, _ in top_courses])
+        category_names = self.get_names(cursor, 'categories', 'name', [id_ for id_, _ in top_categories])
+        usernames = self.get_names(cursor, 'users', 'username', [id_ for id_, _ in top_teachers])
+        return {
+            'totals': {
+                'categories': len(self.category_ids),
+                'courses': len(self.course_ids),
+                'users': {name: self.user_types.count(code) for code, name in enumerate(USER_TYPES)},
+                'enrolments': sum(self.user_courses),
+            },
+            'course_types': {name: self.course_types.count(code) for code, name in enumerate(COURSE_TYPES)},
+            'students_per_course': {
+                **summary(self.course_students),
+                'top': [{'id': id_, 'name': course_names.get(id_), 'students': count} for id_, count in top_courses],
+            },
+            'courses_per_category': {
+                'roots': sum(1 for parent in self.category_parents if not parent),
+                'top': [{'id': id_, 'name': category_names.get(id_), 'courses': direct[id_], 'subtree_courses': count}
+                        for id_, count in top_categories],
+            },
+            'teacher_load': {
+                **summary(teacher_load),
+                'top': [{'id': id_, 'username': usernames.get(id_), 'courses': count} for id_, count in top_teachers],
+            },
+        }
+
+
+class EnrolmentStats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.columns = None
+        self.reports = {}
+
+    def invalidate(self, changes: list = None):
+        with self.lock:
+            self.generation += 1
+            self.columns = None
+            self.reports = {}
+
+    def get_report(self, connection, top: int = STATS_TOP_DEFAULT) -> dict:
+        with self.lock:
+            generation = self.generation
+            columns = self.columns
+            report = self.reports.get(top)
+        if report is not None:
+            LOOKUPS.labels('hit').inc()
+            return report
+        LOOKUPS.labels('miss').inc()
+        start = perf_counter()
+        cursor = TimedCursor(connection, self.__class__.__name__)
+        columns = columns or Columns(cursor)
+        report = columns.report(cursor, top)
+        duration = perf_counter() - start
+        COMPUTE_DURATION.observe(duration)
+        report['computed_in_ms'] = round(duration * 1000, 2)
+        with self.lock:
+            if self.generation == generation:
+                self.columns = columns
+                self.reports[top] = report
+        return report
+
+
+enrolment_stats = EnrolmentStats()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print enrolment analytics as JSON')
+    parser.add_argument('--top', type=int, default=STATS_TOP_DEFAULT)
+    args = parser.parse_args(argv)
+    print(json.dumps(enrolment_stats.get_report(connect, args.top), indent=2, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
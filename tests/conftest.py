@@ -0,0 +1,78 @@
+import io
+import os
+import sys
+import json
+import sqlite3
+import tempfile
+from contextlib import closing
+from urllib.parse import urlencode
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='shogun-tests-'), 'db.sqlite')
+os.environ['SHOGUN_DB_PATH'] = DB_PATH
+sys.path.insert(0, BASE_DIR)
+
+import pytest
+import settings
+from db.create import create_schema
+
+with closing(sqlite3.connect(DB_PATH)) as schema_connection:
+    create_schema(schema_connection)
+
+from models import connect
+from db.unit_of_work import UnitOfWork, UnitOfWorkMiddleware
+from shogun.main import Shogun
+from shogun.cache import fragment_cache
+from shogun.middleware import middlewares
+from urls import urls
+
+TABLES = ('course_user', 'courses', 'users', 'categories')
+
+
+@pytest.fixture(autouse=True)
+def connection():
+    yield connect
+    UnitOfWork.get_current().rollback()
+    if connect.in_transaction:
+        connect.rollback()
+    for table in TABLES:
+        connect.execute(f'DELETE FROM {table}')
+    connect.execute('DELETE FROM sqlite_sequence')
+    connect.commit()
+    fragment_cache.clear()
+
+
+@pytest.fixture
+def unit_of_work(connection):
+    unit_of_work = UnitOfWork.get_current()
+    unit_of_work.begin(connection)
+    yield unit_of_work
+    unit_of_work.rollback()
+
+
+@pytest.fixture
+def app():
+    app_settings = {name: getattr(settings, name) for name in dir(settings) if name.isupper()}
+    return Shogun(urls=list(urls), settings=app_settings, middlewares=[*middlewares, UnitOfWorkMiddleware])
+
+
+@pytest.fixture
+def call(app):
+    def call(method: str, path: str, data=None):
+        if isinstance(data, (list, dict)) and path.startswith('/api/'):
+            body, content_type = json.dumps(data).encode(), 'application/json'
+        else:
+            body, content_type = urlencode(data or {}, doseq=True).encode(), 'application/x-www-form-urlencoded'
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+                   'SERVER_PORT': '8000', 'HTTP_HOST': 'localhost:8000', 'wsgi.url_scheme': 'http',
+                   'CONTENT_TYPE': content_type, 'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body)}
+        result = {}
+
+        def start_response(status, headers, exc_info=None):
+            result['status'] = status
+
+        chunks = app(environ, start_response)
+        body = b''.join(chunks)
+        getattr(chunks, 'close', lambda: None)()
+        return result['status'], body
+    return call
@@ -0,0 +1,94 @@
+import json
+import pytest
+from batch import BatchExecutor
+
+
+def post(call, operations):
+    status, body = call('POST', '/api/batch', operations)
+    return status, json.loads(body)
+
+
+def count(connection, table: str) -> int:
+    return connection.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+
+
+@pytest.fixture
+def category(connection):
+    category_id = connection.execute("INSERT INTO categories (name) VALUES ('root')").lastrowid
+    connection.commit()
+    return category_id
+
+
+@pytest.mark.parametrize('operations, index, error', [
+    ([{'op': 'rename', 'kind': 'user'}], 0, 'op must be one of'),
+    ([{'op': 'create', 'kind': 'user', 'type': 'student', 'username': 'a'}, {'op': 'create', 'kind': 'group'}],
+     1, 'kind must be one of'),
+    ([{'op': 'create', 'kind': 'user', 'type': 'guest', 'username': 'a'}], 0, "unknown user type 'guest'"),
+    ([{'op': 'create', 'kind': 'course', 'type': 'online', 'name': 'go', 'category': '$missing'}], 0,
+     "unknown reference '$missing'"),
+    ([{'op': 'create', 'kind': 'course', 'type': 'online', 'name': 'go', 'category': 424242}], 0,
+     'category 424242 does not exist'),
+    ([{'op': 'create', 'kind': 'user', 'type': 'student', 'username': 'a', 'ref': 'u'},
+      {'op': 'create', 'kind': 'course', 'type': 'online', 'name': 'go', 'category': '$u'}], 1,
+     "'$u' refers to a user, not a category"),
+])
+def test_invalid_batch_is_rejected_without_writes(call, connection, operations, index, error):
+    status, body = post(call, operations)
+    assert status == '400 Bad Request'
+    assert body['index'] == index
+    assert body['error'].startswith(error)
+    assert count(connection, 'users') == 0
+
+
+def test_body_must_be_an_array(call):
+    assert post(call, {'op': 'create'})[0] == '400 Bad Request'
+
+
+def test_references_resolve_to_created_ids(call, connection):
+    status, body = post(call, [
+        {'op': 'create', 'kind': 'category', 'name': 'root', 'ref': 'root'},
+        {'op': 'create', 'kind': 'category', 'name': 'child', 'parent': '$root', 'ref': 'child'},
+        {'op': 'create', 'kind': 'course', 'type': 'offline', 'name': 'go', 'address': 'main street',
+         'category': '$child', 'ref': 'course'},
+        {'op': 'create', 'kind': 'user', 'type': 'student', 'username': 'alice', 'ref': 'alice'},
+        {'op': 'enrol', 'course': '$course', 'user': '$alice', 'notification_method': 'sms'},
+    ])
+    assert status == '200 OK'
+    refs = body['refs']
+    assert [result.get('id') for result in body['results'][:4]] == \
+        [refs['root'], refs['child'], refs['course'], refs['alice']]
+    assert body['results'][4] == {'course_id': refs['course'], 'user_id': refs['alice'], 'status': 'enrolled'}
+    assert connection.execute('SELECT category_id FROM categories WHERE id=?', (refs['child'], )).fetchone() == \
+        (refs['root'], )
+    assert connection.execute('SELECT category_id, address FROM courses WHERE id=?', (refs['course'], )).fetchone() \
+        == (refs['child'], 'main street')
+    assert connection.execute('SELECT * FROM course_user').fetchall() == [(refs['course'], refs['alice'], 'sms')]
+
+
+def test_existing_enrolment_is_reported(call, connection, category):
+    course_id = connection.execute("INSERT INTO courses (name, category_id, type, platform) "
+                                   "VALUES ('go', ?, 'online', 'zoom')", (category, )).lastrowid
+    user_id = connection.execute("INSERT INTO users (username, type) VALUES ('alice', 'student')").lastrowid
+    connection.execute('INSERT INTO course_user (course_id, user_id) VALUES (?, ?)', (course_id, user_id))
+    connection.commit()
+    status, body = post(call, [{'op': 'enrol', 'course': course_id, 'user': user_id}])
+    assert status == '200 OK'
+    assert body['results'] == [{'course_id': course_id, 'user_id': user_id, 'status': 'exists'}]
+
+
+def test_conflict_rolls_back_the_whole_batch(call, connection, category, monkeypatch):
+    plan = BatchExecutor.plan
+
+    def plan_then_delete_category(executor, operations):
+        result = plan(executor, operations)
+        executor.connection.execute('DELETE FROM categories WHERE id=?', (category, ))
+        return result
+    monkeypatch.setattr(BatchExecutor, 'plan', plan_then_delete_category)
+
+    status, body = post(call, [
+        {'op': 'create', 'kind': 'user', 'type': 'student', 'username': 'alice'},
+        {'op': 'create', 'kind': 'course', 'type': 'online', 'name': 'go', 'platform': 'zoom', 'category': category},
+    ])
+    assert status == '409 Conflict'
+    assert 'FOREIGN KEY' in body['error']
+    assert (count(connection, 'users'), count(connection, 'courses'), count(connection, 'categories')) == (0, 0, 1)
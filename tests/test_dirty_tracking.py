@@ -0,0 +1,107 @@
+import pytest
+from models import Engine, Observer, CourseMapper, UserMapper, TimedCursor, UPDATES_SKIPPED
+
+
+class RecordingObserver(Observer):
+
+    def __init__(self, user=None):
+        super().__init__(user)
+        self.changes = []
+
+    def update(self, param, old, new):
+        self.changes.append((param, old, new))
+
+
+@pytest.fixture
+def updates(monkeypatch):
+    statements = []
+    executemany = TimedCursor.executemany
+
+    def record(cursor, statement, rows):
+        rows = list(rows)
+        if statement.startswith('UPDATE'):
+            statements.append((statement, [tuple(row) for row in rows]))
+        return executemany(cursor, statement, rows)
+    monkeypatch.setattr(TimedCursor, 'executemany', record)
+    return statements
+
+
+@pytest.fixture
+def course(unit_of_work, connection):
+    category = Engine.create_category('root')
+    category.mark_new()
+    unit_of_work.commit()
+    course = Engine.create_course('online', 'zoom', 'python', category)
+    course.mark_new()
+    unit_of_work.commit()
+    return CourseMapper(connection).find_by_id(course.id)
+
+
+def test_unchanged_object_is_skipped(unit_of_work, course, updates):
+    skipped = UPDATES_SKIPPED.labels('CourseMapper').value
+    course.mark_dirty()
+    unit_of_work.commit()
+    assert updates == []
+    assert UPDATES_SKIPPED.labels('CourseMapper').value == skipped + 1
+
+
+def test_only_changed_columns_are_written(unit_of_work, connection, course, updates):
+    course.platform = 'meet'
+    course.mark_dirty()
+    unit_of_work.commit()
+    assert updates == [('UPDATE courses SET platform=? WHERE id=?', [('meet', course.id)])]
+    assert connection.execute('SELECT name, platform FROM courses WHERE id=?', (course.id, )).fetchone() == \
+        ('python', 'meet')
+
+
+def test_snapshot_follows_written_changes(unit_of_work, course, updates):
+    course.name = 'go'
+    course.mark_dirty()
+    unit_of_work.commit()
+    course.mark_dirty()
+    unit_of_work.commit()
+    course.name = 'python'
+    course.mark_dirty()
+    unit_of_work.commit()
+    assert [rows for _, rows in updates] == [[('go', course.id)], [('python', course.id)]]
+
+
+def test_rebuilt_object_is_diffed_against_the_stored_row(unit_of_work, course, updates):
+    rebuilt = Engine.create_course('online', 'zoom', 'python', course.category)
+    rebuilt.id = course.id
+    rebuilt.mark_dirty()
+    unit_of_work.commit()
+    assert updates == []
+
+
+def test_same_column_sets_share_one_statement(unit_of_work, connection, updates):
+    users = [Engine.create_user('student', f'user{i}') for i in range(3)]
+    for user in users:
+        user.mark_new()
+    unit_of_work.commit()
+    users = UserMapper(connection).find_by_ids([user.id for user in users])
+    users[0].username = 'renamed'
+    users[1].username = 'renamed too'
+    users[2].type_ = 'teacher'
+    mapper = UserMapper(connection)
+    updated = mapper.update_many(users)
+    assert len(updated) == 3
+    assert sorted(updates) == [('UPDATE users SET type=? WHERE id=?', [('teacher', users[2].id)]),
+                               ('UPDATE users SET username=? WHERE id=?',
+                                [('renamed', users[0].id), ('renamed too', users[1].id)])]
+    assert connection.execute('SELECT username, type FROM users ORDER BY id').fetchall() == \
+        [('renamed', 'student'), ('renamed too', 'student'), ('user2', 'teacher')]
+
+
+def test_observers_see_real_changes_only(unit_of_work, connection, course):
+    observer = RecordingObserver()
+    course.attach(observer)
+    course.mark_dirty()
+    unit_of_work.end()
+    assert observer.changes == []
+
+    unit_of_work.begin(connection)
+    course.platform = 'meet'
+    course.mark_dirty()
+    unit_of_work.end()
+    assert observer.changes == [('platform', 'zoom', 'meet')]
@@ -0,0 +1,71 @@
+import pytest
+from models import Engine, Student, OnlineCourse, OfflineCourse, SQL_CHUNK_SIZE, CategoryMapper, CourseMapper, \
+    UserMapper, CourseUserMapper, CourseUser, MapperRegistry
+
+
+def test_round_trip(unit_of_work, connection):
+    root = Engine.create_category('root')
+    child = Engine.create_category('child', root)
+    course = Engine.create_course('online', 'zoom', 'python', child)
+    user = Engine.create_user('student', 'alice')
+    for obj in (root, child, course, user):
+        obj.mark_new()
+    unit_of_work.commit()
+    CourseUser(course.id, user.id, 'sms').mark_new()
+    unit_of_work.commit()
+
+    loaded = CategoryMapper(connection).find_by_id(child.id)
+    assert (loaded.name, loaded.category.id, loaded.category.name) == ('child', root.id, 'root')
+    loaded = CourseMapper(connection).find_by_id(course.id)
+    assert isinstance(loaded, OnlineCourse)
+    assert (loaded.name, loaded.platform, loaded.category.id, loaded.student_count) == ('python', 'zoom', child.id, 1)
+    assert loaded.users['students'] == [user.id]
+    loaded = UserMapper(connection).find_by_id(user.id)
+    assert isinstance(loaded, Student)
+    assert (loaded.username, loaded.courses) == ('alice', [course.id])
+    enrolment, = CourseUserMapper(connection).find_where('course_id=?', (course.id, ))
+    assert (enrolment.user_id, enrolment.notification_method) == (user.id, 'sms')
+
+
+def test_find_by_ids_is_chunked(unit_of_work, connection):
+    users = [Engine.create_user('student', f'user{i}') for i in range(SQL_CHUNK_SIZE * 2 + 1)]
+    for user in users:
+        user.mark_new()
+    unit_of_work.commit()
+    mapper = UserMapper(connection)
+    statements = []
+    execute = mapper.cursor.execute
+    mapper.cursor.execute = lambda *args: statements.append(args[0]) or execute(*args)
+
+    ids = [user.id for user in reversed(users)] + [0]
+    found = mapper.find_by_ids(ids)
+
+    assert [user.id for user in found] == ids[:-1]
+    assert [user.username for user in found[:2]] == [users[-1].username, users[-2].username]
+    assert len(statements) == 3
+
+
+def test_mapper_lookup_by_type():
+    assert MapperRegistry.get_mapper_type(OfflineCourse('street', 'name', None)) is CourseMapper
+    with pytest.raises(KeyError):
+        MapperRegistry.get_mapper_type(object())
+
+
+def test_course_type_switch_nulls_other_slots(unit_of_work, connection):
+    category = Engine.create_category('root')
+    category.mark_new()
+    unit_of_work.commit()
+    course = Engine.create_course('online', 'zoom', 'python', category)
+    course.mark_new()
+    unit_of_work.commit()
+
+    switched = Engine.create_course('offline', 'main street', 'python', category)
+    switched.id = course.id
+    switched.mark_dirty()
+    unit_of_work.commit()
+
+    row = connection.execute('SELECT type, address, platform FROM courses WHERE id=?', (course.id, )).fetchone()
+    assert row == ('offline', 'main street', None)
+    loaded = CourseMapper(connection).find_by_id(course.id)
+    assert isinstance(loaded, OfflineCourse)
+    assert not hasattr(loaded, 'platform')
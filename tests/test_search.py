@@ -0,0 +1,27 @@
+import pytest
+from search import Searcher
+
+
+@pytest.fixture
+def courses(connection):
+    category_id = connection.execute("INSERT INTO categories (name) VALUES ('root')").lastrowid
+    connection.executemany("INSERT INTO courses (name, category_id, type, platform) VALUES (?, ?, 'online', 'zoom')",
+                           [(f'python for beginners part {i}', category_id) for i in range(1500)])
+    exact_id = connection.execute("INSERT INTO courses (name, category_id, type, platform) "
+                                  "VALUES ('python', ?, 'online', 'zoom')", (category_id, )).lastrowid
+    connection.commit()
+    return exact_id
+
+
+def test_best_match_ranks_first_among_many(connection, courses):
+    result = Searcher(connection, per_page=10, max_candidates=1000).search('courses', 'python')
+    assert result.items[0].id == courses
+    assert result.has_next
+
+
+def test_paging_stops_at_the_candidate_cap(connection, courses):
+    searcher = Searcher(connection, per_page=10, max_candidates=1000)
+    last = searcher.search('courses', 'python', 100)
+    assert len(last.items) == 10
+    assert not last.has_next
+    assert searcher.search('courses', 'python', 101).items == []
@@ -0,0 +1,140 @@
+import json
+import sqlite3
+import pytest
+from contextlib import closing
+from bulk import BulkEnroller
+from models import Engine, MapperRegistry, CourseUserMapper
+from db.unit_of_work import UnitOfWork, COMMIT_LATENCY
+from shogun.url import Url
+from shogun.view import View
+from settings import DB_PATH
+
+
+class EnrolThenFail(View):
+
+    def post(self, request, *args, **kwargs):
+        BulkEnroller(MapperRegistry.get_connection()).enrol([int(request.POST['course_id'][0])],
+                                                            [int(request.POST['user_id'][0])])
+        Engine.create_user('student', 'leaked').mark_new()
+        raise RuntimeError('view failed')
+
+
+def commits() -> int:
+    return sum(COMMIT_LATENCY.labels().counts)
+
+
+def query(statement: str) -> list:
+    with closing(sqlite3.connect(DB_PATH)) as connection:
+        return connection.execute(statement).fetchall()
+
+
+def count(table: str) -> int:
+    return query(f'SELECT COUNT(*) FROM {table}')[0][0]
+
+
+@pytest.fixture
+def ids(connection):
+    category_id = connection.execute("INSERT INTO categories (name) VALUES ('root')").lastrowid
+    course_ids = [connection.execute("INSERT INTO courses (name, category_id, type, platform) "
+                                     "VALUES (?, ?, 'online', 'zoom')", (name, category_id)).lastrowid
+                  for name in ('go', 'python')]
+    user_ids = [connection.execute("INSERT INTO users (username, type) VALUES (?, 'student')", (name, )).lastrowid
+                for name in ('alice', 'bob')]
+    connection.commit()
+    return course_ids, user_ids
+
+
+def test_request_commits_once(call, ids):
+    course_ids, user_ids = ids
+    before = commits()
+    status, _ = call('POST', '/api/enrolments', {'course_ids': course_ids, 'user_ids': user_ids})
+    assert status == '200 OK'
+    assert commits() == before + 1
+    assert count('course_user') == 4
+
+    status, _ = call('POST', '/users/create', {'username': 'carol', 'type': 'teacher'})
+    assert status == '200 OK'
+    assert commits() == before + 2
+
+
+def test_exception_rolls_back_the_request(app, call, ids):
+    course_ids, user_ids = ids
+    app.urls.insert(0, Url('^fail$', EnrolThenFail))
+    app.compile_routes()
+    before = commits()
+    with pytest.raises(RuntimeError):
+        call('POST', '/fail', {'course_id': course_ids[0], 'user_id': user_ids[0]})
+    assert commits() == before
+    assert (count('course_user'), count('users')) == (0, 2)
+
+    status, _ = call('POST', '/users/create', {'username': 'carol', 'type': 'teacher'})
+    assert status == '200 OK'
+    assert query('SELECT username FROM users ORDER BY id') == [('alice', ), ('bob', ), ('carol', )]
+
+
+def test_enrolment_waits_for_the_unit_of_work(unit_of_work, connection, ids):
+    course_ids, user_ids = ids
+    results = BulkEnroller(connection).enrol(course_ids, user_ids)
+    assert [result['status'] for result in results] == ['enrolled'] * 4
+    assert count('course_user') == 0
+    unit_of_work.end()
+    assert count('course_user') == 4
+
+
+def test_enrolment_without_unit_of_work_commits_itself(connection, ids):
+    course_ids, user_ids = ids
+    assert UnitOfWork.get_active() is None
+    BulkEnroller(connection).enrol(course_ids, user_ids[:1])
+    assert count('course_user') == 2
+
+
+def test_savepoint_rolls_back_inner_work_only(unit_of_work):
+    Engine.create_user('student', 'outer').mark_new()
+    with unit_of_work.savepoint():
+        Engine.create_user('student', 'kept').mark_new()
+    with pytest.raises(RuntimeError):
+        with unit_of_work.savepoint():
+            Engine.create_user('student', 'inner').mark_new()
+            unit_of_work.commit()
+            with unit_of_work.savepoint():
+                Engine.create_user('student', 'nested').mark_new()
+            raise RuntimeError('sub-operation failed')
+    unit_of_work.end()
+    assert query('SELECT username FROM users ORDER BY id') == [('outer', ), ('kept', )]
+
+
+@pytest.fixture
+def hidden_pair(connection, ids, monkeypatch):
+    course_ids, user_ids = ids
+    connection.execute("INSERT INTO course_user (course_id, user_id) VALUES (?, ?)", (course_ids[0], user_ids[0]))
+    connection.commit()
+    monkeypatch.setattr(CourseUserMapper, 'find_pairs', lambda mapper, course_ids, user_ids: set())
+    return course_ids[0], user_ids[0]
+
+
+def test_pair_enrolled_concurrently_is_reported_as_existing(call, ids, hidden_pair):
+    course_ids, user_ids = ids
+    status, body = call('POST', '/api/enrolments', {'course_ids': course_ids[:1], 'user_ids': user_ids})
+    assert status == '200 OK'
+    assert [result['status'] for result in json.loads(body)['results']] == ['exists', 'enrolled']
+    assert count('course_user') == 2
+
+    status, body = call('POST', '/api/batch', [{'op': 'enrol', 'course': course_ids[0], 'user': user_ids[0]}])
+    assert status == '200 OK'
+    assert json.loads(body)['results'][0]['status'] == 'exists'
+
+    status, _ = call('POST', '/users/courses', {'course_id': course_ids[0], 'user_id': user_ids[0]})
+    assert status == '200 OK'
+    assert count('course_user') == 2
+
+
+def test_enrolment_without_unit_of_work_publishes_real_inserts_only(connection, ids, hidden_pair, monkeypatch):
+    course_ids, user_ids = ids
+    published = []
+    monkeypatch.setattr(UnitOfWork, 'listeners', [published.extend])
+    results = BulkEnroller(connection).enrol(course_ids[:1], user_ids, 'sms')
+    assert [result['status'] for result in results] == ['exists', 'enrolled']
+    assert [(operation, table, obj.user_id) for operation, table, obj in published] == \
+        [('insert', 'course_user', user_ids[1])]
+    assert query('SELECT user_id, notification_method FROM course_user ORDER BY user_id') == \
+        [(user_ids[0], 'email'), (user_ids[1], 'sms')]
@@ -1,4 +1,6 @@
 from shogun.url import Url
+from shogun.metrics import MetricsView
+from shogun.static import StaticView
 from views import *
 
 urls = [
@@ -14,5 +16,16 @@ urls = [
     Url('^users/edit$', UserEdit),
     Url('^users/delete', UserDelete),
     Url('^users/courses$', UserCourses),
-    Url('^api/courses$', APICourses)
+    Url('^search$', SearchPage),
+    Url('^api/courses$', APICourses),
+    Url('^api/search$', APISearch),
+    Url('^api/enrolments$', BulkEnrol),
+    Url('^api/batch$', APIBatch),
+    Url('^api/stats$', APIStats),
+    Url('^api/catalog/verify$', APICatalogVerify),
+    Url('^api/changes$', APIChanges),
+    Url('^api/import$', BulkImport),
+    Url('^api/export$', BulkExport),
+    Url('^metrics$', MetricsView),
+    Url('^static/', StaticView)
 ]
@@ -1,28 +1,59 @@
 from shogun.view import View
 from shogun.request import Request
-from shogun.response import Response
+from shogun.response import Response, StreamingResponse
+from shogun.asgi import current_executor
 from shogun.template_engine import build_template
+from shogun.cache import SharedCache, fragment_cache
 from shogun.log_writers import ConsoleWriter, FileWriter
-from models import MapperRegistry, Engine, Logger, JSONSerializer
-from db.unit_of_work import UnitOfWork
+from models import MapperRegistry, Engine, Logger, JSONSerializer, CourseUser
+from db.unit_of_work import UnitOfWork, UnitOfWorkMiddleware
+from bulk import BulkImporter, BulkEnroller, FORMATS, COLUMNS, iter_lines, iter_records, export_rows, guess_format
+from search import Searcher, KINDS, get_terms
+from batch import BatchExecutor, BatchError
+from catalog import Catalog, get_reader
+from stats import enrolment_stats
+from feed import change_feed
+from urllib.parse import quote_plus
+import json
+import sqlite3
 
 
-UnitOfWork().new_current()
-UnitOfWork.get_current().set_registry(MapperRegistry)
+def init_unit_of_work():
+    UnitOfWork().new_current()
+    UnitOfWork.get_current().set_registry(MapperRegistry)
+
+
+def iter_with_connection(settings: dict, produce):
+    with UnitOfWorkMiddleware.get_pool(settings).connection() as connection:
+        yield from produce(connection)
+
+
+def invalidate_fragments(changes: list):
+    (SharedCache.current or fragment_cache).invalidate(*{table_name for _, table_name, _ in changes})
+
+
+init_unit_of_work()
+UnitOfWork.add_listener(invalidate_fragments)
+UnitOfWork.add_listener(enrolment_stats.invalidate)
+UnitOfWork.add_listener(change_feed.publish)
+SharedCache.add_listener(enrolment_stats.invalidate)
+SharedCache.add_listener(change_feed.reset)
 engine = Engine()
 course_logger = Logger('course logger', FileWriter)
 category_logger = Logger('category logger', ConsoleWriter)
 user_logger = Logger('user logger', FileWriter)
+batch_logger = Logger('batch logger', FileWriter)
 
 
 class Index(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        body = build_template(request, {'categories': MapperRegistry.get_mapper_by_name('category').all(),
-                                        'courses': MapperRegistry.get_mapper_by_name('course').all(),
-                                        'students': MapperRegistry.get_mapper_by_name('user').find_by_type('student'),
-                                        'teachers': MapperRegistry.get_mapper_by_name('user').find_by_type('teacher'),
-                                        'admins': MapperRegistry.get_mapper_by_name('user').find_by_type('admin'),
+        user_reader = get_reader('user')
+        body = build_template(request, {'categories': get_reader('category').list_rows,
+                                        'courses': get_reader('course').list_rows,
+                                        'students': lambda: user_reader.list_rows('student'),
+                                        'teachers': lambda: user_reader.list_rows('teacher'),
+                                        'admins': lambda: user_reader.list_rows('admin'),
                                         'base_url': request.base_url,
                                         'session_id': request.session_id}, 'index.html')
         return Response(request, body=body)
@@ -31,7 +62,7 @@ class Index(View):
 class CategoryCreate(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        body = build_template(request, {'categories': MapperRegistry.get_mapper_by_name('category').all(),
+        body = build_template(request, {'categories': get_reader('category').list_rows(),
                                         'base_url': request.base_url, 'session_id': request.session_id},
                               'create_category.html')
         return Response(request, body=body)
@@ -52,8 +83,8 @@ class CategoryCreate(View):
 class CategoryEdit(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        category = MapperRegistry.get_mapper_by_name('category').find_by_id(int(request.GET.get('category_id')[0]))
-        categories = MapperRegistry.get_mapper_by_name('category').all()
+        category = get_reader('category').find_by_id(int(request.GET.get('category_id')[0]))
+        categories = get_reader('category').list_rows()
         categories = [cat for cat in categories if cat.id not in category.subcategories and cat.id != category.id]
         body = build_template(request, {'category': category,
                                         'categories': categories,
@@ -65,11 +96,11 @@ class CategoryEdit(View):
         name = request.POST.get('name')[0]
         category_id = int(request.POST.get('category_id')[0])
         parent_category_id = int(request.POST.get('parent_category_id')[0])
-        category = MapperRegistry.get_mapper_by_name('category').\
-            find_by_id(parent_category_id) if parent_category_id >= 0 else None
-        new_category = engine.create_category(name, category)
-        new_category.id = category_id
-        new_category.mark_dirty()
+        mapper = MapperRegistry.get_mapper_by_name('category')
+        category = mapper.find_by_id(category_id)
+        category.name = name
+        category.category = mapper.find_by_id(parent_category_id) if parent_category_id >= 0 else None
+        category.mark_dirty()
         UnitOfWork.get_current().commit()
         category_logger.log(f'{name} is edited')
         body = build_template(request, {'type': 'category', 'name': name, 'action': 'edited',
@@ -92,7 +123,7 @@ class CategoryDelete(View):
 class CourseCreate(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        body = build_template(request, {'categories': MapperRegistry.get_mapper_by_name('category').all(),
+        body = build_template(request, {'categories': get_reader('category').list_rows(),
                                         'types': engine.get_courses_types(),
                                         'base_url': request.base_url, 'session_id': request.session_id},
                               'create_course.html')
@@ -121,9 +152,9 @@ class CourseCreate(View):
 class CourseEdit(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        course = MapperRegistry.get_mapper_by_name('course').find_by_id(int(request.GET.get('course_id')[0]))
+        course = get_reader('course').find_by_id(int(request.GET.get('course_id')[0]))
         body = build_template(request, {'course': course,
-                                        'categories': MapperRegistry.get_mapper_by_name('category').all(),
+                                        'categories': get_reader('category').list_rows(),
                                         'types': engine.get_courses_types(), 'base_url': request.base_url,
                                         'session_id': request.session_id}, 'edit_course.html')
         return Response(request, body=body)
@@ -142,6 +173,7 @@ class CourseEdit(View):
         category = MapperRegistry.get_mapper_by_name('category').find_by_id(int(request.POST.get('category_id')[0]))
         course = engine.create_course(type_, *params, name, category)
         course.id = id_
+        MapperRegistry.get_mapper_by_name('course').attach_observers(course)
         course.mark_dirty()
         UnitOfWork.get_current().commit()
         course_logger.log(f'{name} is edited')
@@ -153,7 +185,7 @@ class CourseEdit(View):
 class CourseCopy(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        course = MapperRegistry.get_mapper_by_name('course').find_by_id(int(request.GET.get('course_id')[0]))
+        course = get_reader('course').find_by_id(int(request.GET.get('course_id')[0]))
         body = build_template(request, {'course': course, 'base_url': request.base_url,
                                         'session_id': request.session_id}, 'copy_course.html')
         return Response(request, body=body)
@@ -206,7 +238,7 @@ class UserCreate(View):
 class UserEdit(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        user = MapperRegistry.get_mapper_by_name('user').find_by_id(int(request.GET.get('user_id')[0]))
+        user = get_reader('user').find_by_id(int(request.GET.get('user_id')[0]))
         body = build_template(request, {'user': user, 'types': engine.get_users_types(), 'base_url': request.base_url,
                                         'session_id': request.session_id}, 'edit_user.html')
         return Response(request, body=body)
@@ -240,8 +272,9 @@ class UserDelete(View):
 class UserCourses(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        user = MapperRegistry.get_mapper_by_name('user').find_by_id(int(request.GET.get('user_id')[0]))
-        courses = [i for i in MapperRegistry.get_mapper_by_name('course').all() if i.id not in user.courses]
+        user = get_reader('user').find_by_id(int(request.GET.get('user_id')[0]))
+        enrolled = set(user.courses)
+        courses = [i for i in get_reader('course').list_rows() if i.id not in enrolled]
         body = build_template(request, {'user': user, 'courses': courses, 'base_url': request.base_url,
                                         'session_id': request.session_id}, 'user_course.html')
         return Response(request, body=body)
@@ -249,12 +282,12 @@ class UserCourses(View):
     def post(self, request: Request, *args, **kwargs) -> Response:
         course_id = int(request.POST.get('course_id')[0])
         user_id = int(request.POST.get('user_id')[0])
+        notification_method = 'sms' if request.POST.get('notification_method', [''])[0].lower() == 'sms' else 'email'
         user = MapperRegistry.get_mapper_by_name('user').find_by_id(user_id)
         course = MapperRegistry.get_mapper_by_name('course').find_by_id(course_id)
-        course_user = engine.create_course_user(course_id, user_id)
-        course_user.mark_new()
+        BulkEnroller(MapperRegistry.get_connection()).enrol([course_id], [user_id], notification_method)
         UnitOfWork.get_current().commit()
-        course.add_observer(user, request.POST.get('notification_method')[0])
+        course.add_observer(user, notification_method)
         user_logger.log(f'{user.username} is added to course {course.name}')
         body = build_template(request, {'type': 'user', 'name': user.username,
                                         'action': f'added to course {course.name}',
@@ -262,8 +295,200 @@ class UserCourses(View):
         return Response(request, body=body)
 
 
+def get_enrolment_params(request: Request):
+    if request.environ.get('CONTENT_TYPE', '').startswith('application/json'):
+        data = json.loads(request.stream.read(request.content_length) or b'{}')
+        return data.get('course_ids', []), data.get('user_ids', []), data.get('notification_method', 'email')
+    return request.POST.get('course_id', []), request.POST.get('user_id', []), \
+        request.POST.get('notification_method', ['email'])[0]
+
+
+class BulkEnrol(View):
+
+    def post(self, request: Request, *args, **kwargs) -> Response:
+        try:
+            course_ids, user_ids, notification_method = get_enrolment_params(request)
+            course_ids = [int(i) for i in course_ids]
+            user_ids = [int(i) for i in user_ids]
+        except (ValueError, TypeError, AttributeError):
+            return Response(request, '400 Bad Request', body='course_ids and user_ids must be lists of integers')
+        if notification_method not in CourseUser.notification_methods:
+            return Response(request, '400 Bad Request',
+                            body=f'notification_method must be one of {", ".join(CourseUser.notification_methods)}')
+        if len(course_ids) * len(user_ids) > request.settings.get('BULK_ENROL_MAX_PAIRS', 100000):
+            return Response(request, '413 Payload Too Large', body='too many course/user pairs in one request')
+
+        unit_of_work = UnitOfWork.get_current()
+        enroller = BulkEnroller(MapperRegistry.get_connection())
+        try:
+            with unit_of_work.savepoint():
+                results = enroller.enrol(course_ids, user_ids, notification_method)
+            unit_of_work.commit(wait=True)
+        except sqlite3.IntegrityError as e:
+            return Response(request, '409 Conflict', {'Content-Type': 'application/json'},
+                            json.dumps({'error': str(e)}))
+        enroller.settle()
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        if summary.get('enrolled'):
+            courses = {result['course_id'] for result in results if result['status'] == 'enrolled'}
+            user_logger.log(f'{summary["enrolled"]} enrolments added to {len(courses)} courses')
+        body = json.dumps({'summary': summary, 'results': results})
+        return Response(request, headers={'Content-Type': 'application/json'}, body=body)
+
+
+class APIBatch(View):
+
+    def post(self, request: Request, *args, **kwargs) -> Response:
+        headers = {'Content-Type': 'application/json'}
+        try:
+            operations = json.loads(request.stream.read(request.content_length) or b'[]')
+        except ValueError:
+            return Response(request, '400 Bad Request', headers, json.dumps({'error': 'body must be JSON'}))
+        if not isinstance(operations, list):
+            return Response(request, '400 Bad Request', headers,
+                            json.dumps({'error': 'body must be an array of operations'}))
+        if len(operations) > request.settings.get('BATCH_MAX_OPERATIONS', 1000):
+            return Response(request, '413 Payload Too Large', headers,
+                            json.dumps({'error': 'too many operations in one batch'}))
+
+        executor = BatchExecutor(MapperRegistry.get_connection())
+        unit_of_work = UnitOfWork.get_current()
+        try:
+            with unit_of_work.savepoint():
+                plan = executor.plan(operations)
+                executor.apply(plan)
+            unit_of_work.commit(wait=True)
+        except BatchError as e:
+            return Response(request, '400 Bad Request', headers, json.dumps({'error': str(e), 'index': e.index}))
+        except sqlite3.IntegrityError as e:
+            return Response(request, '409 Conflict', headers, json.dumps({'error': str(e)}))
+        batch_logger.log(f'{len(operations)} operations applied in one batch')
+        return Response(request, headers=headers, body=json.dumps(executor.get_results(plan)))
+
+
 class APICourses(View):
 
     def get(self, request: Request, *args, **kwargs) -> Response:
-        body = JSONSerializer(MapperRegistry.get_mapper_by_name('course').all()).get_json()
+        rows = get_reader('course').list_rows()
+        body = JSONSerializer([row._asdict() for row in rows]).get_json()
         return Response(request, body=body)
+
+
+class APIStats(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        try:
+            top = int(request.GET.get('top', [request.settings.get('STATS_TOP_DEFAULT', 10)])[0])
+        except ValueError:
+            return Response(request, '400 Bad Request', body='top must be an integer')
+        if not 0 < top <= request.settings.get('STATS_TOP_MAX', 100):
+            return Response(request, '400 Bad Request',
+                            body=f'top must be between 1 and {request.settings.get("STATS_TOP_MAX", 100)}')
+        body = json.dumps(enrolment_stats.get_report(MapperRegistry.get_connection(), top))
+        return Response(request, headers={'Content-Type': 'application/json'}, body=body)
+
+
+class APICatalogVerify(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        catalog = Catalog.get_current()
+        if catalog is None:
+            return Response(request, '404 Not Found', body='catalog is disabled')
+        drift = catalog.verify(MapperRegistry.get_connection())
+        body = json.dumps({'consistent': not drift, 'drift': drift})
+        return Response(request, '200 OK' if not drift else '409 Conflict', {'Content-Type': 'application/json'}, body)
+
+
+class APIChanges(View):
+
+    async def get(self, request: Request, *args, **kwargs) -> Response:
+        last_id = request.environ.get('HTTP_LAST_EVENT_ID') or request.GET.get('last_event_id', [None])[0]
+        try:
+            last_id = int(last_id) if last_id is not None else None
+        except ValueError:
+            return Response(request, '400 Bad Request', body='Last-Event-ID must be an integer')
+        headers = {'Content-Type': 'text/event-stream; charset=utf-8', 'Cache-Control': 'no-cache',
+                   'X-Accel-Buffering': 'no'}
+        retry = request.settings.get('CHANGE_FEED_RETRY', 3000)
+        if 'shogun.async' not in request.environ:
+            return Response(request, headers=headers, body=change_feed.poll(last_id, retry)[0])
+        return StreamingResponse(request, headers=headers, body=change_feed.stream(
+            last_id, request.settings.get('CHANGE_FEED_HEARTBEAT', 15.0), retry, current_executor.get()))
+
+
+class BulkImport(View):
+
+    def post(self, request: Request, *args, **kwargs) -> Response:
+        entity = request.GET.get('entity', [''])[0]
+        if entity not in COLUMNS:
+            return Response(request, '400 Bad Request', body=f'entity must be one of {", ".join(COLUMNS)}')
+        format_ = request.GET.get('format', [guess_format(request.environ.get('CONTENT_TYPE', ''))])[0]
+        records = iter_records(iter_lines(request.stream, request.content_length), format_)
+        body = iter_with_connection(request.settings, lambda connection: (
+            json.dumps(i) + '\n' for i in BulkImporter(connection).import_records(entity, records)))
+        return StreamingResponse(request, headers={'Content-Type': FORMATS['ndjson']}, body=body)
+
+
+class BulkExport(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        entity = request.GET.get('entity', [''])[0]
+        if entity not in COLUMNS:
+            return Response(request, '400 Bad Request', body=f'entity must be one of {", ".join(COLUMNS)}')
+        format_ = request.GET.get('format', ['csv'])[0]
+        if format_ not in FORMATS:
+            return Response(request, '400 Bad Request', body=f'format must be one of {", ".join(FORMATS)}')
+        return StreamingResponse(request, headers={'Content-Type': FORMATS[format_],
+                                                   'Content-Disposition': f'attachment; filename="{entity}.{format_}"'},
+                                 body=iter_with_connection(request.settings,
+                                                           lambda connection: export_rows(connection, entity, format_)))
+
+
+def get_search_params(request: Request):
+    query = ' '.join(get_terms(request.GET.get('q', [''])[0]))
+    try:
+        page = max(int(request.GET.get('page', ['1'])[0]), 1)
+    except ValueError:
+        page = 1
+    return query, page
+
+
+class SearchPage(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        query, page = get_search_params(request)
+        results = Searcher(MapperRegistry.get_connection()).search_all(query, page)
+        body = build_template(request, {'query': query, 'query_param': quote_plus(query), 'page': page,
+                                        'prev_page': page - 1, 'next_page': page + 1,
+                                        'has_prev': page > 1,
+                                        'has_next': any(i.has_next for i in results.values()),
+                                        'courses': results['courses'].items,
+                                        'categories': results['categories'].items,
+                                        'users': results['users'].items,
+                                        'base_url': request.base_url, 'session_id': request.session_id},
+                              'search.html')
+        return Response(request, body=body)
+
+
+class APISearch(View):
+
+    def get(self, request: Request, *args, **kwargs) -> Response:
+        query, page = get_search_params(request)
+        kind = request.GET.get('kind', [None])[0]
+        if kind is not None and kind not in KINDS:
+            return Response(request, '400 Bad Request', body=f'kind must be one of {", ".join(KINDS)}')
+        searcher = Searcher(MapperRegistry.get_connection())
+        results = {kind: searcher.search(kind, query, page)} if kind else searcher.search_all(query, page)
+        serializers = {
+            'courses': lambda i: {'id': i.id, 'name': i.name, 'type': i.type_, 'category': i.category_name,
+                                  'address': getattr(i, 'address', None), 'platform': getattr(i, 'platform', None)},
+            'categories': lambda i: {'id': i.id, 'name': i.name, 'parent': i.category.id if i.category else None},
+            'users': lambda i: {'id': i.id, 'username': i.username, 'type': i.type_},
+        }
+        body = json.dumps({'query': query, 'page': page,
+                           'results': {name: {'items': [serializers[name](i) for i in result.items],
+                                              'has_next': result.has_next}
+                                       for name, result in results.items()}}, ensure_ascii=False)
+        return Response(request, headers={'Content-Type': 'application/json'}, body=body)